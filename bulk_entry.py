@@ -0,0 +1,248 @@
+"""Пакетный ввод показаний одним сообщением
+
+Оператор вставляет строки вида "<№ п/п или Инв. №> <показание> [комментарий]"
+или "<номер> <комментарий>" без показания. Все строки разбираются сразу,
+проверяются теми же правилами, что и загруженный файл
+(MeterValidator.validate_file), принятые строки сохраняются в final_report,
+а пользователь получает одну сводку с принятыми строками и ошибками.
+"""
+import os
+import re
+import logging
+from datetime import datetime
+import pandas as pd
+from check import MeterValidator
+from report_storage import get_week_folder, store_frame
+from template_service import TEMPLATE_COLUMNS
+from notification_digest import MAX_MESSAGE_LENGTH
+
+logger = logging.getLogger(__name__)
+
+BULK_MAX_LINES = int(os.getenv('BULK_MAX_LINES', 500))
+
+# Комментарии, допустимые без показания; регистр при вводе не важен
+BULK_COMMENTS = ("В ремонте", "Не исправен счетчик", "Нет на локации", "Убыло")
+_COMMENTS_BY_LOWER = {comment.lower(): comment for comment in BULK_COMMENTS}
+
+# Ошибки validate_file начинаются с номера строки, а строки DataFrame
+# пронумерованы по строкам сообщения
+_ROW_ERROR = re.compile(r'^Строка (\d+):')
+
+BULK_HELP_TEXT = (
+    "Отправьте показания одним сообщением, по одной строке на счётчик:\n"
+    "<№ п/п или Инв. №> <показание> [комментарий]\n"
+    "Без показания можно указать только комментарий: "
+    + ", ".join(BULK_COMMENTS) + ".\n\n"
+    "Например:\n1 15230\n2 В ремонте\n104577 880,5"
+)
+
+
+def _equipment_key(value):
+    """Инв. № в виде строки, как его набирает пользователь"""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _parse_value(token):
+    try:
+        return float(token.replace(',', '.'))
+    except ValueError:
+        return None
+
+
+def _error_line(error):
+    match = _ROW_ERROR.match(error)
+    return int(match.group(1)) if match else 0
+
+
+def format_equipment_list(equipment):
+    """Нумерованный список оборудования сессии с последними показаниями"""
+    lines = []
+    for position, record in enumerate(equipment):
+        line = f"{position + 1}. {record['Гос. номер']} | Инв. № {_equipment_key(record['Инв. №'])} | {record['Счётчик']}"
+        last_reading = equipment.last_reading(position)
+        if last_reading and last_reading['reading'] is not None:
+            line += f" (посл.: {last_reading['reading']:g})"
+        lines.append(line)
+    return lines
+
+
+def split_message(lines, header=''):
+    """Разбиение строк на сообщения не длиннее лимита Telegram"""
+    messages = []
+    text = header
+    for line in lines:
+        if text and len(text) + len(line) + 1 > MAX_MESSAGE_LENGTH:
+            messages.append(text)
+            text = ''
+        text = f"{text}\n{line}" if text else line
+    if text:
+        messages.append(text)
+    return messages
+
+
+def parse_bulk_text(text, equipment):
+    """Разбор строк сообщения
+
+    Номер сначала ищется среди инв. номеров списка, затем как № п/п.
+    Возвращает словарь: 'rows' - {номер строки: (позиция, показание,
+    комментарий)}, 'errors' - ошибки разбора.
+    """
+    by_inv = {}
+    for position, record in enumerate(equipment):
+        by_inv.setdefault(_equipment_key(record['Инв. №']), []).append(position)
+
+    rows = {}
+    errors = []
+    seen = {}
+    lines = text.splitlines()
+    if len(lines) > BULK_MAX_LINES:
+        return {'rows': {}, 'errors': [f"Слишком много строк ({len(lines)}), максимум {BULK_MAX_LINES} за одно сообщение"]}
+
+    for line_no, line in enumerate(lines, start=1):
+        parts = line.strip().split(maxsplit=1)
+        if not parts:
+            continue
+        if len(parts) < 2:
+            errors.append(f"Строка {line_no}: не указаны показание или комментарий")
+            continue
+        key, rest = parts
+
+        positions = by_inv.get(key)
+        if positions and len(positions) > 1:
+            numbers = ', '.join(str(position + 1) for position in positions)
+            errors.append(f"Строка {line_no}: у Инв. № {key} несколько счётчиков, укажите № п/п ({numbers})")
+            continue
+        if positions:
+            position = positions[0]
+        elif key.isdigit() and 1 <= int(key) <= len(equipment):
+            position = int(key) - 1
+        else:
+            errors.append(f"Строка {line_no}: оборудование {key} не найдено в списке")
+            continue
+
+        if position in seen:
+            errors.append(f"Строка {line_no}: оборудование № {position + 1} уже указано в строке {seen[position]}")
+            continue
+
+        value_part = rest.split(maxsplit=1)
+        value = _parse_value(value_part[0])
+        if value is not None:
+            comment = value_part[1].strip() if len(value_part) > 1 else ''
+        else:
+            comment = _COMMENTS_BY_LOWER.get(rest.strip().lower())
+            if comment is None:
+                errors.append(
+                    f"Строка {line_no}: показание должно быть числом, без показания допустимы "
+                    f"комментарии: {', '.join(BULK_COMMENTS)}"
+                )
+                continue
+        # Комментарий статуса приводится к написанию, которое ожидает validate_file
+        comment = _COMMENTS_BY_LOWER.get(comment.lower(), comment)
+
+        seen[position] = line_no
+        rows[line_no] = (position, value, comment)
+
+    return {'rows': rows, 'errors': errors}
+
+
+def build_readings_frame(rows, equipment):
+    """DataFrame в колонках шаблона; индекс - номер строки сообщения минус один"""
+    data = []
+    for line_no, (position, value, comment) in rows.items():
+        record = equipment[position]
+        data.append({
+            '№ п/п': position + 1,
+            'Гос. номер': record['Гос. номер'],
+            'Инв. №': record['Инв. №'],
+            'Счётчик': record['Счётчик'],
+            'Показания': value,
+            'Комментарий': comment or None
+        })
+    return pd.DataFrame(data, columns=TEMPLATE_COLUMNS, index=[line_no - 1 for line_no in rows])
+
+
+def process_bulk_text(text, equipment, user_info, context=None):
+    """Разбор, проверка и сохранение пакета показаний
+
+    Строки с ошибками отбрасываются, остальные проверяются и сохраняются
+    вместе. Возвращает словарь с ключами 'accepted' (описания принятых
+    строк), 'errors', 'warnings' и 'saved'.
+    """
+    result = {'accepted': [], 'errors': [], 'warnings': [], 'saved': False}
+    try:
+        parsed = parse_bulk_text(text, equipment)
+        result['errors'].extend(parsed['errors'])
+        if not parsed['rows']:
+            if not result['errors']:
+                result['errors'].append("Сообщение не содержит строк с показаниями")
+            return result
+
+        readings_df = build_readings_frame(parsed['rows'], equipment)
+        validator = MeterValidator()
+        validation_result = validator.validate_file(readings_df, user_info, context)
+        result['warnings'].extend(validation_result.get('warnings', []))
+
+        rejected = set()
+        for error in validation_result.get('errors', []):
+            match = _ROW_ERROR.match(error)
+            if match is None:
+                # Ошибка не относится к строке - пакет не сохраняется
+                result['errors'].append(error)
+                return result
+            rejected.add(int(match.group(1)))
+            result['errors'].append(error)
+
+        df = validation_result.get('df', readings_df)
+        df = df[[index + 1 not in rejected for index in df.index]].copy()
+        if df.empty:
+            return result
+
+        now = datetime.now()
+        df['name'] = user_info['name']
+        df['location'] = user_info['location']
+        df['division'] = user_info['division']
+        df['tab_number'] = user_info['tab_number']
+        df['timestamp'] = now.strftime('%Y-%m-%d %H:%M:%S')
+
+        save_result = validator.save_to_final_report(df)
+        if save_result.get('status') != 'success':
+            result['errors'].append(f"Показания не сохранены: {save_result.get('message', 'Неизвестная ошибка')}")
+            return result
+
+        file_path = os.path.join(
+            get_week_folder(),
+            f"meters_{user_info['location']}_{user_info['division']}_{user_info['tab_number']}_{now.strftime('%Y%m%d_%H%M%S')}.xlsx"
+        )
+        store_frame(df, file_path)
+        result['saved'] = True
+
+        for _, row in df.iterrows():
+            shown = row['Комментарий'] if pd.isna(row['Показания']) else f"{row['Показания']:g}"
+            result['accepted'].append(f"{row['№ п/п']}. Инв. № {_equipment_key(row['Инв. №'])} {row['Счётчик']}: {shown}")
+        return result
+
+    except Exception as e:
+        logger.error(f"Ошибка пакетного ввода показаний: {e}")
+        result['errors'].append("Ошибка обработки показаний")
+        return result
+
+
+def format_summary(result):
+    """Сводка по пакету в виде списка сообщений"""
+    lines = []
+    errors = sorted(result['errors'], key=_error_line)
+    if result['accepted']:
+        lines.append(f"✅ Принято и сохранено: {len(result['accepted'])}")
+        lines.extend(result['accepted'])
+    if errors:
+        if lines:
+            lines.append('')
+        lines.append(f"❌ Ошибки ({len(errors)}):")
+        lines.extend(errors)
+    if result['warnings']:
+        lines.append('')
+        lines.append("⚠️ Предупреждения:")
+        lines.extend(result['warnings'])
+    return split_message(lines)
@@ -0,0 +1,100 @@
+"""Проверка chat_id администраторов через Telegram
+
+Сохраненные chat_id администраторов проверяются запросом get_chat не чаще
+раза в CHAT_RESOLVE_TTL секунд на сотрудника. Запросы к Telegram идут
+параллельно (не более CHAT_RESOLVE_WORKERS одновременно) и вне транзакций,
+а изменившиеся chat_id записываются в people одним пакетным UPDATE, поэтому
+утренние задания не держат блокировку SQLite на время сетевых вызовов.
+"""
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from db_utils import db_transaction
+from roster import roster
+from users_directory import ROLE_ADMIN
+
+logger = logging.getLogger(__name__)
+
+CHAT_RESOLVE_TTL = int(os.getenv('CHAT_RESOLVE_TTL', 24 * 3600))
+CHAT_RESOLVE_WORKERS = int(os.getenv('CHAT_RESOLVE_WORKERS', 8))
+
+
+class ChatResolver:
+    """Проверка и обновление chat_id с кэшем результатов на время TTL"""
+
+    def __init__(self, ttl=CHAT_RESOLVE_TTL, workers=CHAT_RESOLVE_WORKERS):
+        self.ttl = ttl
+        self.workers = workers
+        self._lock = threading.Lock()
+        # табельный номер -> (подтвержденный chat_id, время проверки)
+        self._checked = {}
+
+    def stale(self, people, now=None):
+        """Сотрудники с chat_id, не проверенным за последние ttl секунд"""
+        now = time.monotonic() if now is None else now
+        result = []
+        for person in people:
+            if not person.chat_id:
+                continue
+            checked = self._checked.get(person.tab_number)
+            if checked is None or checked[0] != person.chat_id or now - checked[1] >= self.ttl:
+                result.append(person)
+        return result
+
+    def refresh(self, bot, people=None, force=False):
+        """Проверка устаревших chat_id (по умолчанию администраторов); возвращает счетчики"""
+        if not self._lock.acquire(blocking=False):
+            logger.info("Проверка chat_id уже выполняется, повторный запуск пропущен")
+            return {'status': 'skipped'}
+        try:
+            people = roster.members(ROLE_ADMIN) if people is None else people
+            pending = [person for person in people if person.chat_id] if force else self.stale(people)
+            result = {
+                'status': 'success',
+                'checked': len(pending),
+                'fresh': sum(1 for person in people if person.chat_id) - len(pending),
+                'updated': 0,
+                'failed': 0
+            }
+            if not pending:
+                return result
+
+            updates = []
+            confirmed = {}
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(pending)),
+                                    thread_name_prefix='chat-resolve') as pool:
+                futures = {pool.submit(bot.get_chat, person.chat_id): person for person in pending}
+                for future in as_completed(futures):
+                    person = futures[future]
+                    try:
+                        chat = future.result()
+                    except Exception as e:
+                        # Не отмечаем как проверенный: попробуем при следующем запуске
+                        result['failed'] += 1
+                        logger.error(f"Не удалось проверить chat_id для {person.name}: {e}")
+                        continue
+                    confirmed[person.tab_number] = (chat.id, time.monotonic())
+                    if chat.id != person.chat_id:
+                        updates.append((chat.id, person.tab_number))
+                        logger.info(f"chat_id для {person.name} изменился: {person.chat_id} -> {chat.id}")
+
+            if updates:
+                # Все новые chat_id записываются одной транзакцией или не записываются вовсе
+                with db_transaction(immediate=True) as cursor:
+                    cursor.executemany('UPDATE people SET chat_id = ? WHERE tab_number = ?', updates)
+                roster.invalidate()
+            # Проверки запоминаются только после записи, иначе при ошибке они не повторятся
+            self._checked.update(confirmed)
+            result['updated'] = len(updates)
+            logger.info(
+                f"Проверка chat_id: проверено {result['checked']}, обновлено {result['updated']}, "
+                f"ошибок {result['failed']}, актуальных {result['fresh']}"
+            )
+            return result
+        finally:
+            self._lock.release()
+
+
+chat_resolver = ChatResolver()
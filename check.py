@@ -6,49 +6,57 @@ import logging
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, InputFile
 import os
 from db_utils import db_transaction
+from roster import roster
+from notification_digest import notify
+from report_storage import find_report_files, open_report_file, load_submission
+from template_service import equipment_templates
 
 logger = logging.getLogger(__name__)
 
-class MeterValidator:
-    """Класс для валидации показаний счетчиков"""
-    def __init__(self):
-        self.equipment_df = None
-        self.conn = sqlite3.connect('Users_bot.db', check_same_thread=False)
-        self.conn.execute("PRAGMA journal_mode=WAL")
-        self.conn.execute("PRAGMA synchronous=NORMAL")
-        self.cursor = self.conn.cursor()
-        self.load_equipment()
+# Сколько счетчиков запрашивается одним запросом (ограничение SQLite на число параметров)
+LAST_READINGS_CHUNK = 400
+
+
+def get_last_readings(keys):
+    """Последние показания для набора счетчиков одним запросом на пачку
+
+    keys - пары (инв. номер, тип счетчика). Возвращает словарь
+    {(инв. номер, тип счетчика): {'reading', 'reading_date'}} в том же
+    формате, что MeterValidator._get_last_reading; счетчиков без истории
+    в словаре нет.
+    """
+    keys = list(dict.fromkeys(keys))
+    result = {}
+    try:
+        with db_transaction() as cursor:
+            for start in range(0, len(keys), LAST_READINGS_CHUNK):
+                chunk = keys[start:start + LAST_READINGS_CHUNK]
+                values = ', '.join(['(?, ?)'] * len(chunk))
+                # Ключи берутся из VALUES, а не из таблицы, чтобы сохранить их исходные типы
+                cursor.execute(f'''
+                    WITH wanted(inv, meter) AS (VALUES {values})
+                    SELECT w.inv, w.meter, f.reading, MAX(f.date)
+                    FROM wanted w
+                    JOIN final_report f ON f.inv_number = w.inv AND f.meter_type = w.meter
+                    GROUP BY w.inv, w.meter
+                ''', [value for key in chunk for value in key])
+                for inv_num, meter_type, reading, reading_date in cursor.fetchall():
+                    result[(inv_num, meter_type)] = {
+                        'reading': float(reading) if reading is not None else None,
+                        'reading_date': reading_date
+                    }
+    except Exception as e:
+        logger.error(f"Ошибка получения последних показаний: {e}")
+    return result
 
-    def load_equipment(self):
-        """Загрузка справочника оборудования"""
-        try:
-            self.equipment_df = pd.read_excel('Equipment.xlsx')
-            # Приводим названия колонок к стандартному виду
-            self.equipment_df.columns = [col.strip() for col in self.equipment_df.columns]
-            logger.info("Справочник оборудования успешно загружен")
-        except Exception as e:
-            logger.error(f"Ошибка при загрузке справочника оборудования: {e}")
-            # Создаем пустой DataFrame с нужными колонками
-            self.equipment_df = pd.DataFrame(columns=[
-                'Локация', 'Подразделение', 'Гос. номер', 'Инв. №', 
-                'Счётчик', 'Тип счетчика'
-            ])
 
+class MeterValidator:
+    """Класс для валидации показаний счетчиков"""
     def _get_equipment_for_location_division(self, location, division):
         """Получение списка оборудования для локации и подразделения"""
         try:
-            if self.equipment_df is None or self.equipment_df.empty:
-                self.load_equipment()
-            
-            if self.equipment_df.empty:
-                logger.warning("Справочник оборудования пуст")
-                return pd.DataFrame()
-            
-            mask = (
-                (self.equipment_df['Локация'] == location) & 
-                (self.equipment_df['Подразделение'] == division)
-            )
-            result_df = self.equipment_df[mask].copy()
+            # Справочник оборудования хранится в памяти и обновляется при изменении файла
+            result_df = equipment_templates.get_equipment(location, division)
             
             if result_df.empty:
                 logger.warning(f"Не найдено оборудования для {location}, {division}")
@@ -73,7 +81,7 @@ class MeterValidator:
         """Получение последнего показания для данного счетчика из final_report"""
         try:
             with db_transaction() as cursor:
-                self.cursor.execute('''
+                cursor.execute('''
                     SELECT reading, date
                     FROM final_report
                     WHERE inv_number = ? AND meter_type = ?
@@ -81,7 +89,7 @@ class MeterValidator:
                     LIMIT 1
                 ''', (inv_num, meter_type))
             
-                result = self.cursor.fetchone()
+                result = cursor.fetchone()
             if result:
                 return {
                     'reading': float(result[0]) if result[0] is not None else None,
@@ -93,23 +101,12 @@ class MeterValidator:
             return None
         
     def _get_admins_for_division(self, division):
-        """Исправленная версия с использованием контекстного менеджера"""
+        """Администраторы подразделения (или все, если их нет) из кэша состава"""
         try:
-            with db_transaction() as cursor:
-                cursor.execute('''
-                    SELECT tab_number, name, chat_id FROM Users_admin_bot 
-                    WHERE division = ? AND chat_id IS NOT NULL
-                ''', (division,))
-                admins = cursor.fetchall()
-                
-                if not admins:
-                    cursor.execute('''
-                        SELECT tab_number, name, chat_id FROM Users_admin_bot 
-                        WHERE chat_id IS NOT NULL AND role = 'Администратор'
-                    ''')
-                    admins = cursor.fetchall()
-                
-                return admins
+            admins = roster.admins_for_division(division)
+            if not admins:
+                admins = roster.members('Администратор')
+            return [(admin.tab_number, admin.name, admin.chat_id) for admin in admins if admin.chat_id is not None]
         except Exception as e:
             logger.error(f"Ошибка при поиске администраторов: {str(e)}")
             return []
@@ -118,13 +115,13 @@ class MeterValidator:
         """Проверяет наличие активного запроса 'Убыло' для оборудования"""
         try:
             with db_transaction() as cursor:
-                self.cursor.execute('''
+                cursor.execute('''
                     SELECT 1 FROM pending_requests 
                     WHERE inv_num = ? AND meter_type = ? 
                     AND status = 'pending'
                     AND timestamp > datetime('now', '-5 days')
                 ''', (inv_num, meter_type))
-                return self.cursor.fetchone() is not None
+                return cursor.fetchone() is not None
         except Exception as e:
             logger.error(f"Ошибка проверки pending-статуса: {e}")
             return False
@@ -139,8 +136,8 @@ class MeterValidator:
             
             if not user_chat_id:
                 with db_transaction() as cursor:
-                    self.cursor.execute('SELECT chat_id FROM Users_user_bot WHERE tab_number = ?', (user_info['tab_number'],))
-                    result = self.cursor.fetchone()
+                    cursor.execute('SELECT chat_id FROM Users_user_bot WHERE tab_number = ?', (user_info['tab_number'],))
+                    result = cursor.fetchone()
                     user_chat_id = result[0] if result else None
             
             if not user_chat_id:
@@ -148,8 +145,8 @@ class MeterValidator:
                 return {'status': 'error', 'message': 'Не удалось определить chat_id пользователя'}
 
             # Сохраняем запрос в базу
-            with db_transaction() as cursor:
-                self.cursor.execute('''
+            with db_transaction(immediate=True) as cursor:
+                cursor.execute('''
                     INSERT INTO pending_requests (
                         request_id, inv_num, meter_type, user_tab, user_name, 
                         location, division, timestamp, status, user_chat_id
@@ -160,7 +157,6 @@ class MeterValidator:
                     user_info.get('location', ''), user_info.get('division', ''),
                     datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'pending', user_chat_id
                 ))
-                self.conn.commit()
 
             admins = self._get_admins_for_division(user_info.get('division', ''))
             if not admins:
@@ -173,23 +169,21 @@ class MeterValidator:
                     continue
                     
                 try:
-                    keyboard = [
-                        [InlineKeyboardButton("✅ Подтвердить", callback_data=f"confirm_ubylo_{request_id}")],
-                        [InlineKeyboardButton("❌ Отклонить", callback_data=f"reject_ubylo_{request_id}")]
-                    ]
-                    reply_markup = InlineKeyboardMarkup(keyboard)
-                    
-                    context.bot.send_message(
-                        chat_id=admin_chat_id,
-                        text=f"⚠️ Запрос на отметку 'Убыло'\n\n"
-                            f"Инв. №: {inv_num}\nСчётчик: {meter_type}\n"
-                            f"Пользователь: {user_info['name']}\n"
-                            f"Локация: {user_info.get('location', '')}\n"
-                            f"Подразделение: {user_info.get('division', '')}",
-                        reply_markup=reply_markup
+                    notify(
+                        context.bot,
+                        admin_chat_id,
+                        f"⚠️ Запрос на отметку 'Убыло'\n\n"
+                        f"Инв. №: {inv_num}\nСчётчик: {meter_type}\n"
+                        f"Пользователь: {user_info['name']}\n"
+                        f"Локация: {user_info.get('location', '')}\n"
+                        f"Подразделение: {user_info.get('division', '')}",
+                        buttons=[
+                            ("✅ Подтвердить", f"confirm_ubylo_{request_id}"),
+                            ("❌ Отклонить", f"reject_ubylo_{request_id}")
+                        ]
                     )
                     sent_to.add(admin_chat_id)
-                    logger.info(f"Уведомление отправлено администратору {admin_name} (chat_id: {admin_chat_id})")
+                    logger.info(f"Уведомление добавлено в сводку администратора {admin_name} (chat_id: {admin_chat_id})")
                 except Exception as e:
                     logger.error(f"Ошибка отправки уведомления администратору {admin_name}: {str(e)}")
 
@@ -198,8 +192,12 @@ class MeterValidator:
             logger.error(f"Ошибка в handle_ubylo_status: {str(e)}")
             return {'status': 'error', 'message': str(e)}
             
-    def validate_file(self, file_path, user_info, context=None):
-        """Улучшенная валидация файла с показаниями"""
+    def validate_file(self, file_path_or_df, user_info, context=None):
+        """Улучшенная валидация файла с показаниями
+
+        Принимает путь к файлу или уже прочитанный DataFrame; нормализованные
+        данные возвращаются в ключе 'df' для сохранения без повторного чтения.
+        """
         try:
             if not all(k in user_info for k in ['tab_number', 'name', 'location', 'division']):
                 return {
@@ -209,7 +207,11 @@ class MeterValidator:
                 }
                 
             # Чтение и проверка файла
-            readings_df = pd.read_excel(file_path).dropna(how='all')
+            if isinstance(file_path_or_df, pd.DataFrame):
+                readings_df = file_path_or_df.dropna(how='all')
+            else:
+                with open_report_file(file_path_or_df) as f:
+                    readings_df = pd.read_excel(f).dropna(how='all')
             
             # Проверка обязательных колонок
             required_columns = {
@@ -270,7 +272,7 @@ class MeterValidator:
                     
                     # Проверяем статус подтверждения
                     with db_transaction() as cursor:
-                        self.cursor.execute('''
+                        cursor.execute('''
                             SELECT status FROM pending_requests 
                             WHERE inv_num = ? AND meter_type = ?
                             AND timestamp > datetime('now', '-5 days')
@@ -278,7 +280,7 @@ class MeterValidator:
                             LIMIT 1
                         ''', (row['Инв. №'], row['Счётчик']))
                         
-                        result = self.cursor.fetchone()
+                        result = cursor.fetchone()
                     
                     if result:
                         status = result[0]
@@ -349,13 +351,15 @@ class MeterValidator:
                     'is_valid': False,
                     'errors': errors,
                     'warnings': warnings,
-                    'pending_ubylo_requests': pending_ubylo_requests
+                    'pending_ubylo_requests': pending_ubylo_requests,
+                    'df': readings_df
                 }
             
             return {
                 'is_valid': True,
                 'warnings': warnings,
-                'pending_ubylo_requests': pending_ubylo_requests
+                'pending_ubylo_requests': pending_ubylo_requests,
+                'df': readings_df
             }
                 
         except Exception as e:
@@ -368,28 +372,17 @@ class MeterValidator:
     def get_admin_for_division(self, division):
         """Получение ID администратора для данного подразделения"""
         try:
-            with db_transaction() as cursor:
-                # Проверяем наличие подразделения
-                if not division:
-                    return []
-                    
-                self.cursor.execute('''
-                    SELECT tab_number, name
-                    FROM Users_admin_bot
-                    WHERE division = ?
-                ''', (division,))
+            # Проверяем наличие подразделения
+            if not division:
+                return []
                 
-                admins = self.cursor.fetchall()
+            admins = roster.admins_for_division(division)
+            
+            # Если нет администраторов для подразделения, вернем всех администраторов
+            if not admins:
+                admins = roster.members('Администратор')
                 
-                # Если нет администраторов для подразделения, вернем всех администраторов
-                if not admins:
-                    self.cursor.execute('''
-                        SELECT tab_number, name
-                        FROM Users_admin_bot
-                    ''')
-                    admins = self.cursor.fetchall()
-                    
-                return admins
+            return [(admin.tab_number, admin.name) for admin in admins]
         except Exception as e:
             logger.error(f"Ошибка получения администратора для подразделения: {e}")
             return []
@@ -421,7 +414,7 @@ class MeterValidator:
                 }
                 
             # Сохраняем в базу данных
-            with db_transaction() as cursor:
+            with db_transaction(immediate=True) as cursor:
                 for _, row in df.iterrows():
                     cursor.execute('''
                         INSERT OR REPLACE INTO final_report (
@@ -451,7 +444,8 @@ class MeterValidator:
         """Сохранение данных из Excel в final_report с получением user_info из БД"""
         try:
             if isinstance(file_path_or_df, str):
-                df = pd.read_excel(file_path_or_df)
+                with open_report_file(file_path_or_df) as f:
+                    df = pd.read_excel(f)
             elif isinstance(file_path_or_df, pd.DataFrame):
                 df = file_path_or_df
             else:
@@ -517,7 +511,7 @@ class MeterValidator:
                         }
             
             # Сохраняем в базу данных
-            with db_transaction() as cursor:
+            with db_transaction(immediate=True) as cursor:
                 for _, row in df.iterrows():
                     cursor.execute('''
                         INSERT OR REPLACE INTO final_report (
@@ -560,13 +554,10 @@ class FinalReportGenerator:
             report_data = []
             week_number = os.path.basename(week_folder).replace('week_', '')
             
-            for filename in os.listdir(week_folder):
-                if not filename.endswith('.xlsx'):
-                    continue
-                    
+            for file_path in find_report_files(week=week_number):
+                filename = os.path.basename(file_path)
                 try:
-                    file_path = os.path.join(week_folder, filename)
-                    df = pd.read_excel(file_path)
+                    df = load_submission(file_path)
                     
                     # Проверяем наличие необходимых колонок
                     required_columns = ['Гос. номер', 'Инв. №', 'Счётчик', 'Показания', 'Комментарий']
@@ -611,6 +602,7 @@ class FinalReportGenerator:
                 return None
         
             # Также сохраняем в Excel (по желанию)
+            os.makedirs(week_folder, exist_ok=True)
             output_path = os.path.join(week_folder, f'final_report_{week_number}.xlsx')
             report_df.to_excel(output_path, index=False)
             
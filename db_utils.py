@@ -27,18 +27,42 @@ def get_db_connection():
     return _local.conn
 
 @contextmanager
-def db_transaction():
-    """Контекстный менеджер для управления транзакциями"""
+def db_transaction(immediate=False):
+    """Контекстный менеджер для управления транзакциями
+
+    Соединение открыто в режиме autocommit (isolation_level=None), поэтому
+    транзакция начинается явно: все запросы блока фиксируются или
+    откатываются вместе. По умолчанию BEGIN DEFERRED - чтение не берет
+    блокировку записи. Блоки, которые пишут, передают immediate=True
+    (BEGIN IMMEDIATE): блокировка берется сразу, и чтение перед записью
+    не упирается в SQLITE_BUSY. Вложенный блок в том же потоке выполняется
+    как SAVEPOINT внутри внешней транзакции.
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
+    depth = getattr(_local, 'depth', 0)
+    savepoint = f'sp_{depth}'
+    if depth:
+        cursor.execute(f'SAVEPOINT {savepoint}')
+    else:
+        cursor.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN DEFERRED')
+    _local.depth = depth + 1
     try:
         yield cursor
-        conn.commit()
+        if depth:
+            cursor.execute(f'RELEASE {savepoint}')
+        else:
+            cursor.execute('COMMIT')
     except Exception as e:
-        conn.rollback()
+        if depth:
+            cursor.execute(f'ROLLBACK TO {savepoint}')
+            cursor.execute(f'RELEASE {savepoint}')
+        elif conn.in_transaction:
+            cursor.execute('ROLLBACK')
         logger.error(f"Ошибка транзакции, выполнен откат: {e}")
         raise
     finally:
+        _local.depth = depth
         cursor.close()
 
 def close_db_connection():
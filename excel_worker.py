@@ -0,0 +1,12 @@
+"""Разбор Excel в процессах пула worker_pool
+
+Модуль намеренно не импортирует ничего из бота: процессы запускаются
+методом spawn и импортируют только то, что нужно для разбора файла.
+"""
+import io
+import pandas as pd
+
+
+def read_excel_bytes(data, kwargs):
+    """DataFrame из содержимого xlsx-файла"""
+    return pd.read_excel(io.BytesIO(data), **kwargs)
@@ -0,0 +1,297 @@
+"""Инкрементальный импорт выгрузок 1С
+
+Выгрузка источника (users, equipment, shifts) берется из файла xlsx, csv
+или json в каталоге IMPORT_DIR либо, если задан IMPORT_API_URL, из
+HTTP-сервиса, отдающего JSON-список записей по адресу <IMPORT_API_URL>/<источник>.
+
+Для каждой строки оборудования считается хэш содержимого и сравнивается с
+хэшами прошлого импорта (таблица import_rows). В таблицы бота одной
+транзакцией на источник попадают только новые, изменившиеся и исчезнувшие
+строки; результат каждого запуска записывается в import_journal. При
+первом импорте источника сравнение идет с текущим содержимым таблицы бота.
+
+Таблица equipment - справочник оборудования бота: шаблоны и проверки
+читают ее через template_service.equipment_templates. Сотрудники и табель
+пишутся тем же кодом, что и загрузка Users.xlsx и tabels.xlsx
+(user_sync.apply_sync, shifts_handler.write_intervals), и сравниваются с
+содержимым people и shift_intervals, а не с хэшами.
+"""
+import os
+import json
+import hashlib
+import logging
+import urllib.request
+from datetime import datetime
+from collections import namedtuple
+import pandas as pd
+from db_utils import db_transaction
+from template_service import DATA_DIR, equipment_templates
+from users_directory import build_users_index
+from shifts_handler import tabel_to_long, interval_rows, write_intervals
+from user_sync import apply_sync
+from shift_store import shift_store, build_intervals
+from roster import roster
+
+logger = logging.getLogger(__name__)
+
+IMPORT_DIR = os.getenv('IMPORT_DIR', DATA_DIR)
+IMPORT_API_URL = os.getenv('IMPORT_API_URL', '')
+IMPORT_API_TIMEOUT = int(os.getenv('IMPORT_API_TIMEOUT', 60))
+
+IMPORT_EXTENSIONS = ('.xlsx', '.xls', '.csv', '.json')
+
+# Разделитель частей ключа и полей при расчете хэша
+_SEPARATOR = '\x1f'
+
+# write(cursor, rows) - собственная запись источника вместо сравнения с хэшами
+# (baseline/apply не используются, import_rows не ведется); возвращает счетчики
+ImportSource = namedtuple(
+    'ImportSource',
+    ['name', 'file_stem', 'prepare', 'baseline', 'apply', 'after_commit', 'write'],
+    defaults=(None,)
+)
+
+
+def _text(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def row_hash(values):
+    """Хэш содержимого строки выгрузки"""
+    return hashlib.sha1(_SEPARATOR.join(_text(value) for value in values).encode('utf-8')).hexdigest()
+
+
+def read_export_file(path):
+    """DataFrame из файла выгрузки по расширению"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.xlsx', '.xls'):
+        return pd.read_excel(path)
+    if extension == '.csv':
+        # 1С выгружает CSV с ';' или ',' и часто с BOM
+        return pd.read_csv(path, sep=None, engine='python', encoding='utf-8-sig')
+    if extension == '.json':
+        with open(path, encoding='utf-8-sig') as f:
+            return pd.DataFrame(json.load(f))
+    raise ValueError(f"Неподдерживаемый формат выгрузки: {path}")
+
+
+def find_export_file(file_stem, directory=None):
+    """Самый свежий файл выгрузки с данным именем среди поддерживаемых форматов"""
+    directory = IMPORT_DIR if directory is None else directory
+    candidates = [
+        os.path.join(directory, file_stem + extension)
+        for extension in IMPORT_EXTENSIONS
+        if os.path.exists(os.path.join(directory, file_stem + extension))
+    ]
+    return max(candidates, key=os.path.getmtime) if candidates else None
+
+
+def fetch_export(source_name):
+    """Записи источника из HTTP-сервиса выгрузок"""
+    url = f"{IMPORT_API_URL.rstrip('/')}/{source_name}"
+    with urllib.request.urlopen(url, timeout=IMPORT_API_TIMEOUT) as response:
+        return pd.DataFrame(json.loads(response.read().decode('utf-8'))), url
+
+
+def load_export(source, path=None):
+    """Выгрузка источника и ее происхождение (путь или адрес); (None, None), если ее нет"""
+    if path is not None:
+        return read_export_file(path), path
+    if IMPORT_API_URL:
+        return fetch_export(source.name)
+    path = find_export_file(source.file_stem)
+    if path is None:
+        return None, None
+    return read_export_file(path), path
+
+
+# --- Сотрудники -------------------------------------------------------------
+
+def prepare_users(df):
+    return list(build_users_index(df).values())
+
+
+def write_users(cursor, entries):
+    # Новые сотрудники появляются в people при первом входе (add_user_to_db)
+    plan, _ = apply_sync(cursor, entries)
+    return {'inserted': 0, 'updated': len(plan['update']), 'deleted': len(plan['delete'])}
+
+
+# --- Оборудование -----------------------------------------------------------
+
+def prepare_equipment(df):
+    df = df.rename(columns=lambda col: str(col).strip())
+    missing = [col for col in ('Инв. №', 'Счётчик') if col not in df.columns]
+    if missing:
+        raise ValueError(f"В выгрузке оборудования нет колонок {', '.join(missing)}")
+    df = df[df['Инв. №'].notna() & df['Счётчик'].notna()]
+
+    def column(name):
+        return df[name].tolist() if name in df.columns else [None] * len(df)
+
+    rows = {}
+    for inventory, meter, gov_number, location, division, state in zip(
+            column('Инв. №'), column('Счётчик'), column('Гос. номер'),
+            column('Локация'), column('Подразделение'), column('Состояние')):
+        key = _SEPARATOR.join((_text(inventory), _text(meter)))
+        rows[key] = (_text(gov_number), _text(location), _text(division), _text(state) or 'active')
+    return rows
+
+
+def baseline_equipment(cursor):
+    cursor.execute('''
+        SELECT inventory_number, meter_type, gov_number, location, division, status
+        FROM equipment WHERE status != 'removed'
+    ''')
+    return {_SEPARATOR.join((_text(row[0]), _text(row[1]))): row[2:] for row in cursor.fetchall()}
+
+
+def apply_equipment(cursor, changed, deleted):
+    cursor.executemany('''
+        INSERT INTO equipment (inventory_number, meter_type, gov_number, location, division, status)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(inventory_number, meter_type) DO UPDATE SET
+            gov_number = excluded.gov_number, location = excluded.location,
+            division = excluded.division, status = excluded.status
+    ''', [(*key.split(_SEPARATOR), *values) for key, values in changed.items()])
+    # Исчезнувшее из выгрузки оборудование не удаляется: по нему есть история показаний
+    cursor.executemany('''
+        UPDATE equipment SET status = 'removed'
+        WHERE inventory_number = ? AND meter_type = ?
+    ''', [tuple(key.split(_SEPARATOR)) for key in deleted])
+
+
+# --- Табель -----------------------------------------------------------------
+
+def prepare_shifts(df):
+    return interval_rows(build_intervals(tabel_to_long(df)))
+
+
+def write_shifts(cursor, rows):
+    # write_intervals внутри открытой транзакции импорта выполняется как ее часть
+    changed, deleted = write_intervals(rows)
+    return {'inserted': 0, 'updated': len(changed), 'deleted': len(deleted)}
+
+
+SOURCES = {
+    'users': ImportSource('users', 'Users', prepare_users, None, None, roster.invalidate, write=write_users),
+    'equipment': ImportSource('equipment', 'Equipment', prepare_equipment, baseline_equipment, apply_equipment,
+                              equipment_templates.reload),
+    'shifts': ImportSource('shifts', 'tabels', prepare_shifts, None, None, shift_store.refresh,
+                           write=write_shifts),
+}
+
+
+def plan_import(rows, previous):
+    """Сравнение строк выгрузки с хэшами прошлого импорта
+
+    rows - {ключ: значения}, previous - {ключ: хэш}. Возвращает новые хэши,
+    изменившиеся строки {ключ: значения}, исчезнувшие ключи и число
+    новых строк среди изменившихся.
+    """
+    hashes = {key: row_hash(values) for key, values in rows.items()}
+    changed = {key: rows[key] for key, digest in hashes.items() if previous.get(key) != digest}
+    deleted = [key for key in previous if key not in hashes]
+    inserted = sum(1 for key in changed if key not in previous)
+    return hashes, changed, deleted, inserted
+
+
+def _journal(cursor, source_name, origin, started_at, result):
+    cursor.execute('''
+        INSERT INTO import_journal (source, origin, started_at, finished_at, total_rows,
+                                    inserted, updated, deleted, unchanged, status, message)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        source_name, origin, started_at, datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        result.get('total', 0), result.get('inserted', 0), result.get('updated', 0),
+        result.get('deleted', 0), result.get('unchanged', 0), result['status'], result.get('message')
+    ))
+
+
+def _apply_rows(cursor, source, rows):
+    """Запись отличий выгрузки от прошлого импорта по хэшам строк; возвращает счетчики"""
+    cursor.execute('SELECT row_key, row_hash FROM import_rows WHERE source = ?', (source.name,))
+    stored = dict(cursor.fetchall())
+    previous = stored
+    if not stored:
+        # Истории импорта нет: сравниваем с тем, что уже лежит в таблице
+        previous = {key: row_hash(values) for key, values in source.baseline(cursor).items()}
+    hashes, changed, deleted, inserted = plan_import(rows, previous)
+
+    if changed or deleted:
+        source.apply(cursor, changed, deleted)
+    cursor.executemany('''
+        INSERT INTO import_rows (source, row_key, row_hash) VALUES (?, ?, ?)
+        ON CONFLICT(source, row_key) DO UPDATE SET row_hash = excluded.row_hash
+    ''', [(source.name, key, digest) for key, digest in hashes.items() if stored.get(key) != digest])
+    cursor.executemany(
+        'DELETE FROM import_rows WHERE source = ? AND row_key = ?',
+        [(source.name, key) for key in stored if key not in hashes]
+    )
+    return {'inserted': inserted, 'updated': len(changed) - inserted, 'deleted': len(deleted)}
+
+
+def run_import(source_name, path=None):
+    """Импорт одного источника (из файла path, если он задан); возвращает словарь со счетчиками"""
+    source = SOURCES[source_name]
+    started_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    origin = None
+    try:
+        df, origin = load_export(source, path)
+        if df is None:
+            return {'status': 'skipped', 'message': 'Выгрузка не найдена'}
+        rows = source.prepare(df)
+        if not rows:
+            # Пустая выгрузка не должна удалить все строки прошлого импорта
+            result = {'status': 'skipped', 'message': 'Выгрузка пуста'}
+            with db_transaction(immediate=True) as cursor:
+                _journal(cursor, source.name, origin, started_at, result)
+            logger.warning(f"Импорт {source.name}: выгрузка {origin} пуста, пропущен")
+            return result
+
+        with db_transaction(immediate=True) as cursor:
+            if source.write is not None:
+                counts = source.write(cursor, rows)
+                # Хэши строк для таких источников не ведутся
+                cursor.execute('DELETE FROM import_rows WHERE source = ?', (source.name,))
+            else:
+                counts = _apply_rows(cursor, source, rows)
+            result = {
+                'status': 'success',
+                'total': len(rows),
+                **counts,
+                'unchanged': max(len(rows) - counts['inserted'] - counts['updated'], 0)
+            }
+            _journal(cursor, source.name, origin, started_at, result)
+
+        if (result['inserted'] or result['updated'] or result['deleted']) and source.after_commit:
+            source.after_commit()
+        logger.info(
+            f"Импорт {source.name} из {origin}: строк {result['total']}, новых {result['inserted']}, "
+            f"изменено {result['updated']}, удалено {result['deleted']}, без изменений {result['unchanged']}"
+        )
+        return result
+
+    except Exception as e:
+        logger.error(f"Ошибка импорта {source.name}: {e}")
+        result = {'status': 'error', 'message': str(e)}
+        try:
+            with db_transaction(immediate=True) as cursor:
+                _journal(cursor, source.name, origin, started_at, result)
+        except Exception as journal_error:
+            logger.error(f"Ошибка записи журнала импорта: {journal_error}")
+        return result
+
+
+def run_all():
+    """Импорт всех источников по очереди"""
+    return {name: run_import(name) for name in SOURCES}
+
+
+def import_1c_job(context):
+    """Ночной импорт выгрузок 1С"""
+    run_all()
@@ -6,12 +6,36 @@ from telegram.error import NetworkError
 import sqlite3
 import pytz
 from datetime import time, datetime, timedelta
-from shifts_handler import ShiftsHandler
+from shifts_handler import ShiftsHandler, TABEL_FILE
 import os
 import logging
 from dotenv import load_dotenv
-from check import MeterValidator
+from check import MeterValidator, get_last_readings
 from db_utils import db_transaction
+from outbound_queue import send_message, send_document, PRIORITY_REPLY, outbound, log_outbound_metrics_job
+from notification_digest import digest, finish_digest_action
+from worker_pool import pool as worker_pool, heavy_handler, BUSY_TEXT, REPORT_PREPARING_TEXT
+from webhook_server import create_updater, run_bot
+from template_service import equipment_templates, readings_templates, EQUIPMENT_FILE, LAST_READINGS_FILE
+from session_state import EquipmentSequence, ReadingLog
+from users_directory import users_directory, normalize_role, USERS_FILE
+from user_sync import sync_users
+from roster import roster, ROLE_TABLES
+from shift_store import build_intervals, shift_store
+from time_utils import location_registry
+from reference_watcher import reference_watcher
+from chat_resolver import chat_resolver
+from import_1c import run_all as run_1c_import, run_import, import_1c_job
+from bulk_entry import BULK_HELP_TEXT, format_equipment_list, split_message, process_bulk_text, format_summary
+from report_writer import StreamingExcelWriter, read_excel_header, iter_excel_rows
+from report_storage import (
+    get_current_week, get_week_folder, find_report_files, find_latest_report_file,
+    open_report_file, report_file_exists, store_upload, store_frame,
+    archive_old_reports_job, cleanup_uploads_job,
+    match_submission_rows, add_submission_patch, apply_submission_patches,
+    load_submission, open_submission, compact_patches_job,
+    UPLOAD_ACCEPTED, UPLOAD_REJECTED
+)
 
 # Загрузка переменных окружения из файла .env
 load_dotenv()
@@ -24,27 +48,50 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Состояния для ConversationHandler
-ENTER_TAB_NUMBER, ENTER_READINGS, WAITING_FOR_ADMIN_CHOICE, WAIT_MANAGER_EXCEL, WAITING_FOR_MANAGER_CHOICE, WAIT_ADMIN_EXCEL, ENTER_ADMIN_READING, WAITING_FOR_CHOICE, SELECT_EQUIPMENT, ENTER_VALUE, CONFIRM_READINGS, WAITING_FOR_FILE, WAIT_EXCEL_FILE, ENTER_READING_VALUE = range(14)
+ENTER_TAB_NUMBER, ENTER_READINGS, WAITING_FOR_ADMIN_CHOICE, WAIT_MANAGER_EXCEL, WAITING_FOR_MANAGER_CHOICE, WAIT_ADMIN_EXCEL, ENTER_ADMIN_READING, WAITING_FOR_CHOICE, SELECT_EQUIPMENT, ENTER_VALUE, CONFIRM_READINGS, WAITING_FOR_FILE, WAIT_EXCEL_FILE, ENTER_READING_VALUE, ENTER_BULK_READINGS = range(15)
 
 # Инициализация обработчика табеля
 shifts_handler = ShiftsHandler()
 
+# Пускать ли пользователей к командам только во время вахты (по умолчанию выключено)
+SHIFT_ACCESS_CHECK = os.getenv('SHIFT_ACCESS_CHECK', '0') == '1'
+
 def update_data_from_1c():
+    # Изменившиеся строки выгрузок переносятся в БД, затем обновляются справочники в памяти
     try:
-        # 1. Загрузка пользователей
-        users_df = pd.read_excel(r'C:\bot_data\Users.xlsx')
-        
-        # 2. Загрузка смен
-        shifts_df = pd.read_excel(r'C:\bot_data\tabels.xlsx')
-        
-        # 3. Загрузка оборудования
-        equipment_df = pd.read_excel(r'C:\bot_data\Equipment.xlsx')
-        
+        run_1c_import()
+        reference_watcher.reload_all()
         logger.info("Данные из 1С успешно обновлены")
     except Exception as e:
         logger.error(f"Ошибка обновления данных: {e}")
 
 
+def reload_users_file(path):
+    """Новая выгрузка сотрудников: справочник, таблица people и часовые пояса"""
+    users_directory.refresh()
+    sync_users()
+    location_registry.refresh()
+
+
+def reload_equipment_file(path):
+    """Новый справочник оборудования: изменения в таблицу equipment, шаблоны и часовые пояса"""
+    # Импорт с изменениями сам перезагружает equipment_templates
+    run_import('equipment', path)
+    location_registry.refresh()
+
+
+def start_reference_watcher():
+    """Перезагрузка справочников при появлении новых выгрузок в каталоге данных"""
+    reference_watcher.register(USERS_FILE, reload_users_file)
+    reference_watcher.register(EQUIPMENT_FILE, reload_equipment_file)
+    reference_watcher.register(LAST_READINGS_FILE, readings_templates.reload)
+    reference_watcher.register(TABEL_FILE, lambda path: shifts_handler.load_tabel())
+    users_directory.watched = True
+    equipment_templates.watched = True
+    readings_templates.watched = True
+    reference_watcher.start()
+
+
 # Загрузка таблицы пользователей
 def load_users_table():
     try:
@@ -55,14 +102,6 @@ def load_users_table():
         return pd.DataFrame()
 
 # Загрузка таблицы смен
-def load_shifts_table():
-    try:
-        df = pd.read_excel('tabels.xlsx')
-        return df
-    except Exception as e:
-        print(f"Ошибка при загрузке файла tabels.xlsx: {e}")
-        return pd.DataFrame()
-
 # Обработка команды /start
 def start(update: Update, context: CallbackContext) -> int:
     if 'started' in context.user_data:
@@ -97,24 +136,12 @@ def start(update: Update, context: CallbackContext) -> int:
         return ConversationHandler.END
 
 def check_tab_number_exists_in_excel(tab_number):
-    """Проверка существования табельного номера в Users.xlsx"""
+    """Поиск табельного номера в справочнике сотрудников (Users.xlsx)"""
     try:
-        df_users = load_users_table()
-        if df_users.empty:
-            logger.error("Файл Users.xlsx пуст или не загружен")
-            return None
-            
-        # Проверяем, что столбец существует
-        if 'Табельный номер' not in df_users.columns:
-            logger.error("В файле Users.xlsx отсутствует столбец 'Табельный номер'")
-            return None
-            
-        # Преобразуем табельные номера к строковому типу для сравнения
-        user_data = df_users[df_users['Табельный номер'].astype(str) == str(tab_number)]
-        
-        if not user_data.empty:
+        user = users_directory.get(tab_number)
+        if user is not None:
             logger.info(f"Найден пользователь с табельным номером {tab_number}")
-            return user_data
+            return user
             
         logger.warning(f"Пользователь с табельным номером {tab_number} не найден")
         return None
@@ -141,10 +168,10 @@ def handle_tab_number(update: Update, context: CallbackContext) -> int:
         user = check_tab_number_exists_in_excel(tab_number)
         
         if user is not None:
-            name = user['ФИО'].values[0]
-            role = determine_role(user)
-            location = user['Локация'].values[0]
-            division = user['Подразделение'].values[0] if 'Подразделение' in user.columns else ""
+            name = user.name
+            role = user.role
+            location = user.location
+            division = user.division
             
             # Добавляем пользователя в базу данных с chat_id
             add_user_to_db(tab_number, name, role, chat_id, location, division)
@@ -169,8 +196,11 @@ def handle_tab_number(update: Update, context: CallbackContext) -> int:
             # Разные сообщения для разных ролей
             if role in ['Администратор', 'Руководитель']:
                 update.message.reply_text("✅ Вы имеете постоянный доступ к боту.")
+            elif not SHIFT_ACCESS_CHECK:
+                # Доступ по табелю выключен - бот доступен вне зависимости от вахты
+                update.message.reply_text("✅ Бот доступен для работы.")
             else:
-                if check_shift_status(tab_number):
+                if is_user_available(tab_number, role):
                     update.message.reply_text("✅ Вы на вахте. Бот доступен для работы.")
                 else:
                     update.message.reply_text("⛔ В настоящее время вы не на вахте. Бот недоступен.")
@@ -195,20 +225,8 @@ def handle_tab_number(update: Update, context: CallbackContext) -> int:
 # Проверка статуса вахты
 def check_shift_status(tab_number):
     try:
-        # Получаем ФИО сотрудника по табельному номеру
-        with db_transaction() as cursor:
-            cursor.execute('SELECT name FROM Users_user_bot WHERE tab_number = ?', (tab_number,))
-            result = cursor.fetchone()
-        if not result:
-            return False
-            
-        employee_name = result[0]
-        # Проверяем статус в табеле
-        status = shifts_handler.check_employee_status(employee_name)
-        if not status:
-            return False
-            
-        return status == 'ДА'
+        # Статус на сегодня из снимка в памяти, без обращения к БД
+        return shift_store.availability.is_on_shift(tab_number)
     except Exception as e:
         logger.error(f"Ошибка при проверке статуса вахты: {e}")
         return False
@@ -219,8 +237,9 @@ def is_user_available(tab_number: int, role: str) -> bool:
         if role in ['Руководитель', 'Администратор']:
             return True
             
-        # Пользователи также всегда имеют доступ для тестирования
-        return True
+        if not SHIFT_ACCESS_CHECK:
+            return True
+        return shift_store.availability.is_on_shift(tab_number)
     except Exception as e:
         logger.error(f"Ошибка проверки доступности: {e}")
         return True
@@ -231,19 +250,15 @@ def check_access(update: Update, context: CallbackContext) -> bool:
         update.message.reply_text("Пожалуйста, сначала введите ваш табельный номер через /start")
         return False
     
-    # Всегда возвращаем True для тестирования
+    if not is_user_available(context.user_data['tab_number'], context.user_data['role']):
+        update.effective_message.reply_text("⛔ В настоящее время вы не на вахте. Бот недоступен.")
+        return False
     return True
 
 # Определение роли пользователя
 def determine_role(user):
     role = user['Роль'].values[0] if 'Роль' in user.columns else "Пользователь"
-    
-    if 'Администратор' in str(role):
-        return 'Администратор'
-    elif 'Руководитель' in str(role):
-        return 'Руководитель'
-    else:
-        return 'Пользователь'
+    return normalize_role(role)
 
 # Показ меню в зависимости от роли
 def show_role_specific_menu(update: Update, role: str):
@@ -282,18 +297,10 @@ def handle_button(update: Update, context: CallbackContext):
 # Удаление пользователя из базы данных
 def delete_user(tab_number, role):
     try:
-        if role == 'Администратор':
-            with db_transaction() as cursor:
-                cursor.execute('DELETE FROM Users_admin_bot WHERE tab_number = ?', (tab_number,))
-        elif role == 'Руководитель':
-            with db_transaction() as cursor:
-                cursor.execute('DELETE FROM Users_dir_bot WHERE tab_number = ?', (tab_number,))
-        else:
-            with db_transaction() as cursor:
-                cursor.execute('DELETE FROM Users_user_bot WHERE tab_number = ?', (tab_number,))
-        
-        # Также удаляем из таблицы смен
-        cursor.execute('DELETE FROM shifts WHERE tab_number = ?', (tab_number,))
+        role = role if role in ROLE_TABLES else 'Пользователь'
+        with db_transaction(immediate=True) as cursor:
+            cursor.execute('DELETE FROM people WHERE tab_number = ? AND role = ?', (tab_number, role))
+        roster.invalidate()
         return True
     except Exception as e:
         print(f"Ошибка при удалении пользователя: {e}")
@@ -302,17 +309,10 @@ def delete_user(tab_number, role):
 # Проверка, существует ли пользователь в базе данных
 def is_user_in_db(tab_number, role):
     try:
-        if role == 'Администратор':
-            with db_transaction() as cursor:
-                cursor.execute('SELECT * FROM Users_admin_bot WHERE tab_number = ?', (tab_number,))
-        elif role == 'Руководитель':
-            with db_transaction() as cursor:
-                cursor.execute('SELECT * FROM Users_dir_bot WHERE tab_number = ?', (tab_number,))
-        else:
-            with db_transaction() as cursor:
-                cursor.execute('SELECT * FROM Users_user_bot WHERE tab_number = ?', (tab_number,))
-        
-        return cursor.fetchone() is not None
+        role = role if role in ROLE_TABLES else 'Пользователь'
+        with db_transaction() as cursor:
+            cursor.execute('SELECT 1 FROM people WHERE tab_number = ? AND role = ?', (tab_number, role))
+            return cursor.fetchone() is not None
     except Exception as e:
         print(f"Ошибка при проверке пользователя в БД: {e}")
         return False
@@ -321,18 +321,17 @@ def is_user_in_db(tab_number, role):
 def add_user_to_db(tab_number, name, role, chat_id, location, division):
     """Добавление пользователя в базу данных"""
     try:
-        table_name = {
-            'Администратор': 'Users_admin_bot',
-            'Руководитель': 'Users_dir_bot',
-            'Пользователь': 'Users_user_bot'
-        }.get(role, 'Users_user_bot')
+        role = role if role in ROLE_TABLES else 'Пользователь'
         
-        with db_transaction() as cursor:
-            cursor.execute(f'''
-                INSERT OR REPLACE INTO {table_name} 
-                (tab_number, name, role, chat_id, location, division) 
+        with db_transaction(immediate=True) as cursor:
+            cursor.execute('''
+                INSERT INTO people (tab_number, name, role, chat_id, location, division)
                 VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(tab_number) DO UPDATE SET
+                    name = excluded.name, role = excluded.role, chat_id = excluded.chat_id,
+                    location = excluded.location, division = excluded.division
             ''', (tab_number, name, role, chat_id, location, division))
+        roster.invalidate()
         return True
     except Exception as e:
         logger.error(f"Ошибка добавления пользователя в БД: {e}")
@@ -341,72 +340,21 @@ def add_user_to_db(tab_number, name, role, chat_id, location, division):
 def check_admin_chat_ids(context: CallbackContext):
     """Проверка и обновление chat_id администраторов"""
     try:
-        with db_transaction() as cursor:  
-            cursor.execute('SELECT tab_number, name FROM Users_admin_bot')
-            admins = cursor.fetchall()
-            
-            for admin in admins:
-                try:
-                    chat = context.bot.get_chat(admin[0])
-                    cursor.execute('UPDATE Users_admin_bot SET chat_id = ? WHERE tab_number = ?', 
-                                 (chat.id, admin[0]))
-                    logger.info(f"Обновлен chat_id для администратора {admin[1]}")
-                except Exception as e:
-                    logger.error(f"Не удалось обновить chat_id для администратора {admin[1]}: {e}")
+        # При запуске проверяются все сохраненные chat_id
+        chat_resolver.refresh(context.bot, force=True)
     except Exception as e:
         logger.error(f"Ошибка при проверке chat_id администраторов: {e}")
 
 def update_shifts_from_excel():
-    try:
-        df = load_shifts_table()
-        if not df.empty:
-            # Очистка таблицы перед обновлением
-            with db_transaction() as cursor:
-                cursor.execute('DELETE FROM shifts')
-            
-            # Вставка новых данных
-            for _, row in df.iterrows():
-                tab_number = row['tab_number'] if 'tab_number' in row else None
-                name = row['name'] if 'name' in row else row['ФИО'] if 'ФИО' in row else None
-                shift_status = str(row['is_on_shift']).upper().strip() if 'is_on_shift' in row and pd.notna(row['is_on_shift']) else "НЕТ"
-                is_on_shift = shift_status in ["ДА", "YES", "TRUE", "1", "1.0"]
-                
-                if tab_number and name:
-                    cursor.execute('''
-                    INSERT INTO shifts (name, tab_number, is_on_shift)
-                    VALUES (?, ?, ?)
-                    ON CONFLICT(tab_number) DO UPDATE SET
-                        name = excluded.name,
-                        is_on_shift = excluded.is_on_shift
-                    ''', (name, tab_number, is_on_shift))
-            print("Данные о сменах в БД обновлены.")
-    except FileNotFoundError:
-        print("Файл tabels.xlsx не найден.")
-    except Exception as e:
-        print(f"Ошибка при обновлении таблицы смен: {e}")
+    # Интервалы вахт строятся из табеля, индекс shift_store обновляется там же
+    shifts_handler.load_tabel()
 
 # Обновление всех таблиц из Excel
 def update_db_from_excel():
     try:
-        # Обновляем таблицу пользователей
-        df_users = load_users_table()
-        if not df_users.empty:
-            # Очистка таблиц перед обновлением
-            with db_transaction() as cursor:
-                cursor.execute('DELETE FROM Users_admin_bot')
-                cursor.execute('DELETE FROM Users_dir_bot')
-                cursor.execute('DELETE FROM Users_user_bot')
-            
-            # Вставка новых данных
-            for _, row in df_users.iterrows():
-                tab_number = row['Табельный номер']
-                name = row['ФИО']
-                role = determine_role(pd.DataFrame([row]))
-                t_number = row['Номер телефона']
-                location = row['Локация']
-                division = row['Подразделение'] if 'Подразделение' in row else ""
-                
-                add_user_to_db(tab_number, name, role, t_number, location, division)
+        # Обновляем таблицу пользователей: применяются только изменения выгрузки
+        result = sync_users()
+        if result.get('status') == 'success':
             print("Данные пользователей в БД обновлены.")
         
         # Обновляем таблицу смен
@@ -421,6 +369,15 @@ def daily_update(context: CallbackContext):
         # Обновляем данные из табеля
         shifts_handler.load_tabel()
         
+        # Переносим изменения выгрузки сотрудников в таблицы пользователей
+        sync_users()
+        
+        # Пересчитываем часовые пояса с учетом новых локаций
+        location_registry.refresh()
+        
+        # Статусы вахты на новый день для проверок доступа
+        shift_store.availability.refresh()
+        
     except Exception as e:
         logger.error(f"Ошибка при ежедневном обновлении: {e}")
 
@@ -555,7 +512,8 @@ def handle_upload_readings(update: Update, context: CallbackContext):
     # Создаем клавиатуру с выбором способа ввода
     keyboard = [
         [InlineKeyboardButton("Загрузить Excel файл", callback_data='upload_excel')],
-        [InlineKeyboardButton("Ввести показания вручную", callback_data='enter_readings')]
+        [InlineKeyboardButton("Ввести показания вручную", callback_data='enter_readings')],
+        [InlineKeyboardButton("Ввести списком одним сообщением", callback_data='enter_bulk')]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
@@ -592,44 +550,30 @@ def generate_excel_template(update: Update, context: CallbackContext):
         
     name, location, division = user_data
     
-    # Создаем шаблон с обязательными колонками
-    columns = ['№ п/п', 'Гос. номер', 'Инв. №', 'Счётчик', 'Показания', 'Комментарий']
-    template_df = pd.DataFrame(columns=columns)
-    
-    # Получаем список оборудования и заполняем шаблон
-    validator = MeterValidator()
-    equipment_df = validator._get_equipment_for_location_division(location, division)
-    
-    if equipment_df.empty:
-        query.edit_message_text("Для вашей локации нет оборудования.")
+    # Справочник оборудования и сам шаблон готовятся в пуле, чтобы не занимать диспетчер
+    query.edit_message_text("⏳ Шаблон Excel готовится...")
+    if worker_pool.submit(send_excel_template, query, context, location, division) is None:
+        query.edit_message_text(BUSY_TEXT)
         return ConversationHandler.END
     
-    for idx, row in equipment_df.iterrows():
-        template_df.loc[idx] = [
-            idx + 1,  # № п/п
-            row['Гос. номер'],
-            row['Инв. №'],
-            row['Счётчик'],
-            '',  # Пустые показания
-            ''   # Пустой комментарий
-        ]
-    
-    # Сохраняем в буфер
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        template_df.to_excel(writer, index=False, sheet_name='Показания')
-    output.seek(0)
-    
-    # Отправляем пользователю
-    query.edit_message_text("Шаблон Excel создан. Заполните столбцы 'Показания' и 'Комментарий' и отправьте файл обратно.")
-    
-    context.bot.send_document(
-        chat_id=query.message.chat_id,
-        document=InputFile(output, filename=f'Показания_{location}_{division}.xlsx'),
+    return WAITING_FOR_FILE
+
+
+def send_excel_template(query, context: CallbackContext, location, division):
+    """Отправка шаблона Excel из кэша шаблонов подразделений"""
+    sent = equipment_templates.send_template(
+        context.bot,
+        query.message.chat_id,
+        location,
+        division,
+        priority=PRIORITY_REPLY,
         caption="Заполните все обязательные колонки перед отправкой"
     )
+    if not sent:
+        query.edit_message_text("Для вашей локации нет оборудования.")
+        return
     
-    return WAITING_FOR_FILE
+    query.edit_message_text("Шаблон Excel создан. Заполните столбцы 'Показания' и 'Комментарий' и отправьте файл обратно.")
 
 
 def start_manual_input(update: Update, context: CallbackContext, message=None):
@@ -687,10 +631,12 @@ def start_manual_input(update: Update, context: CallbackContext, message=None):
                 message.reply_text("Для вашей локации нет оборудования.")
             return ConversationHandler.END
         
-        # Инициализация данных
-        context.user_data[f'equipment_{user_type}'] = equipment_df.to_dict('records')
+        # Инициализация данных: сессия хранит только индексы в общей таблице оборудования,
+        # последние показания загружаются одним запросом на всю сессию
+        context.user_data[f'equipment_{user_type}'] = EquipmentSequence.from_frame(equipment_df) \
+            .prefetch_last_readings(get_last_readings)
         context.user_data[f'current_index_{user_type}'] = 0
-        context.user_data[f'readings_{user_type}'] = []
+        context.user_data[f'readings_{user_type}'] = ReadingLog()
         
         # Показываем первое оборудование
         return show_next_equipment(update, context, user_type)
@@ -725,11 +671,10 @@ def show_next_equipment(update: Update, context: CallbackContext, user_type='use
                 
         equipment = equipment_list[current_idx]
 
-        # Получаем последние показания
-        validator = MeterValidator()
+        # Последние показания из снимка, загруженного при начале ввода
         inv_num = equipment['Инв. №']
         meter_type = equipment['Счётчик']
-        last_reading = validator._get_last_reading(inv_num, meter_type)
+        last_reading = equipment_list.last_reading(current_idx)
         
         # Форматирование сообщения
         message = (
@@ -794,7 +739,8 @@ def back_to_choice(update: Update, context: CallbackContext):
     # Создаем клавиатуру с выбором способа
     keyboard = [
         [InlineKeyboardButton("Загрузить Excel файл", callback_data='upload_excel')],
-        [InlineKeyboardButton("Ввести показания вручную", callback_data='enter_readings')]
+        [InlineKeyboardButton("Ввести показания вручную", callback_data='enter_readings')],
+        [InlineKeyboardButton("Ввести списком одним сообщением", callback_data='enter_bulk')]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
@@ -816,8 +762,7 @@ def handle_reading_input(update: Update, context: CallbackContext):
             update.message.reply_text("Ошибка: показание не может быть отрицательным.")
             return ENTER_READING_VALUE
         
-        validator = MeterValidator()
-        last_reading = validator._get_last_reading(equipment['Инв. №'], equipment['Счётчик'])
+        last_reading = context.user_data['equipment'].last_reading(current_index)
         
         # Если предыдущее показание None или отсутствует - принимаем любое неотрицательное
         if last_reading is None or last_reading['reading'] is None:
@@ -860,6 +805,79 @@ def readings_choice_handler(update: Update, context: CallbackContext):
         return generate_excel_template(update, context)
     elif query.data == 'enter_readings':
         return start_manual_input(update, context)
+
+
+def start_bulk_input(update: Update, context: CallbackContext):
+    """Начало пакетного ввода: список оборудования и формат строк
+
+    Единственная точка входа по кнопке enter_bulk. Выбор способа подачи на
+    этом завершается: данные начатого ручного ввода сбрасываются.
+    """
+    query = update.callback_query
+    query.answer()
+    for key in ('readings', 'current_index', 'readings_user', 'equipment_user', 'current_index_user'):
+        context.user_data.pop(key, None)
+    
+    tab_number = context.user_data.get('tab_number')
+    try:
+        with db_transaction() as cursor:
+            cursor.execute('''
+                SELECT name, location, division FROM Users_user_bot WHERE tab_number = ?
+            ''', (tab_number,))
+            user_data = cursor.fetchone()
+    except Exception as e:
+        logger.error(f"Ошибка получения данных пользователя: {e}")
+        query.edit_message_text("Ошибка: не удалось получить данные пользователя.")
+        return ConversationHandler.END
+    
+    if not user_data:
+        query.edit_message_text("Ошибка: пользователь не найден в базе данных.")
+        return ConversationHandler.END
+    
+    name, location, division = user_data
+    equipment_df = equipment_templates.get_equipment(location, division)
+    if equipment_df.empty:
+        query.edit_message_text("Для вашей локации нет оборудования.")
+        return ConversationHandler.END
+    
+    equipment = EquipmentSequence.from_frame(equipment_df).prefetch_last_readings(get_last_readings)
+    context.user_data['bulk_equipment'] = equipment
+    context.user_data['bulk_user_info'] = {
+        'tab_number': tab_number,
+        'name': name,
+        'location': location,
+        'division': division
+    }
+    
+    query.edit_message_text(BULK_HELP_TEXT)
+    for text in split_message(format_equipment_list(equipment), header=f"Оборудование ({len(equipment)}):"):
+        send_message(context.bot, query.message.chat_id, text, priority=PRIORITY_REPLY)
+    
+    return ENTER_BULK_READINGS
+
+
+def handle_bulk_readings(update: Update, context: CallbackContext):
+    """Разбор сообщения со списком показаний и ответ одной сводкой"""
+    equipment = context.user_data.get('bulk_equipment')
+    user_info = context.user_data.get('bulk_user_info')
+    if equipment is None or user_info is None:
+        update.message.reply_text("Сессия ввода устарела. Начните заново через 'Загрузить показания'.")
+        return ConversationHandler.END
+    
+    result = process_bulk_text(update.message.text, equipment, user_info, context)
+    for text in format_summary(result):
+        update.message.reply_text(text)
+    
+    if result['errors']:
+        # Принятые строки уже сохранены, повторно отправлять нужно только исправленные
+        update.message.reply_text("Отправьте исправленные строки следующим сообщением или нажмите /cancel.")
+        return ENTER_BULK_READINGS
+    
+    if 'missing_reports' in context.bot_data:
+        context.bot_data['missing_reports'].pop(user_info['tab_number'], None)
+    context.user_data.pop('bulk_equipment', None)
+    context.user_data.pop('bulk_user_info', None)
+    return ConversationHandler.END
     
 def finish_manual_input(update: Update, context: CallbackContext):
     try:
@@ -938,18 +956,11 @@ def finish_manual_input(update: Update, context: CallbackContext):
         df['tab_number'] = tab_number
         df['timestamp'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         
-        # Создаем папку для отчетов
-        current_week = datetime.now().strftime('%Y-W%U')
-        report_folder = f'meter_readings/week_{current_week}'
-        os.makedirs(report_folder, exist_ok=True)
-        
-        # Сохраняем файл
+        # Сохраняем файл в хранилище загрузок
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        file_path = os.path.join(report_folder, 
+        file_path = os.path.join(get_week_folder(),
                                f'meters_{location}_{division}_{tab_number}_{timestamp}.xlsx')
-        
-        # Сохраняем в Excel
-        df.to_excel(file_path, index=False, columns=columns + ['name', 'location', 'division', 'tab_number', 'timestamp'])
+        store_frame(df, file_path, columns=columns + ['name', 'location', 'division', 'tab_number', 'timestamp'])
         
         # Валидация файла
         validator = MeterValidator()
@@ -983,9 +994,7 @@ def show_equipment_for_input(update: Update, context: CallbackContext, index: in
     context.user_data['current_equipment_index'] = index
     
     # Получаем последние показания
-    from check import MeterValidator
-    validator = MeterValidator()
-    last_reading = validator._get_last_reading(equipment['Инв. №'], equipment['Счётчик'])
+    last_reading = context.user_data['equipment'].last_reading(index)
     
     last_reading_text = ""
     if last_reading:
@@ -1042,9 +1051,7 @@ def select_equipment_handler(update: Update, context: CallbackContext):
     context.user_data['current_equip_index'] = equip_index
     
     # Получаем последнее показание для этого счетчика
-    from check import MeterValidator
-    validator = MeterValidator()
-    last_reading = validator._get_last_reading(equipment['Инв. №'], equipment['Счётчик'])
+    last_reading = context.user_data['equipment'].last_reading(equip_index)
     
     last_reading_info = ""
     if last_reading:
@@ -1097,8 +1104,7 @@ def process_reading_input(update: Update, context: CallbackContext):
             update.message.reply_text("Ошибка: показание не может быть отрицательным.")
             return ENTER_READING_VALUE
         
-        validator = MeterValidator()
-        last_reading = validator._get_last_reading(equipment['Инв. №'], equipment['Счётчик'])
+        last_reading = equipment_list.last_reading(current_index)
         
         # Проверяем только если есть предыдущее показание
         if last_reading and last_reading['reading'] is not None:
@@ -1110,7 +1116,7 @@ def process_reading_input(update: Update, context: CallbackContext):
                 return ENTER_READING_VALUE
         
         # Сохраняем показание
-        context.user_data.setdefault(f'readings_{user_type}', []).append({
+        context.user_data.setdefault(f'readings_{user_type}', ReadingLog()).append({
             'equipment': equipment,
             'value': value,
             'comment': ''
@@ -1159,21 +1165,20 @@ def handle_reading_button(update: Update, context: CallbackContext):
     equipment = equipment_list[current_index]
         
     equipment = equipment_list[current_index]
-    validator = MeterValidator()
     
     if query.data.startswith(f'repair_{user_type}'):
         # Для "В ремонте" последнее показание
-        last_reading = validator._get_last_reading(equipment['Инв. №'], equipment['Счётчик'])
+        last_reading = equipment_list.last_reading(current_index)
         
         if last_reading:
-            context.user_data.setdefault(f'readings_{user_type}', []).append({
+            context.user_data.setdefault(f'readings_{user_type}', ReadingLog()).append({
                 'equipment': equipment,
                 'value': last_reading['reading'],
                 'comment': 'В ремонте'
             })
             message = f"✅ Оборудование {equipment['Инв. №']} ({equipment['Счётчик']}) отмечено как 'В ремонте'"
         else:
-            context.user_data.setdefault(f'readings_{user_type}', []).append({
+            context.user_data.setdefault(f'readings_{user_type}', ReadingLog()).append({
                 'equipment': equipment,
                 'value': None,
                 'comment': 'В ремонте'
@@ -1182,6 +1187,7 @@ def handle_reading_button(update: Update, context: CallbackContext):
         
     elif query.data.startswith(f'ubylo_{user_type}'):
         # Обработка "Убыло"
+        validator = MeterValidator()
         result = validator.handle_ubylo_status(
             context,
             equipment['Инв. №'],
@@ -1203,7 +1209,7 @@ def handle_reading_button(update: Update, context: CallbackContext):
             message = "✅ Запрос на 'Убыло' отправлен"
             
             # Добавляем запись с комментарием "Убыло"
-            context.user_data.setdefault(f'readings_{user_type}', []).append({
+            context.user_data.setdefault(f'readings_{user_type}', ReadingLog()).append({
                 'equipment': equipment,
                 'value': None,
                 'comment': 'Убыло'
@@ -1215,7 +1221,7 @@ def handle_reading_button(update: Update, context: CallbackContext):
     
     elif query.data.startswith(f'skip_{user_type}'):
         # Пропуск оборудования
-        context.user_data.setdefault(f'readings_{user_type}', []).append({
+        context.user_data.setdefault(f'readings_{user_type}', ReadingLog()).append({
             'equipment': equipment,
             'value': None,
             'comment': 'Пропущено'
@@ -1255,7 +1261,7 @@ def enter_value_handler(update: Update, context: CallbackContext):
             # Проверяем, что значение не меньше предыдущего
             from check import MeterValidator
             validator = MeterValidator()
-            last_reading = validator._get_last_reading(equipment['Инв. №'], equipment['Счётчик'])
+            last_reading = context.user_data['equipment'].last_reading(equip_index)
             
             if last_reading and value < last_reading['reading']:
                 update.message.reply_text(
@@ -1357,9 +1363,7 @@ def enter_value_handler(update: Update, context: CallbackContext):
             auto_value_message = ""
             
             if comment == "В ремонте":
-                from check import MeterValidator
-                validator = MeterValidator()
-                last_reading = validator._get_last_reading(equipment['Инв. №'], equipment['Счётчик'])
+                last_reading = context.user_data['equipment'].last_reading(equip_index)
                 
                 if last_reading:
                     value = last_reading['reading']
@@ -1437,17 +1441,9 @@ def confirm_readings(update: Update, context: CallbackContext):
     user_data = cursor.fetchone()
     name, location, division = user_data
     
-    # Создаем директорию для отчетов, если не существует
-    os.makedirs('meter_readings', exist_ok=True)
-    
-    # Создаем папку для отчетов текущей недели, если не существует
-    current_week = datetime.now().strftime('%Y-W%U')  # Год-Номер недели
-    report_folder = f'meter_readings/week_{current_week}'
-    os.makedirs(report_folder, exist_ok=True)
-    
-    # Формируем имя файла
+    # Формируем имя файла в папке текущей недели
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    file_path = f'{report_folder}/meters_{location}_{division}_{tab_number}_{timestamp}.xlsx'
+    file_path = f'{get_week_folder()}/meters_{location}_{division}_{tab_number}_{timestamp}.xlsx'
     
     # Добавляем метаданные
     user_info = {
@@ -1461,12 +1457,9 @@ def confirm_readings(update: Update, context: CallbackContext):
     for key, value in user_info.items():
         df[key] = value
     
-    # Сохраняем файл
-    df.to_excel(file_path, index=False)
-    
-    # Валидируем созданный файл
+    # Валидируем введенные показания без промежуточного файла
     validator = MeterValidator()
-    validation_result = validator.validate_file(file_path, user_info)
+    validation_result = validator.validate_file(df, user_info)
     
     if not validation_result['is_valid']:
         errors_text = "\n".join(validation_result['errors'])
@@ -1477,14 +1470,11 @@ def confirm_readings(update: Update, context: CallbackContext):
         else:
             update.message.reply_text(error_message)
         
-        # Удаляем файл с ошибками
-        try:
-            os.remove(file_path)
-        except:
-            pass
-        
         return ConversationHandler.END
     
+    # Сохраняем файл в хранилище загрузок
+    store_frame(df, file_path)
+    
     # Уведомляем пользователя об успешной отправке
     moscow_tz = pytz.timezone('Europe/Moscow')
     moscow_now = datetime.now(moscow_tz)
@@ -1534,7 +1524,7 @@ def handle_ubylo_confirmation(update: Update, context: CallbackContext):
     
     try:
         # Use db_transaction context manager instead of raw cursor
-        with db_transaction() as cursor:
+        with db_transaction(immediate=True) as cursor:
             # 1. Получаем данные запроса
             cursor.execute('''
                 SELECT inv_num, meter_type, user_tab, user_name, location, division, user_chat_id 
@@ -1544,45 +1534,34 @@ def handle_ubylo_confirmation(update: Update, context: CallbackContext):
             request_data = cursor.fetchone()
             
             if not request_data:
-                query.edit_message_text("❌ Запрос не найден или уже обработан")
+                finish_digest_action(query, "❌ Запрос не найден или уже обработан", request_id)
                 return
                 
             inv_num, meter_type, user_tab, user_name, location, division, user_chat_id = request_data
             
             # 2. Находим последний файл пользователя
-            current_week = datetime.now().strftime('%Y-W%U')
-            report_folder = f'meter_readings/week_{current_week}'
-            import glob
-            user_files = glob.glob(f'{report_folder}/*_{location}_{division}_{user_tab}_*.xlsx')
+            latest_file = find_latest_report_file(location, division, user_tab, week=get_current_week())
             
-            if not user_files:
+            if not latest_file:
                 logger.error(f"Файлы пользователя {user_name} не найдены")
-                query.edit_message_text("❌ Файл показаний пользователя не найден")
+                finish_digest_action(query, "❌ Файл показаний пользователя не найден", request_id)
                 return
-                
-            # Берем самый свежий файл
-            latest_file = max(user_files, key=os.path.getctime)
-            
-            # 3. Читаем файл и находим нужную строку
-            df = pd.read_excel(latest_file)
             
-            # Нормализуем данные для сравнения
-            df['Инв. №'] = df['Инв. №'].astype(str).str.strip()
-            search_inv_num = str(inv_num).strip()
-            search_meter_type = str(meter_type).strip().upper()
-            
-            mask = (
-                (df['Инв. №'] == search_inv_num) & 
-                (df['Счётчик'].str.strip().str.upper() == search_meter_type)
-            )
+            # 3. Читаем файл с уже подтвержденными правками и находим нужную строку
+            df = load_submission(latest_file)
+            mask = match_submission_rows(df, inv_num, meter_type)
             
             if not df[mask].empty:
-                # 4. Обновляем данные в файле
-                df.loc[mask, 'Показания'] = None
-                df.loc[mask, 'Комментарий'] = 'Убыло (подтверждено)'
-                
-                # Сохраняем обновленный файл
-                df.to_excel(latest_file, index=False)
+                # 4. Записываем правку; файл не перезаписывается, правки переносятся в него плановым уплотнением
+                ubylo_values = {'Показания': None, 'Комментарий': 'Убыло (подтверждено)'}
+                add_submission_patch(latest_file, inv_num, meter_type, ubylo_values, request_id)
+                patched_df = apply_submission_patches(
+                    df[mask].copy(), [(None, inv_num, meter_type, ubylo_values)]
+                )
+                patched_df['name'] = user_name
+                patched_df['location'] = location
+                patched_df['division'] = division
+                patched_df['tab_number'] = user_tab
                 
                 # 5. Обновляем БД
                 cursor.execute('''
@@ -1593,9 +1572,9 @@ def handle_ubylo_confirmation(update: Update, context: CallbackContext):
                     WHERE request_id = ?
                 ''', (query.from_user.id, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), request_id))
                 
-                # 6. Сохраняем в final_report только после подтверждения
+                # 6. Сохраняем в final_report только подтвержденную строку
                 validator = MeterValidator()
-                save_result = validator.save_to_final_report(df)
+                save_result = validator.save_to_final_report(patched_df)
                 
                 if save_result.get('status') != 'success':
                     error_msg = save_result.get('message', 'Неизвестная ошибка')
@@ -1603,7 +1582,8 @@ def handle_ubylo_confirmation(update: Update, context: CallbackContext):
                 
                 # 7. Уведомляем пользователя
                 try:
-                    context.bot.send_message(
+                    send_message(
+                        context.bot,
                         chat_id=user_chat_id,
                         text=f"✅ Статус 'Убыло' подтверждён для:\n"
                              f"Инв. №: {inv_num}\n"
@@ -1613,26 +1593,30 @@ def handle_ubylo_confirmation(update: Update, context: CallbackContext):
                 except Exception as e:
                     logger.error(f"Ошибка уведомления пользователя: {e}")
                 
-                query.edit_message_text(
+                finish_digest_action(
+                    query,
                     f"✅ Подтверждено 'Убыло' для:\n"
                     f"Инв. №: {inv_num}\n"
                     f"Счётчик: {meter_type}\n"
-                    f"Пользователь: {user_name}"
+                    f"Пользователь: {user_name}",
+                    request_id
                 )
             else:
                 logger.error(f"Не найдена строка: Инв.№ {inv_num}, Счетчик {meter_type}")
                 logger.info(f"Содержимое файла:\n{df[['Инв. №', 'Счётчик']].to_string()}")
                 
-                query.edit_message_text(
+                finish_digest_action(
+                    query,
                     f"❌ Оборудование не найдено в файле пользователя:\n"
                     f"Инв. №: {inv_num}\n"
                     f"Счётчик: {meter_type}\n\n"
-                    f"Пользователь мог изменить файл после отправки запроса."
+                    f"Пользователь мог изменить файл после отправки запроса.",
+                    request_id
                 )
                 
     except Exception as e:
         logger.error(f"Ошибка подтверждения 'Убыло': {e}")
-        query.edit_message_text("❌ Ошибка при обработке запроса")
+        finish_digest_action(query, "❌ Ошибка при обработке запроса", request_id)
 
 def handle_ubylo_rejection(update: Update, context: CallbackContext):
     """Отклонение запроса 'Убыло' с уведомлением пользователя"""
@@ -1642,7 +1626,7 @@ def handle_ubylo_rejection(update: Update, context: CallbackContext):
     request_id = query.data.replace('reject_ubylo_', '')
     
     try:
-        with db_transaction() as cursor:
+        with db_transaction(immediate=True) as cursor:
             # Получаем данные запроса
             cursor.execute('''
                 SELECT inv_num, meter_type, user_tab, user_name, location, division, user_chat_id 
@@ -1652,7 +1636,7 @@ def handle_ubylo_rejection(update: Update, context: CallbackContext):
             request_data = cursor.fetchone()
             
             if not request_data:
-                query.edit_message_text("❌ Запрос не найден или уже обработан")
+                finish_digest_action(query, "❌ Запрос не найден или уже обработан", request_id)
                 return
                 
             inv_num, meter_type, user_tab, user_name, location, division, user_chat_id = request_data
@@ -1668,7 +1652,8 @@ def handle_ubylo_rejection(update: Update, context: CallbackContext):
             
             # Уведомляем пользователя
             try:
-                context.bot.send_message(
+                send_message(
+                    context.bot,
                     chat_id=user_chat_id,
                     text=f"❌ Ваш запрос на отметку 'Убыло' отклонён:\n"
                          f"Инв. №: {inv_num}\n"
@@ -1678,18 +1663,21 @@ def handle_ubylo_rejection(update: Update, context: CallbackContext):
             except Exception as e:
                 logger.error(f"Ошибка уведомления пользователя {user_chat_id}: {e}")
             
-            query.edit_message_text(
+            finish_digest_action(
+                query,
                 f"❌ Запрос 'Убыло' отклонён:\n"
                 f"Инв. №: {inv_num}\n"
                 f"Счётчик: {meter_type}\n"
-                f"Пользователь: {user_name}"
+                f"Пользователь: {user_name}",
+                request_id
             )
             
     except Exception as e:
         logger.error(f"Ошибка отклонения 'Убыло': {e}")
-        query.edit_message_text("❌ Ошибка при обработке запроса")
+        finish_digest_action(query, "❌ Ошибка при обработке запроса", request_id)
 
 
+@heavy_handler(REPORT_PREPARING_TEXT)
 def handle_admin_view(update: Update, context: CallbackContext):
     """Обработка команды просмотра показаний для администратора"""
     if not check_access(update, context):
@@ -1717,31 +1705,28 @@ def handle_admin_view(update: Update, context: CallbackContext):
     location, division = admin_info
     
     # Получаем текущую неделю
-    current_week = datetime.now().strftime('%Y-W%U')
-    report_folder = f'meter_readings/week_{current_week}'
+    current_week = get_current_week()
     
-    if not os.path.exists(report_folder):
+    if not find_report_files(week=current_week):
         update.message.reply_text("За эту неделю еще нет показаний.")
         return
     
     # Собираем все файлы для данного подразделения
-    reports = []
-    for filename in os.listdir(report_folder):
-        if f"_{location}_{division}_" in filename:
-            reports.append(filename)
+    reports = find_report_files(location, division, week=current_week)
     
     if not reports:
         update.message.reply_text(f"Нет показаний для вашего подразделения ({location}, {division}) за эту неделю.")
         return
     
-    # Создаем сводный отчет
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        for report in reports:
-            df = pd.read_excel(os.path.join(report_folder, report))
-            df.to_excel(writer, sheet_name=report[:30], index=False)
+    # Создаем сводный отчет: каждый файл копируется построчно на отдельный лист
+    writer = StreamingExcelWriter()
+    for report_path in reports:
+        with open_submission(report_path) as f:
+            header = read_excel_header(f)
+            f.seek(0)
+            writer.add_sheet(os.path.basename(report_path)[:30], header, iter_excel_rows(f))
+    output = writer.save()
     
-    output.seek(0)
     update.message.reply_document(
         document=InputFile(output, filename=f'Показания_{location}_{division}_{current_week}.xlsx'),
         caption=f"Показания за неделю {current_week} (локация: {location}, подразделение: {division})"
@@ -1765,31 +1750,28 @@ def handle_view_readings(update: Update, context: CallbackContext):
     location, division = admin_info
     
     # Получаем текущую неделю
-    current_week = datetime.now().strftime('%Y-W%U')
-    report_folder = f'meter_readings/week_{current_week}'
+    current_week = get_current_week()
     
-    if not os.path.exists(report_folder):
+    if not find_report_files(week=current_week):
         update.message.reply_text("За эту неделю еще нет показаний.")
         return
     
     # Собираем все файлы для данного подразделения
-    reports = []
-    for filename in os.listdir(report_folder):
-        if f"_{location}_{division}_" in filename:
-            reports.append(filename)
+    reports = find_report_files(location, division, week=current_week)
     
     if not reports:
         update.message.reply_text(f"Нет показаний для вашего подразделения ({location}, {division}) за эту неделю.")
         return
     
-    # Создаем сводный отчет
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        for report in reports:
-            df = pd.read_excel(f"{report_folder}/{report}")
-            df.to_excel(writer, sheet_name=report[:30], index=False)
+    # Создаем сводный отчет: каждый файл копируется построчно на отдельный лист
+    writer = StreamingExcelWriter()
+    for report_path in reports:
+        with open_submission(report_path) as f:
+            header = read_excel_header(f)
+            f.seek(0)
+            writer.add_sheet(os.path.basename(report_path)[:30], header, iter_excel_rows(f))
+    output = writer.save()
     
-    output.seek(0)
     update.message.reply_document(
         document=InputFile(output, filename=f'Показания_{location}_{division}_{current_week}.xlsx'),
         caption=f"Показания за неделю {current_week} (локация: {location}, подразделение: {division})"
@@ -1798,14 +1780,8 @@ def handle_view_readings(update: Update, context: CallbackContext):
 def get_available_users_by_role(role):
     """Получает список доступных пользователей по роли"""
     try:
-        with db_transaction() as cursor:
-            if role == 'Администратор':
-                cursor.execute('SELECT name, chat_id FROM Users_admin_bot')
-            elif role == 'Руководитель':
-                cursor.execute('SELECT name, chat_id FROM Users_dir_bot')
-            else:
-                cursor.execute('SELECT name, chat_id FROM Users_user_bot')
-            return cursor.fetchall()
+        role = role if role in ROLE_TABLES else 'Пользователь'
+        return [(person.name, person.chat_id) for person in roster.members(role)]
     except Exception as e:
         logger.error(f"Ошибка получения пользователей по роли {role}: {e}")
         return []
@@ -1822,7 +1798,7 @@ def handle_disagree_with_errors(update: Update, context: CallbackContext):
     validation_result = context.user_data['validation_result']
     file_path = context.user_data['file_path']
     
-    if not file_path or not os.path.exists(file_path):
+    if not file_path or not report_file_exists(file_path):
         query.edit_message_text("Ошибка: файл с показаниями не найден.")
         return ConversationHandler.END
     
@@ -1872,7 +1848,8 @@ def notify_admin_about_disagreement(context: CallbackContext, user_info: dict, f
                 reply_markup = InlineKeyboardMarkup(keyboard)
                 
                 # Отправляем сообщение администратору
-                context.bot.send_message(
+                send_message(
+                    context.bot,
                     chat_id=admin_chat_id,
                     text=f"⚠️ Пользователь не согласен с ошибками\n\n"
                          f"👤 Пользователь: {user_info['name']}\n"
@@ -1884,17 +1861,19 @@ def notify_admin_about_disagreement(context: CallbackContext, user_info: dict, f
                 )
                 
                 # Проверяем существование файла перед отправкой
-                if os.path.exists(file_path):
+                if report_file_exists(file_path):
                     # Отправляем файл администратору
-                    with open(file_path, 'rb') as f:
-                        context.bot.send_document(
+                    with open_report_file(file_path) as f:
+                        send_document(
+                            context.bot,
                             chat_id=admin_chat_id,
-                            document=f,
+                            document=InputFile(f, filename=os.path.basename(file_path)),
                             caption=f"Файл с показаниями от {user_info['name']}"
                         )
                 else:
                     logger.error(f"Файл не найден: {file_path}")
-                    context.bot.send_message(
+                    send_message(
+                        context.bot,
                         chat_id=admin_chat_id,
                         text=f"⚠️ Файл с показаниями не найден или был удалён."
                     )
@@ -1966,22 +1945,18 @@ def handle_admin_submit(update: Update, context: CallbackContext):
     name, location, division = user_data
 
     # Ищем последний файл, отправленный пользователем
-    current_week = datetime.now().strftime('%Y-W%U')
-    report_folder = f'meter_readings/week_{current_week}'
-    import glob
-    user_files = glob.glob(f'{report_folder}/*_{location}_{division}_{user_tab}_*.xlsx')
+    latest_file = find_latest_report_file(location, division, user_tab, week=get_current_week())
     
-    if not user_files:
+    if not latest_file:
         query.edit_message_text("Пользователь еще не отправлял показания.")
         return
     
-    # Берем самый свежий файл
-    latest_file = max(user_files, key=os.path.getctime)
-    
     try:
         # Отправляем файл администратору
-        with open(latest_file, 'rb') as f:
-            context.bot.send_document(
+        with open_submission(latest_file) as f:
+            send_document(
+                context.bot,
+                priority=PRIORITY_REPLY,
                 chat_id=query.message.chat_id,
                 document=InputFile(f, filename=f'Показания_{name}.xlsx'),
                 caption=f"Файл показаний пользователя {name}"
@@ -2025,27 +2000,27 @@ def handle_admin_excel_file(update: Update, context: CallbackContext):
             update.message.reply_text("Ошибка: не удалось определить пользователя.")
             return ConversationHandler.END
 
-        # Создаем папку для отчетов
-        current_week = datetime.now().strftime('%Y-W%U')
-        report_folder = f'meter_readings/week_{current_week}'
-        os.makedirs(report_folder, exist_ok=True)
-
         # Сохраняем файл с пометкой, что отправлено администратором
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         file_path = os.path.join(
-            report_folder,
+            get_week_folder(),
             f'meters_admin_{user_tab}_{timestamp}.xlsx'
         )
-        new_file.download(file_path)
+        buffer = io.BytesIO()
+        new_file.download(out=buffer)
+        file_bytes = buffer.getvalue()
+        buffer.seek(0)
 
         # Валидация и сохранение файла
         validator = MeterValidator()
-        save_result = validator.save_to_final_report(file_path, user_tab)
+        save_result = validator.save_to_final_report(pd.read_excel(buffer), user_tab)
         
         if save_result.get('status') != 'success':
+            store_upload(file_bytes, file_path, UPLOAD_REJECTED)
             error_msg = save_result.get('message', 'Неизвестная ошибка')
             update.message.reply_text(f"❌ Ошибка сохранения: {error_msg}")
             return
+        store_upload(file_bytes, file_path, UPLOAD_ACCEPTED)
 
         # Уведомляем пользователя
         try:
@@ -2057,7 +2032,8 @@ def handle_admin_excel_file(update: Update, context: CallbackContext):
                 
                 if user_data:
                     user_name, user_chat_id = user_data
-                    context.bot.send_message(
+                    send_message(
+                        context.bot,
                         chat_id=user_chat_id,
                         text=f"✅ Администратор отправил показания за вас"
                     )
@@ -2082,26 +2058,8 @@ def handle_admin_excel_file(update: Update, context: CallbackContext):
 def update_admin_chat_ids(context: CallbackContext):
     """Обновление chat_id администраторов в базе данных"""
     try:
-        with db_transaction() as cursor:
-            
-            cursor.execute('SELECT tab_number, name FROM Users_admin_bot')
-        admins = cursor.fetchall()
-        
-        updated_count = 0
-        for admin_tab, admin_name in admins:
-            try:
-                chat = context.bot.get_chat(admin_tab)
-                cursor.execute('''
-                    UPDATE Users_admin_bot 
-                    SET chat_id = ? 
-                    WHERE tab_number = ? AND (chat_id IS NULL OR chat_id != ?)
-                ''', (chat.id, admin_tab, chat.id))
-                if cursor.rowcount > 0:
-                    updated_count += 1
-                    logger.info(f"Обновлен chat_id для администратора {admin_name}")
-            except Exception as e:
-                logger.error(f"Ошибка обновления chat_id для администратора {admin_name}: {e}")
-        logger.info(f"Обновлено chat_id для {updated_count} администраторов")
+        # Проверяются только chat_id, не подтвержденные за CHAT_RESOLVE_TTL
+        chat_resolver.refresh(context.bot)
     except Exception as e:
         logger.error(f"Ошибка при массовом обновлении chat_id администраторов: {e}")
 
@@ -2151,9 +2109,10 @@ def handle_admin_action(update: Update, context: CallbackContext):
                 query.edit_message_text(f"Для локации {request_data['user_location']} и подразделения {request_data['user_division']} нет оборудования.")
                 return
                 
-            context.user_data['equipment'] = equipment.to_dict('records')
+            context.user_data['equipment'] = EquipmentSequence.from_frame(equipment) \
+                .prefetch_last_readings(get_last_readings)
             context.user_data['current_index'] = 0
-            context.user_data['readings'] = []
+            context.user_data['readings'] = ReadingLog()
             
             return show_next_equipment(update, context)
             
@@ -2170,7 +2129,8 @@ def handle_admin_action(update: Update, context: CallbackContext):
         elif action == 'reject':
             # Отклоняем несогласие
             try:
-                context.bot.send_message(
+                send_message(
+                    context.bot,
                     chat_id=request_data['user_chat_id'],
                     text=f"❌ Администратор отклонил ваше несогласие с ошибками.\n\n"
                          f"Пожалуйста, проверьте данные и отправьте показания заново."
@@ -2213,14 +2173,13 @@ def handle_admin_reading_input(update: Update, context: CallbackContext):
             update.message.reply_text("Ошибка: показание не может быть отрицательным.")
             return ENTER_ADMIN_READING
         
-        validator = MeterValidator()
-        last_reading = validator._get_last_reading(equipment['Инв. №'], equipment['Счётчик'])
+        last_reading = equipment_list.last_reading(current_index)
         
         if last_reading and value < last_reading['reading']:
             update.message.reply_text(f"Ошибка: новое показание меньше предыдущего ({last_reading['reading']}).")
             return ENTER_ADMIN_READING
         
-        context.user_data.setdefault('readings_admin', []).append({
+        context.user_data.setdefault('readings_admin', ReadingLog()).append({
             'equipment': equipment,
             'value': value,
             'comment': ''
@@ -2249,11 +2208,10 @@ def handle_admin_reading_button(update: Update, context: CallbackContext):
 
     current_index = context.user_data['current_index']
     equipment = context.user_data['equipment'][current_index]
-    validator = MeterValidator()
 
     if query.data == 'repair':
         # Для "В ремонте" используем последнее показание
-        last_reading = validator._get_last_reading(equipment['Инв. №'], equipment['Счётчик'])
+        last_reading = context.user_data['equipment'].last_reading(current_index)
         
         if last_reading:
             context.user_data['readings'].append({
@@ -2272,6 +2230,7 @@ def handle_admin_reading_button(update: Update, context: CallbackContext):
 
     elif query.data == 'ubylo':
         # Обработка "Убыло"
+        validator = MeterValidator()
         result = validator.handle_ubylo_status(
             context,
             equipment['Инв. №'],
@@ -2340,15 +2299,10 @@ def finish_admin_readings(update: Update, context: CallbackContext):
         location = context.user_data['user_location']
         division = context.user_data['user_division']
 
-        # Create report folder
-        current_week = datetime.now().strftime('%Y-W%U')
-        report_folder = f'meter_readings/week_{current_week}'
-        os.makedirs(report_folder, exist_ok=True)
-
         # Prepare filename
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f'meters_{location}_{division}_{user_tab}_admin_{timestamp}.xlsx'
-        file_path = os.path.join(report_folder, filename)
+        file_path = os.path.join(get_week_folder(), filename)
 
         # Create DataFrame from readings
         readings = context.user_data.get('readings_admin', [])
@@ -2377,12 +2331,9 @@ def finish_admin_readings(update: Update, context: CallbackContext):
         df['submitted_by'] = admin_name
         df['timestamp'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-        # Save file
-        df.to_excel(file_path, index=False)
-
-        # Validate file
+        # Validate readings
         validator = MeterValidator()
-        validation_result = validator.validate_file(file_path, {
+        validation_result = validator.validate_file(df, {
             'name': user_name,
             'location': location,
             'division': division,
@@ -2392,12 +2343,15 @@ def finish_admin_readings(update: Update, context: CallbackContext):
         if not validation_result['is_valid']:
             errors = "\n".join(validation_result['errors'])
             update.message.reply_text(f"Ошибки при проверке:\n{errors}")
-            os.remove(file_path)
             return
 
+        # Save file
+        store_frame(df, file_path)
+
         # Notify user
         try:
-            context.bot.send_message(
+            send_message(
+                context.bot,
                 chat_id=user_tab,
                 text=f"✅ Администратор {admin_name} отправил показания за вас\n"
                      f"📍 Локация: {location}\n"
@@ -2425,6 +2379,7 @@ def finish_admin_readings(update: Update, context: CallbackContext):
         update.message.reply_text("❌ Ошибка при сохранении показаний")
         return ConversationHandler.END
 
+@heavy_handler(REPORT_PREPARING_TEXT)
 def handle_view_week_report(update: Update, context: CallbackContext):
     """Обработка запроса на просмотр показаний за неделю"""
     if not check_access(update, context):
@@ -2458,7 +2413,13 @@ def handle_view_week_report(update: Update, context: CallbackContext):
             
         location, division = user_info
         
-        # Получаем данные из final_report для этой локации и подразделения
+        columns = [
+            'Гос. номер', 'Инв. №', 'Счётчик', 'Показания', 'Комментарий',
+            'Наименование', 'Дата', 'Подразделение', 'Локация', 'Отправитель'
+        ]
+        
+        # Строки из final_report пишутся в Excel прямо из курсора, без промежуточного DataFrame
+        writer = StreamingExcelWriter()
         with db_transaction() as cursor:
             cursor.execute('''
                 SELECT 
@@ -2469,9 +2430,9 @@ def handle_view_week_report(update: Update, context: CallbackContext):
                 ORDER BY date DESC
             ''', (location, division))
             
-            report_data = cursor.fetchall()
+            rows_count = writer.add_cursor('Показания', columns, cursor)
             
-        if not report_data:
+        if not rows_count:
             update.message.reply_text(
                 f"За эту неделю нет данных в отчете для:\n"
                 f"📍 Локация: {location}\n"
@@ -2479,18 +2440,7 @@ def handle_view_week_report(update: Update, context: CallbackContext):
             )
             return
             
-        # Создаем DataFrame
-        columns = [
-            'Гос. номер', 'Инв. №', 'Счётчик', 'Показания', 'Комментарий',
-            'Наименование', 'Дата', 'Подразделение', 'Локация', 'Отправитель'
-        ]
-        df = pd.DataFrame(report_data, columns=columns)
-        
-        # Сохраняем в Excel
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Показания')
-        output.seek(0)
+        output = writer.save()
         
         # Формируем имя файла
         current_week = datetime.now().strftime('%Y-W%U')
@@ -2510,27 +2460,14 @@ def handle_view_week_report(update: Update, context: CallbackContext):
 
 def get_accessible_reports(location: str, division: str, role: str) -> list:
     """Возвращает список доступных отчетов"""
-    current_week = datetime.now().strftime('%Y-W%U')
-    report_folder = f'meter_readings/week_{current_week}'
-    
-    if not os.path.exists(report_folder):
+    if role == 'Администратор':
+        reports = find_report_files(location, division, week=get_current_week())
+    elif role == 'Руководитель':
+        reports = find_report_files(location, week=get_current_week())
+    else:
         return []
-        
-    accessible = []
-    for filename in os.listdir(report_folder):
-        parts = filename.split('_')
-        if len(parts) < 4:
-            continue
-            
-        file_loc = parts[1]
-        file_div = parts[2]
-        
-        if role == 'Администратор' and file_loc == location and file_div == division:
-            accessible.append(filename)
-        elif role == 'Руководитель' and file_loc == location:
-            accessible.append(filename)
     
-    return accessible
+    return [os.path.basename(path) for path in reports]
 
 def handle_manager_submit(update: Update, context: CallbackContext):
     """Обработка отправки показаний руководителем за пользователя"""
@@ -2603,22 +2540,20 @@ def handle_manager_excel_file(update: Update, context: CallbackContext):
         division = context.user_data['user_division']
         user_chat_id = context.user_data['user_chat_id']
 
-        # Создаем папку для отчетов
-        current_week = datetime.now().strftime('%Y-W%U')
-        report_folder = f'meter_readings/week_{current_week}'
-        os.makedirs(report_folder, exist_ok=True)
-
         # Сохраняем файл с пометкой, что отправлено руководителем
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         file_path = os.path.join(
-            report_folder,
+            get_week_folder(),
             f'meters_{location}_{division}_{user_tab}_manager_{timestamp}.xlsx'
         )
-        new_file.download(file_path)
+        buffer = io.BytesIO()
+        new_file.download(out=buffer)
+        file_bytes = buffer.getvalue()
+        buffer.seek(0)
 
         # Валидация файла
         validator = MeterValidator()
-        validation_result = validator.validate_file(file_path, {
+        validation_result = validator.validate_file(pd.read_excel(buffer), {
             'name': user_name,
             'location': location,
             'division': division,
@@ -2631,12 +2566,14 @@ def handle_manager_excel_file(update: Update, context: CallbackContext):
                 f"Ошибки в файле:\n{errors}\n\n"
                 "Пожалуйста, исправьте и отправьте файл снова."
             )
-            os.remove(file_path)
+            store_upload(file_bytes, file_path, UPLOAD_REJECTED)
             return WAIT_MANAGER_EXCEL
+        store_upload(file_bytes, file_path, UPLOAD_ACCEPTED)
 
         # Уведомляем пользователя
         try:
-            context.bot.send_message(
+            send_message(
+                context.bot,
                 chat_id=user_chat_id,
                 text=f"✅ Руководитель отправил показания за вас:\n\n"
                      f"📍 Локация: {location}\n"
@@ -2695,23 +2632,16 @@ def finish_manager_readings(update: Update, context: CallbackContext):
         df['timestamp'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         df['submitted_by_manager'] = update.effective_user.id  # ID руководителя
 
-        # Создаем папку для отчетов
-        current_week = datetime.now().strftime('%Y-W%U')
-        report_folder = f'meter_readings/week_{current_week}'
-        os.makedirs(report_folder, exist_ok=True)
-
         # Сохраняем файл
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         file_path = os.path.join(
-            report_folder,
+            get_week_folder(),
             f'meters_{location}_{division}_{user_tab}_manager_{timestamp}.xlsx'
         )
 
-        df.to_excel(file_path, index=False)
-
-        # Валидация файла
+        # Валидация показаний
         validator = MeterValidator()
-        validation_result = validator.validate_file(file_path, {
+        validation_result = validator.validate_file(df, {
             'name': user_name,
             'location': location,
             'division': division,
@@ -2724,12 +2654,14 @@ def finish_manager_readings(update: Update, context: CallbackContext):
                 f"Ошибки при проверке показаний:\n{errors}\n\n"
                 "Пожалуйста, попробуйте снова."
             )
-            os.remove(file_path)
             return ConversationHandler.END
 
+        store_frame(df, file_path)
+
         # Уведомляем пользователя
         try:
-            context.bot.send_message(
+            send_message(
+                context.bot,
                 chat_id=user_chat_id,
                 text=f"✅ Руководитель отправил показания за вас:\n\n"
                      f"📍 Локация: {location}\n"
@@ -2791,7 +2723,7 @@ def cleanup_old_requests(context: CallbackContext):
     
 def main():
     # Инициализация бота
-    updater = Updater(token=os.getenv('BOT_TOKEN'), use_context=True)
+    updater = create_updater()
     dp = updater.dispatcher
     job_queue = updater.job_queue
     
@@ -2816,12 +2748,37 @@ def main():
         days=(0, 1, 2, 3, 4, 5, 6),
         name="daily_admin_chat_id_update"
     )
-
+    
+    # Импорт изменений из выгрузок 1С каждую ночь в 01:00
     job_queue.run_daily(
-        update_admin_chat_ids,
-        time=time(hour=8, minute=0, tzinfo=moscow_tz),
+        import_1c_job,
+        time=time(hour=1, minute=0, tzinfo=moscow_tz),
         days=(0, 1, 2, 3, 4, 5, 6),
-        name="daily_admin_chat_id_update"
+        name="nightly_1c_import"
+    )
+    
+    # Архивация старых папок с показаниями по воскресеньям в 03:00
+    job_queue.run_daily(
+        archive_old_reports_job,
+        time=time(hour=3, minute=0, tzinfo=moscow_tz),
+        days=(6,),
+        name="weekly_reports_archive"
+    )
+    
+    # Перенос подтвержденных правок в файлы показаний каждый день в 02:30
+    job_queue.run_daily(
+        compact_patches_job,
+        time=time(hour=2, minute=30, tzinfo=moscow_tz),
+        days=(0, 1, 2, 3, 4, 5, 6),
+        name="daily_patches_compaction"
+    )
+    
+    # Очистка отклоненных загрузок и блобов без ссылок каждый день в 03:30
+    job_queue.run_daily(
+        cleanup_uploads_job,
+        time=time(hour=3, minute=30, tzinfo=moscow_tz),
+        days=(0, 1, 2, 3, 4, 5, 6),
+        name="daily_uploads_cleanup"
     )
     
     # Обработчик ввода табельного номера
@@ -2871,6 +2828,29 @@ def main():
     dp.add_handler(conv_handler)
     logger.info("Зарегистрирован обработчик диалога ввода табельного номера")
     
+    # Пакетный ввод регистрируется до общего обработчика текста, чтобы получать строки показаний
+    dp.add_handler(ConversationHandler(
+        entry_points=[
+            CallbackQueryHandler(start_bulk_input, pattern='^enter_bulk$')
+        ],
+        states={
+            ENTER_BULK_READINGS: [
+                MessageHandler(
+                    Filters.text & ~Filters.command & ~Filters.regex('^(Отмена|В начало)$'),
+                    handle_bulk_readings,
+                    run_async=True
+                )
+            ]
+        },
+        fallbacks=[
+            CommandHandler('cancel', cancel),
+            MessageHandler(Filters.regex('^Отмена$'), cancel)
+        ],
+        per_chat=True,
+        per_user=True,
+        name="bulk_readings_conversation"
+    ))
+    
     dp.add_handler(MessageHandler(Filters.regex('^(В начало)$'), handle_button))
     dp.add_handler(MessageHandler(Filters.regex('^Загрузить показания$'), handle_upload_readings))
     dp.add_handler(MessageHandler(Filters.regex('^(Посмотреть показания за эту неделю)$'), handle_button))
@@ -2946,7 +2926,8 @@ def main():
         ],
         states={
             WAITING_FOR_CHOICE: [
-                CallbackQueryHandler(readings_choice_handler)
+                # enter_bulk обрабатывает только диалог пакетного ввода
+                CallbackQueryHandler(readings_choice_handler, pattern='^(upload_excel|enter_readings)$')
             ],
             ENTER_READING_VALUE: [
                 MessageHandler(Filters.text & ~Filters.command, process_reading_input),
@@ -3021,79 +3002,174 @@ def main():
         pattern='^reject_ubylo_'
     ))
     
-    # Запуск бота
+    # Очередь исходящих сообщений и запись ее метрик в лог каждые 15 минут
+    outbound.start()
+    job_queue.run_repeating(log_outbound_metrics_job, interval=900, first=900, name="outbound_metrics")
+    
+    # Процессы разбора Excel запускаются до начала приема сообщений
+    worker_pool.start()
+    
+    # Справочник сотрудников загружается заранее, чтобы первый вход не ждал чтения файла
+    users_directory.refresh()
+    # Изменения Equipment.xlsx, сделанные пока бот был остановлен, переносятся в таблицу equipment
+    if os.path.exists(EQUIPMENT_FILE):
+        run_import('equipment', EQUIPMENT_FILE)
+    # Часовые пояса и сроки подачи для известных локаций
+    location_registry.refresh()
+    # Дальше справочники обновляются только при изменении файлов
+    start_reference_watcher()
+    
+    # Запуск бота в режиме polling или webhook (BOT_MODE)
     logger.info("Запуск бота...")
-    updater.start_polling()
-    logger.info("Бот успешно запущен и ожидает сообщений")
-    updater.idle()
+    run_bot(updater)
+    
+    # Отправляем накопленные сводки и дожидаемся отправки очереди
+    reference_watcher.stop()
+    worker_pool.shutdown()
+    digest.flush_all()
+    outbound.stop()
 
 # Инициализация базы данных
 def init_database():
     try:
         logger.info("Инициализация базы данных")
-        with db_transaction() as cursor:
+        with db_transaction(immediate=True) as cursor:
             
+            # Все сотрудники бота в одной таблице с ролью
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS Users_admin_bot (
+                CREATE TABLE IF NOT EXISTS people (
                     tab_number INTEGER PRIMARY KEY,
                     name TEXT NOT NULL,
-                    role TEXT DEFAULT 'Администратор',
+                    role TEXT NOT NULL DEFAULT 'Пользователь',
                     chat_id INTEGER NOT NULL,
                     location TEXT,
                     division TEXT
                 )''')
-
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS Users_user_bot (
-                    tab_number INTEGER PRIMARY KEY,
-                    name TEXT NOT NULL,
-                    role TEXT DEFAULT 'Пользователь',
-                    chat_id INTEGER NOT NULL,
-                    location TEXT,
-                    division TEXT
-                )''')
-
+                CREATE INDEX IF NOT EXISTS idx_people_division
+                ON people (division, role)
+            ''')
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS Users_dir_bot (
-                    tab_number INTEGER PRIMARY KEY,
-                    name TEXT NOT NULL,
-                    role TEXT DEFAULT 'Руководитель',
-                    chat_id INTEGER NOT NULL,
-                    location TEXT,
-                    division TEXT
-                )''')
-            
-            # Создаем таблицу для смен
+                CREATE INDEX IF NOT EXISTS idx_people_location_division
+                ON people (location, division)
+            ''')
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS shifts (
-                    tab_number INTEGER PRIMARY KEY,
-                    name TEXT NOT NULL,
-                    is_on_shift TEXT DEFAULT 'НЕТ',
-                    FOREIGN KEY (tab_number) REFERENCES Users_user_bot(tab_number)
-                )
+                CREATE INDEX IF NOT EXISTS idx_people_chat_id
+                ON people (chat_id)
             ''')
             
-            # Создаем таблицу для ежедневных статусов
+            # Прежние таблицы по ролям переносятся в people и заменяются представлениями.
+            # При повторе табельного номера остается запись с более высокой ролью.
+            for role, table in ROLE_TABLES.items():
+                cursor.execute("SELECT type FROM sqlite_master WHERE name = ?", (table,))
+                existing = cursor.fetchone()
+                if existing and existing[0] == 'table':
+                    cursor.execute(f'''
+                        INSERT OR IGNORE INTO people (tab_number, name, role, chat_id, location, division)
+                        SELECT tab_number, name, ?, chat_id, location, division FROM {table}
+                    ''', (role,))
+                    cursor.execute(f'DROP TABLE {table}')
+                    logger.info(f"Таблица {table} перенесена в people")
+                
+                cursor.execute(f'''
+                    CREATE VIEW IF NOT EXISTS {table} AS
+                    SELECT tab_number, name, role, chat_id, location, division
+                    FROM people WHERE role = '{role}'
+                ''')
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS {table}_insert INSTEAD OF INSERT ON {table}
+                    BEGIN
+                        INSERT INTO people (tab_number, name, role, chat_id, location, division)
+                        VALUES (NEW.tab_number, NEW.name, '{role}', NEW.chat_id, NEW.location, NEW.division)
+                        ON CONFLICT(tab_number) DO UPDATE SET
+                            name = excluded.name, role = excluded.role, chat_id = excluded.chat_id,
+                            location = excluded.location, division = excluded.division;
+                    END
+                ''')
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS {table}_update INSTEAD OF UPDATE ON {table}
+                    BEGIN
+                        UPDATE people SET
+                            tab_number = NEW.tab_number, name = NEW.name, chat_id = NEW.chat_id,
+                            location = NEW.location, division = NEW.division
+                        WHERE tab_number = OLD.tab_number AND role = '{role}';
+                    END
+                ''')
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS {table}_delete INSTEAD OF DELETE ON {table}
+                    BEGIN
+                        DELETE FROM people WHERE tab_number = OLD.tab_number AND role = '{role}';
+                    END
+                ''')
+            
+            # Вахты хранятся интервалами одинакового статуса, даты в формате ГГГГ-ММ-ДД
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS daily_shifts (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    date TEXT NOT NULL,
+                CREATE TABLE IF NOT EXISTS shift_intervals (
                     employee_name TEXT NOT NULL,
+                    start_date TEXT NOT NULL,
+                    end_date TEXT NOT NULL,
                     status TEXT NOT NULL,
-                    UNIQUE(date, employee_name)
+                    PRIMARY KEY (employee_name, start_date)
                 )
             ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_shift_intervals_dates
+                ON shift_intervals (start_date, end_date)
+            ''')
+            
+            # Прежние ежедневные статусы переносятся в интервалы, флаг вахты больше не нужен
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'daily_shifts'")
+            if cursor.fetchone():
+                cursor.execute('SELECT date, employee_name, status FROM daily_shifts')
+                daily = pd.DataFrame(cursor.fetchall(), columns=['date', 'employee_name', 'status'])
+                cursor.executemany('''
+                    INSERT OR IGNORE INTO shift_intervals (employee_name, start_date, end_date, status)
+                    VALUES (?, ?, ?, ?)
+                ''', build_intervals(daily).to_numpy().tolist())
+                cursor.execute('DROP TABLE daily_shifts')
+                logger.info(f"Таблица daily_shifts перенесена в shift_intervals: {len(daily)} строк")
+            cursor.execute('DROP TABLE IF EXISTS shifts')
 
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS equipment (
                     inventory_number TEXT NOT NULL,
                     meter_type TEXT NOT NULL,
+                    gov_number TEXT,
                     location TEXT,
                     division TEXT,
                     status TEXT DEFAULT 'active',
                     PRIMARY KEY (inventory_number, meter_type)
                 )
             ''')
+            cursor.execute('PRAGMA table_info(equipment)')
+            if 'gov_number' not in [row[1] for row in cursor.fetchall()]:
+                cursor.execute('ALTER TABLE equipment ADD COLUMN gov_number TEXT')
+            
+            # Хэши строк последнего импорта выгрузок 1С и журнал запусков
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS import_rows (
+                    source TEXT NOT NULL,
+                    row_key TEXT NOT NULL,
+                    row_hash TEXT NOT NULL,
+                    PRIMARY KEY (source, row_key)
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS import_journal (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    source TEXT NOT NULL,
+                    origin TEXT,
+                    started_at DATETIME NOT NULL,
+                    finished_at DATETIME NOT NULL,
+                    total_rows INTEGER DEFAULT 0,
+                    inserted INTEGER DEFAULT 0,
+                    updated INTEGER DEFAULT 0,
+                    deleted INTEGER DEFAULT 0,
+                    unchanged INTEGER DEFAULT 0,
+                    status TEXT NOT NULL,
+                    message TEXT
+                )
+            ''')
 
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS final_report (
@@ -3112,6 +3188,10 @@ def init_database():
                     UNIQUE(gov_number, inv_number, meter_type, date)
                 )
             ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_final_report_meter
+                ON final_report (inv_number, meter_type, date)
+            ''')
 
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS pending_requests (
@@ -3129,14 +3209,96 @@ def init_database():
                     user_chat_id INTEGER NOT NULL
                 )
             ''')
+
+            # Индекс файлов показаний, перенесенных в архив
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS archived_reports (
+                    path TEXT PRIMARY KEY,
+                    archive_path TEXT NOT NULL,
+                    member_name TEXT NOT NULL,
+                    folder TEXT NOT NULL,
+                    location TEXT,
+                    division TEXT,
+                    tab_number INTEGER,
+                    source TEXT,
+                    report_timestamp DATETIME,
+                    size INTEGER
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_archived_reports_user
+                ON archived_reports (location, division, tab_number)
+            ''')
+
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS archive_log (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    folder TEXT NOT NULL,
+                    archive_path TEXT NOT NULL,
+                    files_count INTEGER NOT NULL,
+                    original_bytes INTEGER NOT NULL,
+                    archived_bytes INTEGER NOT NULL,
+                    saved_bytes INTEGER NOT NULL,
+                    created_at DATETIME NOT NULL
+                )
+            ''')
+
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS upload_blobs (
+                    hash TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    ref_count INTEGER NOT NULL DEFAULT 0,
+                    created_at DATETIME NOT NULL
+                )
+            ''')
+
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS upload_manifest (
+                    path TEXT PRIMARY KEY,
+                    blob_hash TEXT NOT NULL,
+                    folder TEXT,
+                    location TEXT,
+                    division TEXT,
+                    tab_number INTEGER,
+                    source TEXT,
+                    status TEXT NOT NULL DEFAULT 'accepted',
+                    report_timestamp DATETIME,
+                    created_at DATETIME NOT NULL,
+                    FOREIGN KEY (blob_hash) REFERENCES upload_blobs(hash)
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_upload_manifest_user
+                ON upload_manifest (location, division, tab_number)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_upload_manifest_folder
+                ON upload_manifest (folder, status)
+            ''')
+
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS submission_patches (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    path TEXT NOT NULL,
+                    inv_num TEXT NOT NULL,
+                    meter_type TEXT NOT NULL,
+                    patch TEXT NOT NULL,
+                    request_id TEXT,
+                    created_at DATETIME NOT NULL
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_submission_patches_path
+                ON submission_patches (path)
+            ''')
         logger.info("База данных успешно инициализирована")
         
         # Выполняем миграцию, если необходимо
     except Exception as e:
         logger.error(f"Ошибка при инициализации базы данных: {e}")
 
-# Вызываем инициализацию при запуске
-init_database()
-
 if __name__ == '__main__':
+    # Инициализация БД только при запуске бота: процессы разбора Excel
+    # (spawn) и повторный импорт main не должны менять схему
+    init_database()
     main()
\ No newline at end of file
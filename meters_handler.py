@@ -5,12 +5,24 @@ import io
 import os
 from datetime import time, datetime, timedelta
 import pytz
-import sqlite3
 import logging
 from typing import List, Tuple
-import glob
-from time_utils import RUSSIAN_TIMEZONES
+from time_utils import location_registry
 from db_utils import db_transaction
+from outbound_queue import send_message, send_document, PRIORITY_BROADCAST
+from notification_digest import notify
+from worker_pool import heavy_handler, parse_excel, FILE_ACCEPTED_TEXT
+from template_service import equipment_templates
+from session_state import EquipmentSequence
+from check import get_last_readings
+from roster import roster
+from shift_store import shift_store
+from report_writer import StreamingExcelWriter, read_excel_header, iter_excel_rows
+from report_storage import (
+    get_current_week, get_week_folder, find_report_files, find_latest_report_file,
+    open_report_file, open_submission, report_file_exists, store_upload,
+    UPLOAD_ACCEPTED, UPLOAD_REJECTED
+)
 
 # Настройка логгирования
 logging.basicConfig(
@@ -19,64 +31,25 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-conn = sqlite3.connect('Users_bot.db', check_same_thread=False)
-cursor = conn.cursor()
+# Напоминания: местный час отправки, растяжка отправки внутри часового пояса и размер пачки
+REMINDER_LOCAL_HOUR = int(os.getenv('REMINDER_LOCAL_HOUR', 8))
+REMINDER_SPREAD_MINUTES = int(os.getenv('REMINDER_SPREAD_MINUTES', 30))
+REMINDER_BATCH_SIZE = int(os.getenv('REMINDER_BATCH_SIZE', 10))
 
 # Состояния для ConversationHandler
 WAITING_FOR_METERS_DATA = 1
 
 def get_timezone_for_location(location: str) -> str:
     """Определяем часовой пояс по названию локации"""
-    # Проверяем первые 5 букв локации
-    location_prefix = location.strip()[:5].capitalize()
-    
-    if location_prefix in RUSSIAN_TIMEZONES:
-        return RUSSIAN_TIMEZONES[location_prefix]
-    
-    # Если не нашли по первым 5 буквам, пробуем найти по содержанию
-    location_lower = location.lower()
-    
-    # Поиск по наиболее характерным частям названий
-    if 'москв' in location_lower:
-        return 'Europe/Moscow'
-    elif 'калин' in location_lower:
-        return 'Europe/Kaliningrad'
-    elif 'самар' in location_lower or 'саратов' in location_lower:
-        return 'Europe/Samara'
-    elif 'екатер' in location_lower or 'свердл' in location_lower:
-        return 'Asia/Yekaterinburg'
-    elif 'омск' in location_lower:
-        return 'Asia/Omsk'
-    elif 'красноярск' in location_lower:
-        return 'Asia/Krasnoyarsk'
-    elif 'краснодар' in location_lower:
-        return 'Europe/Moscow'
-    elif 'иркут' in location_lower or 'бурят' in location_lower:
-        return 'Asia/Irkutsk'
-    elif 'якут' in location_lower or 'саха' in location_lower:
-        return 'Asia/Yakutsk'
-    elif 'владив' in location_lower or 'примор' in location_lower:
-        return 'Asia/Vladivostok'
-    elif 'магад' in location_lower or 'сахал' in location_lower:
-        return 'Asia/Magadan'
-    elif 'камчат' in location_lower or 'чукот' in location_lower:
-        return 'Asia/Kamchatka'
-    
-    # По умолчанию возвращаем московское время
-    return 'Europe/Moscow'
+    return location_registry.timezone_name(location)
 
 def get_local_datetime(location: str) -> datetime:
     """Получает текущее время в указанной локации"""
-    timezone_str = get_timezone_for_location(location)
-    timezone = pytz.timezone(timezone_str)
-    return datetime.now(timezone)
+    return location_registry.now(location)
 
 def format_datetime_for_timezone(dt: datetime, location: str) -> str:
     """Форматирует дату/время с учетом часового пояса локации"""
-    timezone_str = get_timezone_for_location(location)
-    timezone = pytz.timezone(timezone_str)
-    local_dt = dt.astimezone(timezone)
-    return local_dt.strftime('%Y-%m-%d %H:%M:%S (%Z)')
+    return location_registry.format_datetime(dt, location)
 
 def get_equipment_data() -> pd.DataFrame:
     """Получаем данные об оборудовании из 1С:ERP (заглушка)"""
@@ -108,14 +81,10 @@ def get_equipment_data() -> pd.DataFrame:
 def get_users_on_shift() -> List[Tuple[int, str, str, str]]:
     """Получаем список пользователей на вахте"""
     try:
-        with db_transaction() as cursor:
-            cursor.execute('''
-                SELECT u.tab_number, u.name, u.location, u.division 
-                FROM Users_user_bot u
-                JOIN shifts s ON u.tab_number = s.tab_number
-                WHERE s.is_on_shift = "ДА"
-            ''')
-            return cursor.fetchall()
+        return [
+            (person.tab_number, person.name, person.location, person.division)
+            for person in shift_store.users_on_shift()
+        ]
     except Exception as e:
         logger.error(f"Ошибка получения пользователей на вахте: {e}")
         return []
@@ -134,11 +103,12 @@ def schedule_weekly_reminders(context: CallbackContext):
             'max_instances': 1  # Максимум 1 экземпляр задания
         }
         
-        # Планируем задание на среду в 08:00 МСК
+        # Во вторник в 22:00 МСК распределяем напоминания на среду: восточные
+        # часовые пояса получают их в 08:00 по местному времени раньше Москвы
         context.job_queue.run_daily(
             callback=prepare_weekly_reminders,
-            time=time(hour=8, minute=0, tzinfo=moscow_tz),
-            days=(2,),  # 2 - среда
+            time=time(hour=22, minute=0, tzinfo=moscow_tz),
+            days=(1,),  # 1 - вторник
             name="weekly_meters_reminder",
             job_kwargs=job_kwargs
         )
@@ -175,124 +145,107 @@ def schedule_weekly_reminders(context: CallbackContext):
         logger.error(f"Ошибка планирования еженедельных напоминаний: {e}")
 
 def prepare_weekly_reminders(context: CallbackContext):
-    """Подготовка еженедельных напоминаний в среду"""
+    """Подготовка еженедельных напоминаний: группировка по часовым поясам
+
+    Получатели группируются по часовому поясу локации. Каждая группа
+    получает напоминания в REMINDER_LOCAL_HOUR по местному времени,
+    а отправка внутри группы растягивается на REMINDER_SPREAD_MINUTES
+    пачками по REMINDER_BATCH_SIZE. В контексте заданий хранятся только
+    табельные номера.
+    """
     try:
         logger.info("Подготовка еженедельных напоминаний")
         
-        # Получаем данные из 1С:ERP
-        equipment_df = get_equipment_data()
-        if equipment_df.empty:
-            logger.error("Не удалось загрузить данные об оборудовании")
-            return
-        
         # Получаем пользователей на вахте
         users_on_shift = get_users_on_shift()
         if not users_on_shift:
             logger.info("Нет пользователей на вахте")
             return
         
-        # Группируем оборудование по локациям и подразделениям
-        grouped_equipment = equipment_df.groupby(['Локация', 'Подразделение'])
-        
-        # Для каждого пользователя на вахте готовим напоминание
-        for user in users_on_shift:
-            tab_number, name, location, division = user
-            
-            # Получаем оборудование для локации и подразделения пользователя
-            try:
-                equipment = grouped_equipment.get_group((location, division))
-                if not equipment.empty:
-                    # Планируем отправку напоминания на среду 08:00 МСК
-                    schedule_reminder(
-                        context=context,
-                        tab_number=tab_number,
-                        name=name,
-                        location=location,
-                        division=division,
-                        equipment=equipment,
-                        hour=8,  # Фиксированное время 08:00 МСК
-                        timezone=pytz.timezone('Europe/Moscow')
-                    )
-            except KeyError:
+        # Группируем получателей по часовому поясу, пропуская подразделения без оборудования
+        groups = {}
+        templates_ready = {}
+        for tab_number, name, location, division in users_on_shift:
+            key = (location, division)
+            if key not in templates_ready:
+                # Заодно заранее собираем шаблон подразделения
+                templates_ready[key] = equipment_templates.get_template(location, division)[0] is not None
+            if not templates_ready[key]:
                 logger.info(f"Нет оборудования для {location}, {division}")
                 continue
-                
+            groups.setdefault(get_timezone_for_location(location), []).append(tab_number)
+        
+        moscow_tz = pytz.timezone('Europe/Moscow')
+        now = datetime.now(moscow_tz)
+        # Дата ближайшей среды по Москве
+        reminder_date = (now + timedelta(days=(2 - now.weekday()) % 7)).date()
+        
+        jobs_count = 0
+        for tz_name, tab_numbers in groups.items():
+            local_tz = pytz.timezone(tz_name)
+            start = local_tz.localize(datetime.combine(reminder_date, time(hour=REMINDER_LOCAL_HOUR)))
+            start = max(start, now + timedelta(seconds=5))
+            
+            batches = [
+                tab_numbers[i:i + REMINDER_BATCH_SIZE]
+                for i in range(0, len(tab_numbers), REMINDER_BATCH_SIZE)
+            ]
+            step = timedelta(minutes=REMINDER_SPREAD_MINUTES) / len(batches)
+            for index, batch in enumerate(batches):
+                context.job_queue.run_once(
+                    callback=send_reminder_batch,
+                    when=start + step * index,
+                    context={'tab_numbers': batch},
+                    name=f"reminder_{tz_name}_{index}"
+                )
+                jobs_count += 1
+            
+            logger.info(
+                f"Напоминания для {len(tab_numbers)} пользователей ({tz_name}) запланированы "
+                f"на {start.strftime('%Y-%m-%d %H:%M %Z')} с растяжкой {REMINDER_SPREAD_MINUTES} мин"
+            )
+        
+        logger.info(f"Запланировано заданий напоминаний: {jobs_count}")
     except Exception as e:
         logger.error(f"Ошибка подготовки еженедельных напоминаний: {e}")
 
-def schedule_reminder(context: CallbackContext, tab_number: int, name: str, 
-                    location: str, division: str, equipment: pd.DataFrame,
-                    hour: int, timezone: pytz.timezone):
-    """Планирование напоминания"""
+def send_reminder_batch(context: CallbackContext):
+    """Отправка напоминаний пачке пользователей"""
+    tab_numbers = context.job.context['tab_numbers']
     try:
-        # Используем московское время как базовое
-        moscow_tz = pytz.timezone('Europe/Moscow')
-        
-        # Планируем на среду в 08:00 МСК
-        context.job_queue.run_daily(
-            callback=send_reminder,
-            time=time(hour=8, minute=0),  # 08:00 МСК
-            days=(2,),  # 2 - это среда
-            context={
-                'tab_number': tab_number,
-                'name': name,
-                'location': location,
-                'division': division,
-                'equipment': equipment.to_dict('records'),
-                'deadline': '14:00 МСК'  # Срок сдачи показаний
-            },
-            name=f"reminder_{tab_number}",
-            timezone=moscow_tz  # Используем московское время
-        )
-        
-        logger.info(f"Напоминание для {name} запланировано на среду 08:00 МСК")
+        # Данные пользователей берутся на момент отправки
+        placeholders = ','.join('?' * len(tab_numbers))
+        with db_transaction() as cursor:
+            cursor.execute(f'''
+                SELECT tab_number, name, location, division, chat_id
+                FROM Users_user_bot
+                WHERE tab_number IN ({placeholders})
+            ''', tab_numbers)
+            users = cursor.fetchall()
     except Exception as e:
-        logger.error(f"Ошибка планирования напоминания для {tab_number}: {e}")
+        logger.error(f"Ошибка получения пользователей для напоминаний: {e}")
+        return
+    
+    for tab_number, name, location, division, chat_id in users:
+        send_reminder(context, tab_number, name, location, division, chat_id)
 
-def send_reminder(context: CallbackContext):
+def send_reminder(context: CallbackContext, tab_number, name, location, division, chat_id):
     """Отправка напоминания"""
-    job_context = context.job.context
-    tab_number = job_context['tab_number']
-    name = job_context['name']
-    location = job_context['location']
-    division = job_context['division']
-    equipment = pd.DataFrame.from_records(job_context['equipment'])
-    deadline = job_context['deadline']
-    
     try:
-        # Получаем местное время
-        local_tz = pytz.timezone(get_timezone_for_location(location))
-        current_local_time = datetime.now(local_tz)
-        formatted_time = current_local_time.strftime('%Y-%m-%d %H:%M:%S (%Z)')
-        
-        # Получаем московское время для дедлайна
-        moscow_tz = pytz.timezone('Europe/Moscow')
-        deadline_time = time(hour=14, minute=0, tzinfo=moscow_tz)
-        deadline_datetime = datetime.combine(datetime.now(moscow_tz).date(), deadline_time)
-        
-        # Конвертируем дедлайн в местное время
-        local_deadline = deadline_datetime.astimezone(local_tz)
-        local_deadline_str = local_deadline.strftime('%H:%M (%Z)')
-        
-        # Создаем шаблон таблицы
-        template_df = pd.DataFrame(columns=[
-            '№ п/п', 'Гос. номер', 'Инв. №', 'Счётчик', 'Показания', 'Комментарий'
-        ])
-        
-        template_df['№ п/п'] = equipment['№ п/п']
-        template_df['Гос. номер'] = equipment['Гос. номер']
-        template_df['Инв. №'] = equipment['Инв. №']
-        template_df['Счётчик'] = equipment['Счётчик']
+        if not chat_id:
+            logger.warning(f"Нет chat_id для {name} (tab: {tab_number}), напоминание не отправлено")
+            return
         
-        # Сохраняем в Excel
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            template_df.to_excel(writer, index=False)
-        output.seek(0)
+
+        # Местное время и срок подачи текущей недели берутся из реестра локаций
+        formatted_time = location_registry.now(location).strftime('%Y-%m-%d %H:%M:%S (%Z)')
+        local_deadline_str = location_registry.deadline_text(location)
         
         # Отправляем пользователю
-        context.bot.send_message(
-            chat_id=tab_number,
+        send_message(
+            context.bot,
+            priority=PRIORITY_BROADCAST,
+            chat_id=chat_id,
             text=f"⏰ *Уважаемый {name}, необходимо подать показания счетчиков!*\n\n"
                 f"📍 Локация: {location}\n"
                 f"🏢 Подразделение: {division}\n"
@@ -302,21 +255,29 @@ def send_reminder(context: CallbackContext):
             parse_mode='Markdown'
         )
         
-        context.bot.send_document(
-            chat_id=tab_number,
-            document=InputFile(output, filename=f'Показания_{location}_{division}.xlsx'),
+        # Шаблон подразделения собирается один раз и отправляется всем из кэша
+        if not equipment_templates.send_template(
+            context.bot,
+            chat_id,
+            location,
+            division,
+            priority=PRIORITY_BROADCAST,
             caption="Шаблон для заполнения показаний счетчиков"
-        )
+        ):
+            logger.warning(f"Нет оборудования для шаблона {location}, {division}")
         
-        # Сохраняем информацию о пользователе
-        context.user_data['waiting_for_meters'] = True
-        context.user_data['location'] = location
-        context.user_data['division'] = division
+        # Сохраняем информацию о пользователе (у задания нет своего user_data);
+        # user_data диспетчера ведется по id пользователя Telegram, в личном чате это chat_id
+        user_data = context.dispatcher.user_data[chat_id]
+        user_data['waiting_for_meters'] = True
+        user_data['location'] = location
+        user_data['division'] = division
         
         logger.info(f"Напоминание отправлено {name} (tab: {tab_number})")
     except Exception as e:
         logger.error(f"Ошибка отправки напоминания {tab_number}: {e}")
 
+@heavy_handler(FILE_ACCEPTED_TEXT)
 def handle_meters_file(update: Update, context: CallbackContext):
     """Обработка файла с показаниями счетчиков с улучшенной обработкой статуса 'Убыло'"""
     try:
@@ -369,20 +330,18 @@ def handle_meters_file(update: Update, context: CallbackContext):
             update.message.reply_text("❌ Ошибка: неполные данные пользователя. Пожалуйста, начните с /start")
             return
         
-        # Создаем папки для сохранения
-        current_week = datetime.now().strftime('%Y-W%U')
-        report_folder = f'meter_readings/week_{current_week}'
-        os.makedirs(report_folder, exist_ok=True)
-        
-        # Сохраняем файл
+        # Загружаем файл в память и читаем его один раз
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        file_path = f'{report_folder}/meters_{location}_{division}_{tab_number}_{timestamp}.xlsx'
-        new_file.download(file_path)
+        file_path = f'{get_week_folder()}/meters_{location}_{division}_{tab_number}_{timestamp}.xlsx'
+        buffer = io.BytesIO()
+        new_file.download(out=buffer)
+        file_bytes = buffer.getvalue()
+        readings_df = parse_excel(file_bytes)
         
         # Валидация файла
         from check import MeterValidator
         validator = MeterValidator()
-        validation_result = validator.validate_file(file_path, {
+        validation_result = validator.validate_file(readings_df, {
             'name': name,
             'location': location,
             'division': division,
@@ -394,6 +353,9 @@ def handle_meters_file(update: Update, context: CallbackContext):
         if not validation_result['is_valid']:
             errors_text = "\n".join(validation_result['errors'])
             
+            # Файл сохраняется для несогласия с ошибками и удаляется плановой очисткой
+            store_upload(file_bytes, file_path, UPLOAD_REJECTED)
+            
             # Сохраняем данные для последующего использования
             context.user_data['validation_result'] = validation_result
             context.user_data['file_path'] = file_path  # Сохраняем путь к файлу
@@ -411,12 +373,8 @@ def handle_meters_file(update: Update, context: CallbackContext):
             return
 
             
-        # Если все в порядке - сохраняем и уведомляем
-        from check import MeterValidator
-        validator = MeterValidator()
-        
-        # Читаем файл и сохраняем в финальный отчет
-        df = pd.read_excel(file_path)
+        # Если все в порядке - сохраняем проверенные данные в финальный отчет
+        df = validation_result['df']
         
         # Добавляем метаданные
         df['name'] = name
@@ -432,6 +390,7 @@ def handle_meters_file(update: Update, context: CallbackContext):
             error_msg = save_result.get('message', 'Неизвестная ошибка')
             update.message.reply_text(f"❌ Ошибка при сохранении показаний: {error_msg}")
             return
+        store_upload(file_bytes, file_path, UPLOAD_ACCEPTED)
             
         # Проверяем сроки сдачи
         is_on_time = check_if_on_time()
@@ -457,8 +416,6 @@ def handle_meters_file(update: Update, context: CallbackContext):
     except Exception as e:
         logger.error(f"Ошибка обработки файла показаний: {e}")
         update.message.reply_text("❌ Произошла ошибка при обработке файла. Пожалуйста, попробуйте позже.")
-        if 'file_path' in locals() and os.path.exists(file_path):
-            os.remove(file_path)
 
 def handle_disagree_with_errors(update: Update, context: CallbackContext):
     """Обработка нажатия кнопки 'Я не согласен с ошибками'"""
@@ -510,29 +467,25 @@ def notify_admins_about_ubylo(context, request_data):
         
         if not admins:
             # Если нет администраторов для подразделения, берем всех
-            cursor.execute('SELECT tab_number, name FROM Users_admin_bot')
-            admins = cursor.fetchall()
+            admins = [(admin.tab_number, admin.name) for admin in roster.members('Администратор')]
         
         for admin_id, admin_name in admins:
-            keyboard = [
-                [InlineKeyboardButton("✅ Подтвердить", callback_data=f"confirm_ubylo_{request_data['request_id']}")],
-                [InlineKeyboardButton("❌ Отклонить", callback_data=f"reject_ubylo_{request_data['request_id']}")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
             try:
-                context.bot.send_message(
-                    chat_id=admin_id,
-                    text=f"⚠️ Запрос на отметку 'Убыло'\n\n"
-                         f"Инв. №: {request_data['inv_num']}\n"
-                         f"Счётчик: {request_data['meter_type']}\n"
-                         f"Пользователь: {request_data['user_name']}\n"
-                         f"Локация: {request_data['location']}\n"
-                         f"Подразделение: {request_data['division']}\n\n"
-                         f"Пожалуйста, подтвердите или отклоните запрос:",
-                    reply_markup=reply_markup
+                notify(
+                    context.bot,
+                    admin_id,
+                    f"⚠️ Запрос на отметку 'Убыло'\n\n"
+                    f"Инв. №: {request_data['inv_num']}\n"
+                    f"Счётчик: {request_data['meter_type']}\n"
+                    f"Пользователь: {request_data['user_name']}\n"
+                    f"Локация: {request_data['location']}\n"
+                    f"Подразделение: {request_data['division']}",
+                    buttons=[
+                        ("✅ Подтвердить", f"confirm_ubylo_{request_data['request_id']}"),
+                        ("❌ Отклонить", f"reject_ubylo_{request_data['request_id']}")
+                    ]
                 )
-                logger.info(f"Уведомление отправлено администратору {admin_name}")
+                logger.info(f"Уведомление добавлено в сводку администратора {admin_name}")
             except Exception as e:
                 logger.error(f"Ошибка отправки уведомления администратору {admin_name}: {e}")
     except Exception as e:
@@ -543,9 +496,6 @@ def notify_admin_about_errors(context: CallbackContext, user_tab_number: int, us
                              location: str, division: str, file_path: str, errors: list):
     """Уведомление администратора о проблемах с файлом показаний"""
     try:
-        # Убеждаемся, что папка meter_readings существует
-        os.makedirs('meter_readings', exist_ok=True)
-        
         # Получаем администраторов данного подразделения
         from check import MeterValidator
         validator = MeterValidator()
@@ -570,24 +520,27 @@ def notify_admin_about_errors(context: CallbackContext, user_tab_number: int, us
         # Отправляем сообщение всем администраторам подразделения
         for admin_id, admin_name in admins:
             try:
-                context.bot.send_message(
+                send_message(
+                    context.bot,
                     chat_id=admin_id,
                     text=message,
                     parse_mode='Markdown'
                 )
                 
                 # Проверяем существование файла перед отправкой
-                if os.path.exists(file_path):
+                if report_file_exists(file_path):
                     # Отправляем файл
-                    with open(file_path, 'rb') as f:
-                        context.bot.send_document(
+                    with open_report_file(file_path) as f:
+                        send_document(
+                            context.bot,
                             chat_id=admin_id,
-                            document=f,
+                            document=InputFile(f, filename=os.path.basename(file_path)),
                             caption=f"Показания счетчиков с ошибками от {user_name}"
                         )
                 else:
                     logger.error(f"Файл не найден при отправке администратору: {file_path}")
-                    context.bot.send_message(
+                    send_message(
+                        context.bot,
                         chat_id=admin_id,
                         text=f"⚠️ Файл показаний не найден или был удалён.",
                         parse_mode='Markdown'
@@ -609,18 +562,14 @@ def check_missing_reports(context: CallbackContext):
             logger.info("Нет пользователей на вахте для проверки отчетов")
             return
         
-        # Создаем папку для отчетов текущей недели, если не существует
-        current_week = datetime.now().strftime('%Y-W%U')  # Год-Номер недели
-        report_folder = f'meter_readings/week_{current_week}'
-        os.makedirs(report_folder, exist_ok=True)
+        current_week = get_current_week()
         
         # Проверяем каждого пользователя
         for user in users_on_shift:
             tab_number, name, location, division = user
             
             # Проверяем, подал ли пользователь отчет
-            report_pattern = f'{report_folder}/*_{location}_{division}_{tab_number}_*.xlsx'
-            user_reports = glob.glob(report_pattern)
+            user_reports = find_report_files(location, division, tab_number, week=current_week)
             
             if not user_reports:  # Если отчет не найден
                 # Отправляем повторное напоминание
@@ -628,7 +577,9 @@ def check_missing_reports(context: CallbackContext):
                     moscow_tz = pytz.timezone('Europe/Moscow')
                     current_moscow_time = datetime.now(moscow_tz).strftime('%H:%M')
                     
-                    context.bot.send_message(
+                    send_message(
+                        context.bot,
+                        priority=PRIORITY_BROADCAST,
                         chat_id=tab_number,
                         text=f"⚠️ *ПОВТОРНОЕ НАПОМИНАНИЕ* ⚠️\n\n"
                              f"Уважаемый {name}, вы не подали показания счетчиков!\n\n"
@@ -664,23 +615,19 @@ def notify_admins_about_missing_reports(context: CallbackContext):
         
         for tab_number, user_info in missing_reports.items():
             # Получаем администраторов для этого подразделения
-            cursor.execute('''
-                SELECT tab_number FROM Users_admin_bot 
-                WHERE division = ? AND location = ?
-            ''', (user_info['division'], user_info['location']))
-            
-            admins = cursor.fetchall()
+            admins = roster.admins_for_division(user_info['division'], user_info['location'])
             
             for admin in admins:
-                admin_tab = admin[0]
+                admin_tab = admin.tab_number
                 try:
-                    context.bot.send_message(
-                        chat_id=admin_tab,
-                        text=f"⚠️ Пользователь {user_info['name']} не предоставил показания!\n\n"
-                             f"Локация: {user_info['location']}\n"
-                             f"Подразделение: {user_info['division']}\n\n"
-                             f"Вы можете заполнить показания за пользователя, отправив файл Excel.",
-                        parse_mode='Markdown'
+                    notify(
+                        context.bot,
+                        admin_tab,
+                        f"⚠️ Пользователь {user_info['name']} не предоставил показания!\n"
+                        f"Локация: {user_info['location']}\n"
+                        f"Подразделение: {user_info['division']}\n"
+                        f"Вы можете заполнить показания за пользователя, отправив файл Excel.",
+                        priority=PRIORITY_BROADCAST
                     )
                 except Exception as e:
                     logger.error(f"Ошибка уведомления администратора {admin_tab}: {e}")
@@ -717,7 +664,8 @@ def notify_admin_about_disagreement(context: CallbackContext, user_info: dict, f
                 ]
                 reply_markup = InlineKeyboardMarkup(keyboard)
                 
-                context.bot.send_message(
+                send_message(
+                    context.bot,
                     chat_id=admin_chat_id,
                     text=f"⚠️ Пользователь не согласен с ошибками\n\n"
                          f"👤 Пользователь: {user_info['name']}\n"
@@ -728,16 +676,18 @@ def notify_admin_about_disagreement(context: CallbackContext, user_info: dict, f
                     reply_markup=reply_markup
                 )
                 
-                if os.path.exists(file_path):
-                    with open(file_path, 'rb') as f:
-                        context.bot.send_document(
+                if report_file_exists(file_path):
+                    with open_report_file(file_path) as f:
+                        send_document(
+                            context.bot,
                             chat_id=admin_chat_id,
-                            document=f,
+                            document=InputFile(f, filename=os.path.basename(file_path)),
                             caption=f"Файл с показаниями от {user_info['name']}"
                         )
                 else:
                     logger.error(f"Файл не найден: {file_path}")
-                    context.bot.send_message(
+                    send_message(
+                        context.bot,
                         chat_id=admin_chat_id,
                         text=f"⚠️ Файл с показаниями не найден или был удалён."
                     )
@@ -756,10 +706,11 @@ def handle_admin_submit_readings(update: Update, context: CallbackContext):
     
     user_tab = int(query.data.split('_')[2])
     
-    cursor.execute('''
-        SELECT name, location, division FROM Users_user_bot WHERE tab_number = ?
-    ''', (user_tab,))
-    user_data = cursor.fetchone()
+    with db_transaction() as cursor:
+        cursor.execute('''
+            SELECT name, location, division FROM Users_user_bot WHERE tab_number = ?
+        ''', (user_tab,))
+        user_data = cursor.fetchone()
     
     if not user_data:
         query.edit_message_text("Пользователь не найден.")
@@ -784,7 +735,8 @@ def handle_admin_submit_readings(update: Update, context: CallbackContext):
         return
         
     # Сохраняем оборудование в контексте
-    context.user_data['equipment'] = equipment.to_dict('records')
+    context.user_data['equipment'] = EquipmentSequence.from_frame(equipment) \
+        .prefetch_last_readings(get_last_readings)
     context.user_data['current_index'] = 0
     
     # Начинаем ввод показаний
@@ -805,58 +757,56 @@ def handle_admin_view_week(update: Update, context: CallbackContext):
         return
         
     # Get current week
-    current_week = datetime.now().strftime('%Y-W%U')
-    report_folder = f'meter_readings/week_{current_week}'
+    current_week = get_current_week()
     
-    if not os.path.exists(report_folder):
+    if not find_report_files(week=current_week):
         update.message.reply_text("За эту неделю еще нет показаний.")
         return
         
     # Get user info
     tab_number = context.user_data.get('tab_number')
-    cursor.execute('''
-        SELECT location, division FROM Users_admin_bot WHERE tab_number = ?
-        UNION
-        SELECT location, division FROM Users_dir_bot WHERE tab_number = ?
-    ''', (tab_number, tab_number))
-    user_info = cursor.fetchone()
+    person = roster.get(tab_number)
     
-    if not user_info:
+    if person is None or person.role not in ('Администратор', 'Руководитель'):
         update.message.reply_text("Ошибка: пользователь не найден.")
         return
         
-    location, division = user_info
+    location, division = person.location, person.division
     
     # Get all reports for the location/division
-    reports = []
-    for filename in os.listdir(report_folder):
-        if f"_{location}_{division}_" in filename:
-            reports.append(os.path.join(report_folder, filename))
+    reports = find_report_files(location, division, week=current_week)
     
     if not reports:
         update.message.reply_text("Нет доступных показаний для просмотра.")
         return
         
-    # Create combined report
-    all_data = []
+    # Create combined report: collect the union of headers first, then stream rows file by file
+    columns = []
+    readable_reports = []
     for report in reports:
         try:
-            df = pd.read_excel(report)
-            all_data.append(df)
+            with open_submission(report) as f:
+                header = read_excel_header(f)
+            for col in header:
+                if col not in columns:
+                    columns.append(col)
+            readable_reports.append(report)
         except Exception as e:
             logger.error(f"Ошибка чтения файла {report}: {e}")
     
-    if not all_data:
+    if not readable_reports:
         update.message.reply_text("Ошибка при формировании отчета.")
         return
         
-    combined_df = pd.concat(all_data)
+    def combined_rows():
+        for report in readable_reports:
+            with open_submission(report) as f:
+                yield from iter_excel_rows(f, columns)
     
     # Save to temp file
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        combined_df.to_excel(writer, index=False)
-    output.seek(0)
+    writer = StreamingExcelWriter()
+    writer.add_sheet('Sheet1', columns, combined_rows())
+    output = writer.save()
     
     update.message.reply_document(
         document=InputFile(output, filename=f'Показания_{location}_{division}_{current_week}.xlsx'),
@@ -871,12 +821,12 @@ def notify_managers_about_unresolved_disagreements(context: CallbackContext):
         # Получаем все нерешенные запросы (старше 3 дней)
         three_days_ago = (datetime.now() - timedelta(days=3)).strftime('%Y-%m-%d %H:%M:%S')
         
-        cursor.execute('''
-            SELECT * FROM pending_requests 
-            WHERE status = 'pending' AND timestamp < ?
-        ''', (three_days_ago,))
-        
-        unresolved_requests = cursor.fetchall()
+        with db_transaction() as cursor:
+            cursor.execute('''
+                SELECT * FROM pending_requests 
+                WHERE status = 'pending' AND timestamp < ?
+            ''', (three_days_ago,))
+            unresolved_requests = cursor.fetchall()
         
         if not unresolved_requests:
             logger.info("Нет нерешенных запросов")
@@ -887,26 +837,21 @@ def notify_managers_about_unresolved_disagreements(context: CallbackContext):
             request_id, inv_num, meter_type, user_tab, user_name, location, division, status, _, _, timestamp = request
             
             # Получаем список руководителей для этого подразделения
-            cursor.execute('''
-                SELECT tab_number, name, chat_id FROM Users_dir_bot 
-                WHERE division = ? AND chat_id IS NOT NULL
-            ''', (division,))
-            
-            managers = cursor.fetchall()
+            managers = [
+                (manager.tab_number, manager.name, manager.chat_id)
+                for manager in roster.managers_for_division(division) if manager.chat_id is not None
+            ]
             
             if not managers:
                 logger.warning(f"Не найдены руководители для подразделения {division}")
                 continue
                 
-            # Получаем файл с оригинальными показаниями пользователя
-            original_file_pattern = f'meter_readings/*/*_{location}_{division}_{user_tab}_*.xlsx'
-            original_files = glob.glob(original_file_pattern)
+            # Получаем самый свежий файл с оригинальными показаниями пользователя (в том числе из архива)
+            original_file = find_latest_report_file(location, division, user_tab, include_archived=True)
             
-            if not original_files:
+            if not original_file:
                 logger.warning(f"Не найден оригинальный файл показаний для {user_name}")
                 continue
-                
-            original_file = sorted(original_files, reverse=True)[0]  # Берем самый свежий файл
             
             # Отправляем уведомление каждому руководителю
             for manager_tab, manager_name, manager_chat_id in managers:
@@ -919,7 +864,9 @@ def notify_managers_about_unresolved_disagreements(context: CallbackContext):
                     reply_markup = InlineKeyboardMarkup(keyboard)
                     
                     # Отправляем сообщение
-                    context.bot.send_message(
+                    send_message(
+                        context.bot,
+                        priority=PRIORITY_BROADCAST,
                         chat_id=manager_chat_id,
                         text=f"⚠️ *Требуется ваше вмешательство*\n\n"
                              f"Пользователь {user_name} не согласен с ошибками в показаниях,\n"
@@ -932,8 +879,10 @@ def notify_managers_about_unresolved_disagreements(context: CallbackContext):
                     )
                     
                     # Отправляем оригинальный файл пользователя
-                    with open(original_file, 'rb') as f:
-                        context.bot.send_document(
+                    with open_submission(original_file) as f:
+                        send_document(
+                            context.bot,
+                            priority=PRIORITY_BROADCAST,
                             chat_id=manager_chat_id,
                             document=InputFile(f, filename=f'Показания_{user_name}.xlsx'),
                             caption=f"Оригинальные показания от {user_name}"
@@ -975,17 +924,12 @@ def notify_managers_about_missing_reports(context: CallbackContext):
                 
             # Находим руководителей
             try:
-                cursor.execute('''
-                    SELECT tab_number, name 
-                    FROM Users_dir_bot 
-                    WHERE division = ?
-                ''', (division,))
-                managers = cursor.fetchall()
+                managers = roster.managers_for_division(division)
                     
                 if not managers:
                     # Если нет руководителей для конкретного подразделения, берем всех
-                    cursor.execute('SELECT tab_number, name FROM Users_dir_bot')
-                    managers = cursor.fetchall()
+                    managers = roster.members('Руководитель')
+                managers = [(manager.tab_number, manager.name) for manager in managers]
                         
                 if not managers:
                     logger.error(f"Не найдены руководители для уведомления")
@@ -994,19 +938,20 @@ def notify_managers_about_missing_reports(context: CallbackContext):
                 # Уведомляем каждого руководителя
                 for manager_id, manager_name in managers:
                     try:
-                        context.bot.send_message(
-                            chat_id=manager_id,
-                            text=f"🚨 *КРИТИЧЕСКОЕ УВЕДОМЛЕНИЕ* 🚨\n\n"
-                                f"Руководитель {manager_name}, показания счетчиков не поданы:\n\n"
-                                f"👤 Пользователь: {name}\n"
-                                f"📍 Локация: {location}\n"
-                                f"🏢 Подразделение: {division}\n"
-                                f"👨‍💼 Ответственный администратор: {admin_name}\n"
-                                f"🕒 Время проверки: {current_moscow_time} МСК\n\n"
-                                f"Требуется ваше вмешательство для разрешения ситуации.",
-                            parse_mode='Markdown'
+                        notify(
+                            context.bot,
+                            manager_id,
+                            f"🚨 КРИТИЧЕСКОЕ УВЕДОМЛЕНИЕ 🚨\n"
+                            f"Руководитель {manager_name}, показания счетчиков не поданы:\n"
+                            f"👤 Пользователь: {name}\n"
+                            f"📍 Локация: {location}\n"
+                            f"🏢 Подразделение: {division}\n"
+                            f"👨‍💼 Ответственный администратор: {admin_name}\n"
+                            f"🕒 Время проверки: {current_moscow_time} МСК\n"
+                            f"Требуется ваше вмешательство для разрешения ситуации.",
+                            priority=PRIORITY_BROADCAST
                         )
-                        logger.info(f"Уведомление отправлено руководителю {manager_name} (ID: {manager_id})")
+                        logger.info(f"Уведомление добавлено в сводку руководителя {manager_name} (ID: {manager_id})")
                             
                     except Exception as e:
                         logger.error(f"Ошибка отправки уведомления руководителю {manager_id}: {e}")
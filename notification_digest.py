@@ -0,0 +1,149 @@
+"""Сводные уведомления для администраторов и руководителей
+
+События для одного получателя копятся в течение короткого окна и
+отправляются одним сообщением с кнопками для каждого ожидающего действия.
+Срочные события отправляются сразу. Если за окно накопилось одно событие,
+оно отправляется в исходном виде.
+"""
+import os
+import logging
+import threading
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from outbound_queue import send_message, PRIORITY_NOTIFY
+
+logger = logging.getLogger(__name__)
+
+# Окно накопления событий в секундах; 0 - отправлять сразу
+DIGEST_WINDOW = float(os.getenv('DIGEST_WINDOW', 60))
+# Не больше стольких событий в одном сообщении (Telegram ограничивает
+# длину текста 4096 символами и клавиатуру 100 кнопками)
+DIGEST_MAX_ITEMS = int(os.getenv('DIGEST_MAX_ITEMS', 20))
+MAX_MESSAGE_LENGTH = 4000
+
+
+class DigestItem:
+    __slots__ = ('text', 'buttons')
+
+    def __init__(self, text, buttons=None):
+        self.text = text
+        # Список пар (подпись, callback_data)
+        self.buttons = buttons or []
+
+
+class NotificationDigest:
+    """Буфер уведомлений по получателям"""
+
+    def __init__(self, window=DIGEST_WINDOW, max_items=DIGEST_MAX_ITEMS):
+        self.window = window
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        # chat_id -> {'bot', 'priority', 'items', 'timer'}
+        self._pending = {}
+
+    def notify(self, bot, chat_id, text, buttons=None, urgent=False, priority=PRIORITY_NOTIFY):
+        """Добавление события в сводку получателя
+
+        buttons - список пар (подпись, callback_data) для этого события.
+        Срочные события и события при нулевом окне отправляются сразу.
+        """
+        item = DigestItem(text, buttons)
+        if urgent or self.window <= 0:
+            self._send(bot, chat_id, [item], priority)
+            return
+
+        ready = None
+        with self._lock:
+            entry = self._pending.get(chat_id)
+            if entry is None:
+                timer = threading.Timer(self.window, self.flush, args=(chat_id,))
+                timer.daemon = True
+                entry = self._pending[chat_id] = {
+                    'bot': bot, 'priority': priority, 'items': [], 'timer': timer
+                }
+                timer.start()
+            entry['items'].append(item)
+            entry['priority'] = min(entry['priority'], priority)
+            if len(entry['items']) >= self.max_items:
+                ready = self._pending.pop(chat_id)
+                ready['timer'].cancel()
+
+        if ready:
+            self._send(ready['bot'], chat_id, ready['items'], ready['priority'])
+
+    def flush(self, chat_id):
+        """Отправка накопленной сводки получателя"""
+        with self._lock:
+            entry = self._pending.pop(chat_id, None)
+        if entry:
+            entry['timer'].cancel()
+            self._send(entry['bot'], chat_id, entry['items'], entry['priority'])
+
+    def flush_all(self):
+        """Отправка всех накопленных сводок (при остановке бота)"""
+        with self._lock:
+            chat_ids = list(self._pending)
+        for chat_id in chat_ids:
+            self.flush(chat_id)
+
+    def _send(self, bot, chat_id, items, priority):
+        for text, markup in render_digest(items):
+            try:
+                send_message(bot, priority=priority, chat_id=chat_id, text=text, reply_markup=markup)
+            except Exception as e:
+                logger.error(f"Ошибка отправки сводки для {chat_id}: {e}")
+        if len(items) > 1:
+            logger.info(f"Сводка из {len(items)} уведомлений поставлена в очередь для {chat_id}")
+
+
+def render_digest(items):
+    """Формирование сообщений сводки: список пар (текст, клавиатура)"""
+    if len(items) == 1:
+        item = items[0]
+        rows = [[InlineKeyboardButton(label, callback_data=data)] for label, data in item.buttons]
+        return [(item.text, InlineKeyboardMarkup(rows) if rows else None)]
+
+    messages = []
+    header = f"📬 Новых уведомлений: {len(items)}\n\n"
+    text, rows = header, []
+    for number, item in enumerate(items, 1):
+        block = f"{number}. {item.text}\n\n"
+        if text != header and len(text) + len(block) > MAX_MESSAGE_LENGTH:
+            messages.append((text.rstrip(), InlineKeyboardMarkup(rows) if rows else None))
+            text, rows = header, []
+        text += block
+        if item.buttons:
+            rows.append([
+                InlineKeyboardButton(f"{number}. {label}", callback_data=data)
+                for label, data in item.buttons
+            ])
+    messages.append((text.rstrip(), InlineKeyboardMarkup(rows) if rows else None))
+    return messages
+
+
+def finish_digest_action(query, text, action_key):
+    """Ответ на нажатие кнопки в сообщении, которое может быть сводкой
+
+    Кнопки обработанного события (callback_data оканчивается на action_key)
+    убираются из клавиатуры. Если в сообщении остались другие действия,
+    результат отправляется отдельным ответом, иначе текст сообщения
+    заменяется результатом, как для обычного уведомления.
+    """
+    markup = query.message.reply_markup if query.message else None
+    remaining = []
+    if markup:
+        remaining = [
+            row for row in markup.inline_keyboard
+            if not any((button.callback_data or '').endswith(action_key) for button in row)
+        ]
+    if remaining:
+        query.edit_message_reply_markup(reply_markup=InlineKeyboardMarkup(remaining))
+        query.message.reply_text(text)
+    else:
+        query.edit_message_text(text)
+
+
+digest = NotificationDigest()
+
+
+def notify(bot, chat_id, text, buttons=None, urgent=False, priority=PRIORITY_NOTIFY):
+    return digest.notify(bot, chat_id, text, buttons=buttons, urgent=urgent, priority=priority)
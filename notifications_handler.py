@@ -5,6 +5,12 @@ import os
 import logging
 from telegram import InputFile
 import io
+from report_writer import frame_to_excel
+from report_storage import get_current_week, find_report_files, parse_report_filename
+from outbound_queue import send_message, PRIORITY_BROADCAST
+from template_service import build_template_frame, readings_templates, TEMPLATE_SHEET
+from roster import roster
+from shift_store import shift_store
 
 # Настройка логирования
 logging.basicConfig(
@@ -25,15 +31,12 @@ def get_last_readings():
         return pd.DataFrame()
 
 def get_active_users(cursor):
-    """Получение списка активных пользователей на вахте"""
+    """Получение списка активных пользователей на вахте (последнее поле - chat_id)"""
     try:
-        cursor.execute('''
-            SELECT u.tab_number, u.name, u.location, u.division, u.t_number 
-            FROM Users_user_bot u
-            JOIN shifts s ON u.tab_number = s.tab_number
-            WHERE s.is_on_shift = "ДА"
-        ''')
-        return cursor.fetchall()
+        return [
+            (person.tab_number, person.name, person.location, person.division, person.chat_id)
+            for person in shift_store.users_on_shift()
+        ]
     except Exception as e:
         logger.error(f"Ошибка при получении активных пользователей: {e}")
         return []
@@ -41,32 +44,17 @@ def get_active_users(cursor):
 def create_user_excel(equipment_data, user_info):
     """Создание персональной таблицы Excel для пользователя"""
     try:
-        df = pd.DataFrame(columns=[
-            '№ п/п', 'Гос. номер', 'Инв. №', 'Счётчик', 
-            'Показания', 'Комментарий'
-        ])
-        
         # Фильтрация оборудования по локации и подразделению
         user_equipment = equipment_data[
             (equipment_data['Локация'] == user_info['location']) & 
             (equipment_data['Подразделение'] == user_info['division'])
         ]
         
-        # Заполнение таблицы
-        for idx, row in user_equipment.iterrows():
-            df.loc[len(df)] = {
-                '№ п/п': len(df) + 1,
-                'Гос. номер': row['Гос. номер'],
-                'Инв. №': row['Инв. №'],
-                'Счётчик': row['Счётчик'],
-                'Показания': row['Последние показания'],
-                'Комментарий': ''
-            }
+        # Таблица собирается целыми столбцами
+        df = build_template_frame(user_equipment, readings_column='Последние показания')
         
         # Создание буфера для файла Excel
-        excel_buffer = io.BytesIO()
-        df.to_excel(excel_buffer, index=False)
-        excel_buffer.seek(0)
+        excel_buffer = frame_to_excel(df, sheet_name=TEMPLATE_SHEET)
         
         return excel_buffer
     except Exception as e:
@@ -76,12 +64,6 @@ def create_user_excel(equipment_data, user_info):
 def weekly_data_preparation(context):
     """Подготовка и рассылка таблиц по средам"""
     try:
-        # Получение последних показаний
-        equipment_data = get_last_readings()
-        if equipment_data.empty:
-            logger.error("Не удалось получить данные о показаниях")
-            return
-        
         # Получение списка активных пользователей
         conn = context.bot_data.get('db_connection')
         if not conn:
@@ -103,9 +85,10 @@ def weekly_data_preparation(context):
                 't_number': t_number
             }
             
-            # Создание персональной таблицы
-            excel_file = create_user_excel(equipment_data, user_info)
-            if not excel_file:
+            # Таблица подразделения с последними показаниями берется из кэша шаблонов
+            template, _ = readings_templates.get_template(location, division)
+            if template is None:
+                logger.warning(f"Нет последних показаний для {location}, {division}")
                 continue
             
             # Формирование сообщения
@@ -124,17 +107,20 @@ def weekly_data_preparation(context):
             )
             
             # Отправка сообщения и файла
-            context.bot.send_message(
+            send_message(
+                context.bot,
+                priority=PRIORITY_BROADCAST,
                 chat_id=t_number,
                 text=message
             )
             
-            context.bot.send_document(
-                chat_id=t_number,
-                document=InputFile(
-                    excel_file,
-                    filename=f'readings_{location}_{division}_{datetime.now().strftime("%Y%m%d")}.xlsx'
-                )
+            readings_templates.send_template(
+                context.bot,
+                t_number,
+                location,
+                division,
+                filename=f'readings_{location}_{division}_{datetime.now().strftime("%Y%m%d")}.xlsx',
+                priority=PRIORITY_BROADCAST
             )
             
             # Сохраняем информацию о напоминании
@@ -151,25 +137,23 @@ def weekly_data_preparation(context):
     except Exception as e:
         logger.error(f"Ошибка в weekly_data_preparation: {e}")
 
+def get_submitted_tab_numbers():
+    """Табельные номера пользователей, подавших отчеты за текущую неделю"""
+    submitted_reports = set()
+    for file_path in find_report_files(week=get_current_week()):
+        meta = parse_report_filename(file_path)
+        if meta:
+            submitted_reports.add(meta['tab_number'])
+    return submitted_reports
+
 def check_missing_reports(context):
     """Проверка неподанных показаний в пятницу 14:00"""
     try:
         # Получаем список отправленных напоминаний
         reminders = context.bot_data.get('reminders', {})
         
-        # Проверяем папку с полученными отчетами
-        current_week = datetime.now().strftime('%Y-W%U')
-        reports_folder = f'meter_readings/week_{current_week}'
-        
-        # Получаем список файлов с отчетами
-        submitted_reports = set()
-        if os.path.exists(reports_folder):
-            for filename in os.listdir(reports_folder):
-                # Извлекаем табельный номер из имени файла
-                parts = filename.split('_')
-                if len(parts) >= 4:
-                    tab_number = parts[3].split('.')[0]
-                    submitted_reports.add(int(tab_number))
+        # Табельные номера из отчетов, полученных за текущую неделю
+        submitted_reports = get_submitted_tab_numbers()
         
         # Проверяем, кто не подал отчеты
         for tab_number, user_info in reminders.items():
@@ -185,7 +169,9 @@ def check_missing_reports(context):
                     f"это сообщение."
                 )
                 
-                context.bot.send_message(
+                send_message(
+                    context.bot,
+                    priority=PRIORITY_BROADCAST,
                     chat_id=user_info['t_number'],
                     text=message
                 )
@@ -205,18 +191,8 @@ def notify_administrators(context):
         # Получаем список отправленных напоминаний
         reminders = context.bot_data.get('reminders', {})
         
-        # Получаем текущую неделю
-        current_week = datetime.now().strftime('%Y-W%U')
-        reports_folder = f'meter_readings/week_{current_week}'
-        
-        # Получаем список поданных отчетов
-        submitted_reports = set()
-        if os.path.exists(reports_folder):
-            for filename in os.listdir(reports_folder):
-                parts = filename.split('_')
-                if len(parts) >= 4:
-                    tab_number = parts[3].split('.')[0]
-                    submitted_reports.add(int(tab_number))
+        # Получаем список поданных отчетов за текущую неделю
+        submitted_reports = get_submitted_tab_numbers()
         
         # Группируем неподанные отчеты по локациям и подразделениям
         missing_reports = {}
@@ -227,22 +203,13 @@ def notify_administrators(context):
                     missing_reports[key] = []
                 missing_reports[key].append(user_info)
         
-        # Получаем список администраторов
-        conn = context.bot_data.get('db_connection')
-        cursor = conn.cursor()
-        
         # Уведомляем администраторов
         for (location, division), users in missing_reports.items():
             # Находим ответственного администратора
-            cursor.execute('''
-                SELECT tab_number, name, t_number 
-                FROM Users_admin_bot 
-                WHERE location = ? AND division = ?
-            ''', (location, division))
-            admin = cursor.fetchone()
+            admins = roster.admins_for_division(division, location)
             
-            if admin:
-                admin_tab, admin_name, admin_number = admin
+            if admins:
+                admin_tab, admin_name, admin_number = admins[0].tab_number, admins[0].name, admins[0].chat_id
                 
                 # Формируем сообщение
                 message = (
@@ -259,7 +226,9 @@ def notify_administrators(context):
                 message += "\nТребуется ваше вмешательство."
                 
                 # Отправляем уведомление
-                context.bot.send_message(
+                send_message(
+                    context.bot,
+                    priority=PRIORITY_BROADCAST,
                     chat_id=admin_number,
                     text=message
                 )
@@ -285,9 +254,6 @@ def notify_managers(context):
         admin_notifications = context.bot_data.get('admin_notifications', {})
         
         # Проверяем, были ли какие-то действия от администраторов
-        conn = context.bot_data.get('db_connection')
-        cursor = conn.cursor()
-        
         for (location, division), notification in admin_notifications.items():
             # Проверяем, прошло ли достаточно времени
             time_passed = datetime.now().timestamp() - notification['timestamp']
@@ -295,15 +261,10 @@ def notify_managers(context):
                 continue
             
             # Находим ответственного руководителя
-            cursor.execute('''
-                SELECT tab_number, name, t_number 
-                FROM Users_dir_bot 
-                WHERE location = ? AND division = ?
-            ''', (location, division))
-            manager = cursor.fetchone()
+            managers = roster.managers_for_division(division, location)
             
-            if manager:
-                manager_tab, manager_name, manager_number = manager
+            if managers:
+                manager_tab, manager_name, manager_number = managers[0].tab_number, managers[0].name, managers[0].chat_id
                 
                 # Формируем сообщение
                 message = (
@@ -320,7 +281,9 @@ def notify_managers(context):
                     message += f"- {user['name']}\n"
                 
                 # Отправляем уведомление
-                context.bot.send_message(
+                send_message(
+                    context.bot,
+                    priority=PRIORITY_BROADCAST,
                     chat_id=manager_number,
                     text=message
                 )
@@ -356,7 +319,9 @@ def notify_users(self, message, users=None):
             }
             
             try:
-                self.bot.send_message(
+                send_message(
+                    self.bot,
+                    priority=PRIORITY_BROADCAST,
                     chat_id=tab_number,  # Используем tab_number как chat_id
                     text=message,
                     parse_mode='Markdown'
@@ -366,7 +331,9 @@ def notify_users(self, message, users=None):
                 logger.error(f"Ошибка отправки уведомления пользователю {name}: {e}")
                 
                 try:
-                    self.bot.send_message(
+                    send_message(
+                        self.bot,
+                        priority=PRIORITY_BROADCAST,
                         chat_id=tab_number,
                         text="❌ Ошибка отправки уведомления. Пожалуйста, свяжитесь с администратором.",
                         parse_mode='Markdown'
@@ -383,15 +350,13 @@ def notify_admins(self, message, user_info=None):
     """Отправка уведомлений администраторам"""
     try:
         # Получаем список администраторов
-        self.cursor.execute('''
-            SELECT tab_number, name
-            FROM Users_admin_bot
-        ''')
-        admins = self.cursor.fetchall()
+        admins = [(admin.tab_number, admin.name) for admin in roster.members('Администратор')]
         
         for admin in admins:
             try:
-                self.bot.send_message(
+                send_message(
+                    self.bot,
+                    priority=PRIORITY_BROADCAST,
                     chat_id=admin[0],  # Используем tab_number как chat_id
                     text=message,
                     parse_mode='Markdown'
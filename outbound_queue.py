@@ -0,0 +1,418 @@
+import io
+import os
+import heapq
+import time
+import hashlib
+import logging
+import threading
+from itertools import count
+from collections import OrderedDict, deque
+from telegram import InputFile
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut, TelegramError
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты отправки: меньше - раньше
+PRIORITY_REPLY = 0        # ответы на действия пользователя
+PRIORITY_NOTIFY = 1       # адресные уведомления (запросы, ошибки, подтверждения)
+PRIORITY_BROADCAST = 2    # массовые рассылки по расписанию
+
+OUTBOUND_WORKERS = int(os.getenv('OUTBOUND_WORKERS', 4))
+# Ограничения Telegram: около 30 сообщений в секунду всего и 1 в секунду в один чат
+GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', 25))
+GLOBAL_BURST = float(os.getenv('OUTBOUND_GLOBAL_BURST', 25))
+PER_CHAT_RATE = float(os.getenv('OUTBOUND_PER_CHAT_RATE', 1))
+PER_CHAT_BURST = float(os.getenv('OUTBOUND_PER_CHAT_BURST', 3))
+MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', 5))
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+# Неиспользуемые корзины чатов удаляются, чтобы словарь не рос бесконечно
+CHAT_BUCKET_IDLE = 600
+# Кэш file_id загруженных документов: размер и время жизни записи в секундах
+FILE_ID_CACHE_SIZE = int(os.getenv('FILE_ID_CACHE_SIZE', 256))
+FILE_ID_CACHE_TTL = int(os.getenv('FILE_ID_CACHE_TTL', 24 * 3600))
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, now=None):
+        """Через сколько секунд появится токен (0, если он есть сейчас)"""
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class FileIdCache:
+    """Кэш file_id документов, уже загруженных в Telegram
+
+    Ключ - хэш содержимого и имя файла. Документ загружается один раз,
+    остальные получатели получают его по file_id. Размер кэша ограничен
+    (вытесняются давно не использованные записи), записи устаревают
+    через ttl секунд. Пока документ загружается, другие потоки с тем же
+    ключом ждут на блокировке этого ключа, а не загружают его повторно.
+    """
+
+    def __init__(self, max_size=FILE_ID_CACHE_SIZE, ttl=FILE_ID_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(content, filename=None):
+        return f'{hashlib.sha256(content).hexdigest()}:{filename or ""}'
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            file_id, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return file_id
+
+    def put(self, key, file_id):
+        with self._lock:
+            self._entries[key] = (file_id, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def key_lock(self, key):
+        """Блокировка на время первой загрузки документа с этим ключом"""
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                if len(self._key_locks) > self.max_size * 2:
+                    self._key_locks = {k: v for k, v in self._key_locks.items() if v.locked()}
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+
+class OutboundMessage:
+    __slots__ = ('method', 'bot', 'chat_id', 'kwargs', 'priority', 'attempts', 'not_before', 'enqueued_at')
+
+    def __init__(self, method, bot, chat_id, kwargs, priority):
+        self.method = method
+        self.bot = bot
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.priority = priority
+        self.attempts = 0
+        self.not_before = 0.0
+        self.enqueued_at = time.monotonic()
+
+
+class OutboundQueue:
+    """Очередь исходящих сообщений бота
+
+    Сообщения отправляются пулом рабочих потоков в порядке приоритета с
+    ограничением общей скорости и скорости на каждый чат. В один чат
+    сообщения уходят строго по очереди: в работе (в очереди, отложено или
+    отправляется) не больше одного сообщения чата, следующее ждет, пока
+    предыдущее не будет доставлено или не завершится ошибкой. Сообщение, для
+    которого нет токена, откладывается до его появления, а поток берет
+    следующее, поэтому один чат не задерживает остальные. При RetryAfter
+    отправка откладывается на указанное Telegram время, при сетевых
+    ошибках повторяется с экспоненциальной задержкой, в обоих случаях не
+    больше MAX_RETRIES раз.
+    """
+
+    def __init__(self, workers=OUTBOUND_WORKERS):
+        self.workers = workers
+        self._heap = []       # готовые к отправке: (приоритет, порядок, сообщение)
+        self._delayed = []    # отложенные повторы: (время, порядок, сообщение)
+        # Чаты с сообщением в работе: {chat_id: следующие сообщения этого чата}
+        self._chats = {}
+        self._seq = count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._running = False
+        self._global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+        self._chat_buckets = {}
+        self._buckets_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self.file_ids = FileIdCache()
+        self.metrics = {
+            'enqueued': 0,
+            'sent': 0,
+            'failed': 0,
+            'retried': 0,
+            'rate_limited': 0,
+            'total_latency': 0.0
+        }
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'outbound-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Очередь исходящих сообщений запущена: потоков {self.workers}")
+
+    def stop(self, timeout=30):
+        """Остановка после отправки уже поставленных в очередь сообщений"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._chats and time.monotonic() < deadline:
+                self._cond.wait(0.5)
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        self._threads = []
+        with self._cond:
+            queued = self._queued()
+        logger.info(f"Очередь исходящих сообщений остановлена, не отправлено: {queued}")
+
+    def enqueue(self, method, bot, chat_id, priority=PRIORITY_NOTIFY, **kwargs):
+        if not self._running:
+            self.start()
+        message = OutboundMessage(method, bot, chat_id, kwargs, priority)
+        with self._cond:
+            waiting = self._chats.get(chat_id)
+            if waiting is None:
+                self._chats[chat_id] = deque()
+                self._push(message)
+            else:
+                # Предыдущее сообщение чата еще в работе
+                waiting.append(message)
+        with self._metrics_lock:
+            self.metrics['enqueued'] += 1
+        return message
+
+    def send_message(self, bot, chat_id, text, priority=PRIORITY_NOTIFY, **kwargs):
+        """Постановка текстового сообщения в очередь"""
+        return self.enqueue('send_message', bot, chat_id, priority, text=text, **kwargs)
+
+    def send_document(self, bot, chat_id, document, priority=PRIORITY_NOTIFY, filename=None,
+                      cache_key=None, **kwargs):
+        """Постановка документа в очередь
+
+        Содержимое файловых объектов читается сразу, поэтому файл можно
+        закрыть сразу после вызова. Одинаковое содержимое загружается в
+        Telegram один раз; cache_key позволяет задать ключ кэша явно для
+        документов, которые собираются заново, но совпадают по смыслу.
+        Явный ключ должен включать имя файла: file_id отправляется с именем
+        первой загрузки.
+        """
+        if isinstance(document, InputFile):
+            filename = filename or document.filename
+            document = document.input_file_content
+        elif hasattr(document, 'read'):
+            filename = filename or os.path.basename(getattr(document, 'name', '') or '') or 'document.xlsx'
+            document = document.read()
+        if isinstance(document, bytes):
+            cache_key = cache_key or FileIdCache.make_key(document, filename)
+        return self.enqueue('send_document', bot, chat_id, priority,
+                            document=document, filename=filename, cache_key=cache_key, **kwargs)
+
+    def get_metrics(self):
+        with self._metrics_lock:
+            metrics = dict(self.metrics)
+        delivered = metrics['sent'] or 1
+        metrics['avg_latency'] = metrics.pop('total_latency') / delivered
+        with self._cond:
+            metrics['queued'] = self._queued()
+        metrics['file_id_hits'] = self.file_ids.hits
+        metrics['file_id_misses'] = self.file_ids.misses
+        return metrics
+
+    def _queued(self):
+        return len(self._heap) + len(self._delayed) + sum(len(waiting) for waiting in self._chats.values())
+
+    def _done(self, message):
+        """Сообщение доставлено или отброшено: в работу идет следующее сообщение чата"""
+        with self._cond:
+            waiting = self._chats.get(message.chat_id)
+            if waiting:
+                self._push(waiting.popleft())
+            else:
+                self._chats.pop(message.chat_id, None)
+                self._cond.notify_all()
+
+    def _push(self, message):
+        with self._cond:
+            if message.not_before > time.monotonic():
+                heapq.heappush(self._delayed, (message.not_before, next(self._seq), message))
+            else:
+                heapq.heappush(self._heap, (message.priority, next(self._seq), message))
+            self._cond.notify()
+
+    def _pop(self):
+        """Следующее готовое к отправке сообщение или None при остановке"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    _, seq, message = heapq.heappop(self._delayed)
+                    heapq.heappush(self._heap, (message.priority, seq, message))
+                if self._heap:
+                    message = heapq.heappop(self._heap)[2]
+                    self._cond.notify_all()
+                    return message
+                if not self._running:
+                    return None
+                self._cond.wait(self._delayed[0][0] - now if self._delayed else None)
+
+    def _chat_bucket(self, chat_id):
+        with self._buckets_lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                if len(self._chat_buckets) > 1000:
+                    threshold = time.monotonic() - CHAT_BUCKET_IDLE
+                    self._chat_buckets = {
+                        key: value for key, value in self._chat_buckets.items() if value.updated > threshold
+                    }
+                bucket = self._chat_buckets[chat_id] = TokenBucket(PER_CHAT_RATE, PER_CHAT_BURST)
+            return bucket
+
+    def _throttle(self, chat_id):
+        """Берет токены на отправку; возвращает, сколько ждать, если их нет"""
+        chat_bucket = self._chat_bucket(chat_id)
+        with self._buckets_lock:
+            now = time.monotonic()
+            wait = max(self._global_bucket.wait_time(now), chat_bucket.wait_time(now))
+            if wait == 0:
+                self._global_bucket.take()
+                chat_bucket.take()
+            return wait
+
+    def _deliver(self, message):
+        kwargs = dict(message.kwargs)
+        if message.method == 'send_document':
+            return self._deliver_document(message, kwargs)
+        return getattr(message.bot, message.method)(chat_id=message.chat_id, **kwargs)
+
+    def _deliver_document(self, message, kwargs):
+        document = kwargs.pop('document')
+        filename = kwargs.pop('filename', None)
+        cache_key = kwargs.pop('cache_key', None)
+        if not isinstance(document, bytes) or cache_key is None:
+            return message.bot.send_document(chat_id=message.chat_id, document=document, **kwargs)
+
+        with self.file_ids.key_lock(cache_key):
+            file_id = self.file_ids.get(cache_key)
+            if file_id:
+                try:
+                    return message.bot.send_document(chat_id=message.chat_id, document=file_id, **kwargs)
+                except BadRequest as e:
+                    # file_id больше не действителен - загружаем файл заново
+                    logger.warning(f"file_id для {filename} отклонен Telegram: {e}")
+                    self.file_ids.invalidate(cache_key)
+
+            result = message.bot.send_document(
+                chat_id=message.chat_id,
+                document=InputFile(io.BytesIO(document), filename=filename),
+                **kwargs
+            )
+            if result is not None and getattr(result, 'document', None):
+                self.file_ids.put(cache_key, result.document.file_id)
+            return result
+
+    def _retry(self, message, delay):
+        message.attempts += 1
+        message.not_before = time.monotonic() + delay
+        with self._metrics_lock:
+            self.metrics['retried'] += 1
+        self._push(message)
+
+    def _worker(self):
+        while True:
+            message = self._pop()
+            if message is None:
+                return
+            wait = self._throttle(message.chat_id)
+            if wait > 0:
+                # Не спим: сообщение ждет токена в отложенных, поток берет следующее
+                message.not_before = time.monotonic() + wait
+                self._push(message)
+                continue
+            try:
+                self._deliver(message)
+                with self._metrics_lock:
+                    self.metrics['sent'] += 1
+                    self.metrics['total_latency'] += time.monotonic() - message.enqueued_at
+                self._done(message)
+            except RetryAfter as e:
+                with self._metrics_lock:
+                    self.metrics['rate_limited'] += 1
+                if message.attempts >= MAX_RETRIES:
+                    self._fail(message, e)
+                else:
+                    logger.warning(f"Ограничение Telegram для чата {message.chat_id}, повтор через {e.retry_after} с")
+                    self._retry(message, float(e.retry_after))
+            except BadRequest as e:
+                # BadRequest наследует NetworkError, но повтор не поможет
+                self._fail(message, e)
+            except (TimedOut, NetworkError) as e:
+                if message.attempts >= MAX_RETRIES:
+                    self._fail(message, e)
+                else:
+                    delay = min(RETRY_BASE_DELAY * 2 ** message.attempts, RETRY_MAX_DELAY)
+                    logger.warning(f"Сетевая ошибка отправки в чат {message.chat_id}: {e}, повтор через {delay} с")
+                    self._retry(message, delay)
+            except TelegramError as e:
+                self._fail(message, e)
+            except Exception as e:
+                self._fail(message, e)
+
+    def _fail(self, message, error):
+        with self._metrics_lock:
+            self.metrics['failed'] += 1
+        logger.error(f"Не удалось отправить {message.method} в чат {message.chat_id}: {error}")
+        self._done(message)
+
+
+outbound = OutboundQueue()
+
+
+def send_message(bot, chat_id, text, priority=PRIORITY_NOTIFY, **kwargs):
+    """Отправка сообщения через общую очередь"""
+    return outbound.send_message(bot, chat_id, text, priority, **kwargs)
+
+
+def send_document(bot, chat_id, document, priority=PRIORITY_NOTIFY, **kwargs):
+    """Отправка документа через общую очередь"""
+    return outbound.send_document(bot, chat_id, document, priority, **kwargs)
+
+
+def log_outbound_metrics_job(context):
+    """Периодическая запись метрик очереди в лог"""
+    metrics = outbound.get_metrics()
+    logger.info(
+        f"Очередь сообщений: поставлено {metrics['enqueued']}, отправлено {metrics['sent']}, "
+        f"ошибок {metrics['failed']}, повторов {metrics['retried']}, "
+        f"ограничений {metrics['rate_limited']}, в очереди {metrics['queued']}, "
+        f"средняя задержка {metrics['avg_latency']:.2f} с, "
+        f"повторных отправок файлов по file_id {metrics['file_id_hits']}"
+    )
@@ -0,0 +1,171 @@
+"""Горячая перезагрузка файлов справочников из каталога данных
+
+Файлы выгрузок 1С (Users.xlsx, Equipment.xlsx, tabels.xlsx) лежат в
+каталоге DATA_DIR. Каталог отслеживается через inotify, а где его нет
+(Windows, сетевые диски) - опросом раз в WATCH_POLL_INTERVAL секунд.
+Файл считается дописанным, когда его версия (время изменения и размер)
+не менялась WATCH_DEBOUNCE секунд; тогда вызывается обработчик,
+зарегистрированный для файла. Обработчики сами проверяют новый файл и
+подменяют снимок в памяти целиком, при ошибке оставляя прежний, поэтому
+обработчики сообщений никогда не читают xlsx.
+"""
+import os
+import time
+import errno
+import select
+import struct
+import logging
+import threading
+import ctypes
+import ctypes.util
+from template_service import file_version
+
+logger = logging.getLogger(__name__)
+
+WATCH_DEBOUNCE = float(os.getenv('WATCH_DEBOUNCE', 2))
+WATCH_POLL_INTERVAL = float(os.getenv('WATCH_POLL_INTERVAL', 5))
+
+# Запись закрыта, файл перемещен в каталог, создан или изменен
+_IN_EVENTS = 0x00000008 | 0x00000080 | 0x00000100 | 0x00000002
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class _Inotify:
+    """Минимальная обертка inotify через libc (только Linux)"""
+
+    def __init__(self, directories):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = libc.inotify_init()
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init')
+        self._directories = {}
+        for directory in directories:
+            wd = libc.inotify_add_watch(self._fd, os.fsencode(directory), _IN_EVENTS)
+            if wd < 0:
+                os.close(self._fd)
+                raise OSError(ctypes.get_errno(), f'inotify_add_watch {directory}')
+            self._directories[wd] = directory
+
+    def read(self, timeout):
+        """Пути файлов с событиями; ждет не дольше timeout секунд"""
+        try:
+            ready, _, _ = select.select([self._fd], [], [], timeout)
+        except InterruptedError:
+            return set()
+        if not ready:
+            return set()
+        data = os.read(self._fd, 64 * 1024)
+        paths = set()
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, _, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if wd in self._directories and name:
+                paths.add(os.path.join(self._directories[wd], os.fsdecode(name)))
+        return paths
+
+    def close(self):
+        try:
+            os.close(self._fd)
+        except OSError as e:
+            if e.errno != errno.EBADF:
+                raise
+
+
+class ReferenceWatcher:
+    """Вызов обработчиков при обновлении файлов справочников"""
+
+    def __init__(self, debounce=WATCH_DEBOUNCE, poll_interval=WATCH_POLL_INTERVAL):
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self._handlers = {}   # абсолютный путь -> (путь как задан, обработчики)
+        self._applied = {}    # абсолютный путь -> версия, переданная обработчикам
+        self._pending = {}    # абсолютный путь -> (версия, время первого наблюдения)
+        self._stop = threading.Event()
+        self._thread = None
+        self._inotify = None
+
+    def register(self, path, handler):
+        """Обработчик handler(path) для файла; вызывается в потоке наблюдателя"""
+        key = os.path.abspath(path)
+        self._handlers.setdefault(key, (path, []))[1].append(handler)
+        self._applied.setdefault(key, file_version(path))
+
+    def start(self):
+        if self._thread is not None:
+            return
+        directories = {os.path.dirname(key) for key in self._handlers}
+        try:
+            self._inotify = _Inotify(directories)
+            mode = 'inotify'
+        except (OSError, AttributeError) as e:
+            self._inotify = None
+            mode = f'опрос раз в {self.poll_interval:g} с'
+            logger.info(f"inotify недоступен ({e}), файлы справочников проверяются опросом")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='reference-watcher', daemon=True)
+        self._thread.start()
+        logger.info(f"Наблюдение за справочниками запущено ({mode}): {', '.join(sorted(directories))}")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.poll_interval + 1)
+            self._thread = None
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def reload_all(self):
+        """Принудительный вызов обработчиков всех файлов (ручное обновление из 1С)"""
+        for key in list(self._handlers):
+            self._fire(key, file_version(self._handlers[key][0]))
+
+    def _run(self):
+        last_poll = 0
+        while not self._stop.is_set():
+            # Пока есть недописанные файлы, проверяем их чаще
+            timeout = self.debounce / 2 if self._pending else self.poll_interval
+            if self._inotify is not None:
+                candidates = {path for path in self._inotify.read(timeout) if path in self._handlers}
+            else:
+                self._stop.wait(timeout)
+                candidates = set()
+            # Опрос выполняется и при inotify: события теряются на сетевых дисках
+            if time.monotonic() - last_poll >= self.poll_interval:
+                candidates.update(self._handlers)
+                last_poll = time.monotonic()
+            candidates.update(self._pending)
+            for key in candidates:
+                self._check(key)
+
+    def _check(self, key):
+        path = self._handlers[key][0]
+        version = file_version(path)
+        now = time.monotonic()
+        if version is None or version == self._applied.get(key):
+            self._pending.pop(key, None)
+            return
+        pending = self._pending.get(key)
+        if pending is None or pending[0] != version:
+            # Файл еще пишется: ждем, пока версия перестанет меняться
+            self._pending[key] = (version, now)
+            return
+        if now - pending[1] >= self.debounce:
+            self._pending.pop(key, None)
+            self._fire(key, version)
+
+    def _fire(self, key, version):
+        path, handlers = self._handlers[key]
+        self._applied[key] = version
+        logger.info(f"Файл справочника {path} обновлен, перезагрузка")
+        for handler in handlers:
+            try:
+                handler(path)
+            except Exception as e:
+                logger.error(f"Ошибка перезагрузки справочника {path}: {e}")
+
+
+reference_watcher = ReferenceWatcher()
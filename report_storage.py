@@ -0,0 +1,721 @@
+import io
+import os
+import json
+import uuid
+import shutil
+import zipfile
+import hashlib
+import logging
+import threading
+import pandas as pd
+from datetime import datetime, timedelta
+from db_utils import db_transaction
+
+logger = logging.getLogger(__name__)
+
+REPORTS_ROOT = 'meter_readings'
+ARCHIVE_DIR = os.path.join(REPORTS_ROOT, 'archive')
+BLOB_DIR = os.path.join(REPORTS_ROOT, 'blobs')
+ARCHIVE_INDEX_NAME = 'index.json'
+# Папки старше этого числа недель переносятся в архив
+ARCHIVE_AFTER_WEEKS = int(os.getenv('ARCHIVE_AFTER_WEEKS', 8))
+
+# Отклоненные и незавершенные загрузки хранятся столько дней
+STALE_UPLOADS_DAYS = int(os.getenv('STALE_UPLOADS_DAYS', 14))
+
+REPORT_TIMESTAMP_FORMAT = '%Y%m%d_%H%M%S'
+
+# Статусы записей манифеста загрузок
+UPLOAD_PENDING = 'pending'
+UPLOAD_ACCEPTED = 'accepted'
+UPLOAD_REJECTED = 'rejected'
+
+# Защищает счетчики ссылок и файлы блобов от гонок между потоками
+_blob_lock = threading.Lock()
+
+
+def get_current_week():
+    """Текущая неделя в формате имен папок отчетов"""
+    return datetime.now().strftime('%Y-W%U')
+
+
+def get_week_folder(week=None, create=False):
+    """Путь к папке отчетов недели"""
+    folder = os.path.join(REPORTS_ROOT, f'week_{week or get_current_week()}')
+    if create:
+        os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def parse_report_filename(filename):
+    """Разбор имени файла показаний
+
+    Поддерживаются имена вида meters_{location}_{division}_{tab}_{YYYYmmdd}_{HHMMSS}.xlsx,
+    с пометкой _admin_/_manager_ перед временем, а также meters_admin_{tab}_{...}.xlsx.
+    """
+    name = os.path.basename(filename)
+    if not name.startswith('meters_') or not name.endswith('.xlsx'):
+        return None
+
+    parts = name[len('meters_'):-len('.xlsx')].split('_')
+    if len(parts) < 3:
+        return None
+
+    try:
+        timestamp = datetime.strptime('_'.join(parts[-2:]), REPORT_TIMESTAMP_FORMAT)
+    except ValueError:
+        return None
+
+    rest = parts[:-2]
+    source = 'user'
+    if rest and rest[-1] in ('admin', 'manager'):
+        source = rest.pop()
+    elif len(rest) == 2 and rest[0] == 'admin':
+        source = 'admin'
+        rest = rest[1:]
+
+    if not rest or not rest[-1].isdigit():
+        return None
+    tab_number = int(rest.pop())
+
+    return {
+        'name': name,
+        'location': rest[0] if rest else None,
+        'division': '_'.join(rest[1:]) if len(rest) > 1 else None,
+        'tab_number': tab_number,
+        'source': source,
+        'timestamp': timestamp
+    }
+
+
+def _matches(meta, location, division, tab_number):
+    if meta is None:
+        return False
+    if location is not None and meta['location'] != location:
+        return False
+    if division is not None and meta['division'] != division:
+        return False
+    if tab_number is not None and str(meta['tab_number']) != str(tab_number):
+        return False
+    return True
+
+
+def _folder_date(folder_name):
+    """Дата, к которой относится папка week_* или report_cycle_*"""
+    try:
+        if folder_name.startswith('week_'):
+            return datetime.strptime(folder_name[len('week_'):] + '-1', '%Y-W%U-%w')
+        if folder_name.startswith('report_cycle_'):
+            return datetime.strptime(folder_name[len('report_cycle_'):][:10], '%Y-%m-%d')
+    except ValueError:
+        pass
+    return None
+
+
+def _hot_folders(week=None):
+    if week is not None:
+        folder = get_week_folder(week)
+        return [folder] if os.path.isdir(folder) else []
+    if not os.path.isdir(REPORTS_ROOT):
+        return []
+    return [
+        os.path.join(REPORTS_ROOT, entry) for entry in sorted(os.listdir(REPORTS_ROOT))
+        if _folder_date(entry) is not None and os.path.isdir(os.path.join(REPORTS_ROOT, entry))
+    ]
+
+
+def _query_index(table, location, division, tab_number, week, conditions=None):
+    """Поиск путей в таблице-индексе (манифест загрузок или архив)"""
+    conditions, params = list(conditions or []), []
+    for column, value in (('location', location), ('division', division), ('tab_number', tab_number)):
+        if value is not None:
+            conditions.append(f'{column} = ?')
+            params.append(value)
+    if week is not None:
+        conditions.append('folder = ?')
+        params.append(f'week_{week}')
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    found = []
+    with db_transaction() as cursor:
+        cursor.execute(f'SELECT path, report_timestamp FROM {table} {where}', params)
+        for path, report_timestamp in cursor.fetchall():
+            timestamp = datetime.strptime(report_timestamp, '%Y-%m-%d %H:%M:%S') if report_timestamp else datetime.min
+            found.append((timestamp, path))
+    return found
+
+
+def find_report_files(location=None, division=None, tab_number=None, week=None,
+                      include_archived=False, include_rejected=False):
+    """Поиск файлов показаний, от самого свежего к самому старому
+
+    Без week просматриваются все недели. Новые загрузки ищутся в манифесте
+    хранилища блобов, более старые файлы - в папках на диске. При
+    include_archived в поиск попадают и файлы, перенесенные в архив.
+    Все найденные пути открываются через open_report_file.
+    """
+    found = []
+    for folder in _hot_folders(week):
+        for filename in os.listdir(folder):
+            meta = parse_report_filename(filename)
+            if _matches(meta, location, division, tab_number):
+                found.append((meta['timestamp'], _normalize_path(os.path.join(folder, filename))))
+
+    try:
+        conditions = [] if include_rejected else [f"status != '{UPLOAD_REJECTED}'"]
+        found.extend(_query_index('upload_manifest', location, division, tab_number, week, conditions))
+    except Exception as e:
+        logger.error(f"Ошибка поиска в манифесте загрузок: {e}")
+
+    if include_archived:
+        try:
+            found.extend(_query_index('archived_reports', location, division, tab_number, week))
+        except Exception as e:
+            logger.error(f"Ошибка поиска в архиве отчетов: {e}")
+
+    found.sort(key=lambda item: item[0], reverse=True)
+    paths = []
+    for _, path in found:
+        if path not in paths:
+            paths.append(path)
+    return paths
+
+
+def find_latest_report_file(location=None, division=None, tab_number=None, week=None, include_archived=False):
+    """Самый свежий файл показаний пользователя или None"""
+    files = find_report_files(location, division, tab_number, week, include_archived)
+    return files[0] if files else None
+
+
+def _normalize_path(path):
+    return os.path.normpath(path).replace(os.sep, '/')
+
+
+def _find_archived(path):
+    with db_transaction() as cursor:
+        cursor.execute('''
+            SELECT archive_path, member_name FROM archived_reports WHERE path = ?
+        ''', (_normalize_path(path),))
+        return cursor.fetchone()
+
+
+def _blob_path(content_hash):
+    return os.path.join(BLOB_DIR, content_hash[:2], f'{content_hash}.xlsx')
+
+
+def _find_upload(path):
+    with db_transaction() as cursor:
+        cursor.execute('''
+            SELECT blob_hash FROM upload_manifest WHERE path = ?
+        ''', (_normalize_path(path),))
+        result = cursor.fetchone()
+    return result[0] if result else None
+
+
+def _write_blob(content_hash, data):
+    blob_path = _blob_path(content_hash)
+    if os.path.exists(blob_path):
+        return blob_path
+    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    tmp_path = f'{blob_path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, blob_path)
+    return blob_path
+
+
+def _release_blob(cursor, content_hash):
+    """Снятие одной ссылки с блоба; возвращает путь файла, если ссылок не осталось"""
+    cursor.execute('''
+        UPDATE upload_blobs SET ref_count = ref_count - 1 WHERE hash = ?
+    ''', (content_hash,))
+    cursor.execute('''
+        DELETE FROM upload_blobs WHERE hash = ? AND ref_count <= 0
+    ''', (content_hash,))
+    return _blob_path(content_hash) if cursor.rowcount else None
+
+
+def _remove_blob_files(blob_paths):
+    for blob_path in blob_paths:
+        try:
+            if blob_path and os.path.exists(blob_path):
+                os.remove(blob_path)
+        except OSError as e:
+            logger.error(f"Ошибка удаления блоба {blob_path}: {e}")
+
+
+def store_upload(data, path, status=UPLOAD_ACCEPTED):
+    """Сохранение загруженного файла в хранилище блобов
+
+    Содержимое хранится один раз под своим SHA-256, а path - прежнее имя
+    файла в папке недели - становится записью манифеста, ссылающейся на блоб.
+    Повторное сохранение по тому же path заменяет содержимое записи.
+    """
+    if hasattr(data, 'read'):
+        data.seek(0)
+        data = data.read()
+    path = _normalize_path(path)
+    content_hash = hashlib.sha256(data).hexdigest()
+    meta = parse_report_filename(path) or {}
+    timestamp = meta.get('timestamp')
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    with _blob_lock:
+        # Файл блоба пишется до записи в БД, чтобы манифест не ссылался на пустоту
+        _write_blob(content_hash, data)
+        with db_transaction(immediate=True) as cursor:
+            cursor.execute('SELECT blob_hash FROM upload_manifest WHERE path = ?', (path,))
+            previous = cursor.fetchone()
+
+            cursor.execute('''
+                INSERT INTO upload_blobs (hash, size, ref_count, created_at)
+                VALUES (?, ?, 1, ?)
+                ON CONFLICT(hash) DO UPDATE SET ref_count = ref_count + 1
+            ''', (content_hash, len(data), now))
+
+            cursor.execute('''
+                INSERT OR REPLACE INTO upload_manifest (
+                    path, blob_hash, folder, location, division, tab_number,
+                    source, status, report_timestamp, created_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                path, content_hash, os.path.basename(os.path.dirname(path)),
+                meta.get('location'), meta.get('division'), meta.get('tab_number'),
+                meta.get('source'), status,
+                timestamp.strftime('%Y-%m-%d %H:%M:%S') if timestamp else now, now
+            ))
+
+            unused_blob = _release_blob(cursor, previous[0]) if previous else None
+        _remove_blob_files([unused_blob])
+
+    logger.info(f"Файл {path} сохранен в хранилище (blob {content_hash[:12]})")
+    return path
+
+
+def store_frame(df, path, status=UPLOAD_ACCEPTED, **to_excel_kwargs):
+    """Сохранение DataFrame в хранилище блобов в виде xlsx"""
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False, **to_excel_kwargs)
+    return store_upload(buffer.getvalue(), path, status)
+
+
+def set_upload_status(path, status):
+    """Изменение статуса записи манифеста (pending/accepted/rejected)"""
+    try:
+        with db_transaction(immediate=True) as cursor:
+            cursor.execute('''
+                UPDATE upload_manifest SET status = ? WHERE path = ?
+            ''', (status, _normalize_path(path)))
+    except Exception as e:
+        logger.error(f"Ошибка изменения статуса загрузки {path}: {e}")
+
+
+def release_upload(path):
+    """Удаление записи манифеста; блоб удаляется, когда на него не осталось ссылок"""
+    path = _normalize_path(path)
+    with _blob_lock:
+        with db_transaction(immediate=True) as cursor:
+            cursor.execute('SELECT blob_hash FROM upload_manifest WHERE path = ?', (path,))
+            result = cursor.fetchone()
+            if not result:
+                return False
+            cursor.execute('DELETE FROM upload_manifest WHERE path = ?', (path,))
+            unused_blob = _release_blob(cursor, result[0])
+        _remove_blob_files([unused_blob])
+    return True
+
+
+def remove_report_file(path):
+    """Удаление файла показаний из хранилища или со старого места на диске"""
+    try:
+        if release_upload(path):
+            return True
+        if os.path.exists(path):
+            os.remove(path)
+            return True
+    except Exception as e:
+        logger.error(f"Ошибка удаления файла {path}: {e}")
+    return False
+
+
+def cleanup_uploads(days=STALE_UPLOADS_DAYS):
+    """Удаление старых отклоненных и незавершенных загрузок и блобов без ссылок"""
+    threshold = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+    with db_transaction() as cursor:
+        cursor.execute('''
+            SELECT path FROM upload_manifest
+            WHERE status IN (?, ?) AND created_at < ?
+        ''', (UPLOAD_REJECTED, UPLOAD_PENDING, threshold))
+        stale = [row[0] for row in cursor.fetchall()]
+
+    for path in stale:
+        release_upload(path)
+    if stale:
+        with db_transaction(immediate=True) as cursor:
+            cursor.executemany('DELETE FROM submission_patches WHERE path = ?', [(path,) for path in stale])
+
+    with _blob_lock:
+        with db_transaction() as cursor:
+            cursor.execute('SELECT hash FROM upload_blobs')
+            referenced = {row[0] for row in cursor.fetchall()}
+        orphans = []
+        if os.path.isdir(BLOB_DIR):
+            for prefix in os.listdir(BLOB_DIR):
+                prefix_dir = os.path.join(BLOB_DIR, prefix)
+                if not os.path.isdir(prefix_dir):
+                    continue
+                for filename in os.listdir(prefix_dir):
+                    if filename.split('.')[0] not in referenced:
+                        orphans.append(os.path.join(prefix_dir, filename))
+        _remove_blob_files(orphans)
+
+    logger.info(f"Очистка загрузок: удалено записей {len(stale)}, файлов без ссылок {len(orphans)}")
+    return {'released': len(stale), 'orphans': len(orphans)}
+
+
+def cleanup_uploads_job(context):
+    """Ежедневное задание очистки хранилища загрузок"""
+    try:
+        cleanup_uploads()
+    except Exception as e:
+        logger.error(f"Ошибка очистки хранилища загрузок: {e}")
+
+
+def open_report_file(path):
+    """Открытие файла показаний на чтение (хранилище блобов, диск или архив)"""
+    content_hash = _find_upload(path)
+    if content_hash:
+        return open(_blob_path(content_hash), 'rb')
+
+    if os.path.exists(path):
+        return open(path, 'rb')
+
+    archived = _find_archived(path)
+    if not archived:
+        raise FileNotFoundError(path)
+
+    archive_path, member_name = archived
+    with zipfile.ZipFile(archive_path) as archive:
+        return io.BytesIO(archive.read(member_name))
+
+
+def report_file_exists(path):
+    """Проверка наличия файла показаний на диске, в хранилище или в архиве"""
+    if os.path.exists(path):
+        return True
+    try:
+        return _find_upload(path) is not None or _find_archived(path) is not None
+    except Exception as e:
+        logger.error(f"Ошибка проверки файла в архиве {path}: {e}")
+        return False
+
+
+def match_submission_rows(df, inv_num, meter_type):
+    """Маска строк файла показаний с заданным инв. номером и типом счетчика"""
+    return (
+        (df['Инв. №'].astype(str).str.strip() == str(inv_num).strip()) &
+        (df['Счётчик'].astype(str).str.strip().str.upper() == str(meter_type).strip().upper())
+    )
+
+
+def add_submission_patch(path, inv_num, meter_type, values, request_id=None):
+    """Запись правки строки файла показаний без перезаписи самого файла
+
+    Правки накапливаются в submission_patches и применяются при чтении
+    через load_submission/open_submission, а в файл переносятся плановым
+    уплотнением compact_submission_patches.
+    """
+    with db_transaction(immediate=True) as cursor:
+        cursor.execute('''
+            INSERT INTO submission_patches (
+                path, inv_num, meter_type, patch, request_id, created_at
+            ) VALUES (?, ?, ?, ?, ?, ?)
+        ''', (
+            _normalize_path(path), str(inv_num).strip(), str(meter_type).strip(),
+            json.dumps(values, ensure_ascii=False), request_id,
+            datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        ))
+        return cursor.lastrowid
+
+
+def get_submission_patches(path):
+    """Правки файла показаний в порядке их записи"""
+    with db_transaction() as cursor:
+        cursor.execute('''
+            SELECT id, inv_num, meter_type, patch FROM submission_patches
+            WHERE path = ? ORDER BY id
+        ''', (_normalize_path(path),))
+        return [(patch_id, inv_num, meter_type, json.loads(patch))
+                for patch_id, inv_num, meter_type, patch in cursor.fetchall()]
+
+
+def apply_submission_patches(df, patches):
+    """Применение правок к DataFrame файла показаний"""
+    for _, inv_num, meter_type, values in patches:
+        mask = match_submission_rows(df, inv_num, meter_type)
+        if not mask.any():
+            logger.warning(f"Правка не применена: строка {inv_num}/{meter_type} не найдена")
+            continue
+        for column, value in values.items():
+            if column not in df.columns:
+                df[column] = None
+            df[column] = df[column].astype(object)
+            df.loc[mask, column] = value
+    return df
+
+
+def load_submission(path):
+    """Чтение файла показаний с примененными правками"""
+    with open_report_file(path) as f:
+        df = pd.read_excel(f)
+    patches = get_submission_patches(path)
+    return apply_submission_patches(df, patches) if patches else df
+
+
+def open_submission(path):
+    """Открытие файла показаний с примененными правками как xlsx
+
+    Без правок возвращается исходный файл, иначе собирается новый xlsx
+    в памяти.
+    """
+    if not get_submission_patches(path):
+        return open_report_file(path)
+    buffer = io.BytesIO()
+    load_submission(path).to_excel(buffer, index=False)
+    buffer.seek(0)
+    return buffer
+
+
+def compact_submission(path):
+    """Перенос накопленных правок в файл показаний"""
+    patches = get_submission_patches(path)
+    if not patches:
+        return 0
+    if _find_upload(path) is None and not os.path.exists(path):
+        # Файлы в архиве не переписываются, правки продолжают применяться при чтении
+        return 0
+
+    with db_transaction() as cursor:
+        cursor.execute('SELECT status FROM upload_manifest WHERE path = ?', (_normalize_path(path),))
+        result = cursor.fetchone()
+    status = result[0] if result else UPLOAD_ACCEPTED
+
+    with open_report_file(path) as f:
+        df = pd.read_excel(f)
+    store_frame(apply_submission_patches(df, patches), path, status)
+
+    with db_transaction(immediate=True) as cursor:
+        cursor.execute('''
+            DELETE FROM submission_patches WHERE path = ? AND id <= ?
+        ''', (_normalize_path(path), patches[-1][0]))
+
+    if os.path.exists(path):
+        # Файл со старого места на диске заменен записью в хранилище
+        os.remove(path)
+    return len(patches)
+
+
+def compact_submission_patches():
+    """Уплотнение правок всех файлов показаний"""
+    with db_transaction() as cursor:
+        cursor.execute('SELECT DISTINCT path FROM submission_patches')
+        paths = [row[0] for row in cursor.fetchall()]
+
+    compacted = 0
+    for path in paths:
+        try:
+            compacted += compact_submission(path)
+        except Exception as e:
+            logger.error(f"Ошибка уплотнения правок файла {path}: {e}")
+    return compacted
+
+
+def compact_patches_job(context):
+    """Ежедневное задание переноса правок в файлы показаний"""
+    try:
+        compacted = compact_submission_patches()
+        logger.info(f"Уплотнение правок завершено: перенесено {compacted} правок")
+    except Exception as e:
+        logger.error(f"Ошибка уплотнения правок: {e}")
+
+
+def _build_index_entry(folder_name, file_path, logical_path=None):
+    logical_path = logical_path or file_path
+    stat = os.stat(file_path)
+    meta = parse_report_filename(logical_path) or {}
+    timestamp = meta.get('timestamp')
+    return {
+        'name': os.path.basename(logical_path),
+        'path': _normalize_path(logical_path),
+        'folder': folder_name,
+        'size': stat.st_size,
+        'mtime': datetime.fromtimestamp(stat.st_mtime).strftime('%Y-%m-%d %H:%M:%S'),
+        'location': meta.get('location'),
+        'division': meta.get('division'),
+        'tab_number': meta.get('tab_number'),
+        'source': meta.get('source'),
+        'report_timestamp': timestamp.strftime('%Y-%m-%d %H:%M:%S') if timestamp else None
+    }
+
+
+def _next_archive_path(folder_name):
+    archive_path = os.path.join(ARCHIVE_DIR, f'{folder_name}.zip')
+    counter = 1
+    while os.path.exists(archive_path):
+        counter += 1
+        archive_path = os.path.join(ARCHIVE_DIR, f'{folder_name}_{counter}.zip')
+    return archive_path
+
+
+def _manifest_folder_entries(folder_name):
+    """Загрузки недели из манифеста: (путь блоба, логический путь, статус)"""
+    with db_transaction() as cursor:
+        cursor.execute('''
+            SELECT path, blob_hash, status FROM upload_manifest
+            WHERE folder = ? ORDER BY path
+        ''', (folder_name,))
+        return [(_blob_path(blob_hash), path, status) for path, blob_hash, status in cursor.fetchall()]
+
+
+def _manifest_folders():
+    with db_transaction() as cursor:
+        cursor.execute('SELECT DISTINCT folder FROM upload_manifest')
+        return [row[0] for row in cursor.fetchall() if row[0]]
+
+
+def archive_folder(folder_path):
+    """Упаковка папки отчетов в сжатый архив с индексом содержимого
+
+    В архив попадают файлы папки на диске и принятые загрузки этой недели
+    из хранилища блобов. Архив сначала пишется во временный файл и
+    проверяется, затем в БД записывается индекс, и только после этого
+    исходная папка удаляется, а ссылки на блобы снимаются.
+    """
+    folder_name = os.path.basename(os.path.normpath(folder_path))
+    sources = []
+    if os.path.isdir(folder_path):
+        sources = [
+            (os.path.join(folder_path, filename), None) for filename in sorted(os.listdir(folder_path))
+            if os.path.isfile(os.path.join(folder_path, filename))
+        ]
+
+    uploads = _manifest_folder_entries(folder_name)
+    # Запись манифеста новее одноименного файла на диске
+    uploaded_paths = {path for _, path, _ in uploads}
+    sources = [source for source in sources if _normalize_path(source[0]) not in uploaded_paths]
+    for blob_path, path, status in uploads:
+        if status != UPLOAD_REJECTED and os.path.exists(blob_path):
+            sources.append((blob_path, path))
+
+    if not sources:
+        shutil.rmtree(folder_path, ignore_errors=True)
+        for _, path, _ in uploads:
+            release_upload(path)
+        return None
+
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    archive_path = _next_archive_path(folder_name)
+    tmp_path = archive_path + '.tmp'
+
+    index = [_build_index_entry(folder_name, file_path, path) for file_path, path in sources]
+    original_bytes = sum(entry['size'] for entry in index)
+
+    try:
+        with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=9) as archive:
+            for entry, (file_path, _) in zip(index, sources):
+                archive.write(file_path, arcname=entry['name'])
+            archive.writestr(ARCHIVE_INDEX_NAME, json.dumps({
+                'folder': folder_name,
+                'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'files': index
+            }, ensure_ascii=False, indent=2))
+
+        with zipfile.ZipFile(tmp_path) as archive:
+            broken = archive.testzip()
+            if broken:
+                raise IOError(f"Поврежден элемент архива: {broken}")
+
+        os.replace(tmp_path, archive_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    archived_bytes = os.path.getsize(archive_path)
+    saved_bytes = original_bytes - archived_bytes
+
+    try:
+        with db_transaction(immediate=True) as cursor:
+            cursor.executemany('''
+                INSERT OR REPLACE INTO archived_reports (
+                    path, archive_path, member_name, folder, location, division,
+                    tab_number, source, report_timestamp, size
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [(
+                entry['path'], archive_path, entry['name'], folder_name, entry['location'],
+                entry['division'], entry['tab_number'], entry['source'],
+                entry['report_timestamp'], entry['size']
+            ) for entry in index])
+            cursor.execute('''
+                INSERT INTO archive_log (
+                    folder, archive_path, files_count, original_bytes,
+                    archived_bytes, saved_bytes, created_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                folder_name, archive_path, len(index), original_bytes, archived_bytes,
+                saved_bytes, datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            ))
+    except Exception:
+        # Без индекса архив бесполезен: оставляем исходную папку на месте
+        os.remove(archive_path)
+        raise
+
+    shutil.rmtree(folder_path, ignore_errors=True)
+    for _, path, _ in uploads:
+        release_upload(path)
+    logger.info(
+        f"Папка {folder_name} перенесена в архив {archive_path}: "
+        f"{len(index)} файлов, освобождено {saved_bytes} байт"
+    )
+    return {
+        'folder': folder_name,
+        'archive_path': archive_path,
+        'files_count': len(index),
+        'original_bytes': original_bytes,
+        'archived_bytes': archived_bytes,
+        'saved_bytes': saved_bytes
+    }
+
+
+def archive_old_folders(weeks=ARCHIVE_AFTER_WEEKS):
+    """Перенос в архив всех папок отчетов старше заданного числа недель"""
+    threshold = datetime.now() - timedelta(weeks=weeks)
+    results = []
+    folders = {os.path.basename(folder): folder for folder in _hot_folders()}
+    try:
+        for folder_name in _manifest_folders():
+            folders.setdefault(folder_name, os.path.join(REPORTS_ROOT, folder_name))
+    except Exception as e:
+        logger.error(f"Ошибка чтения манифеста загрузок: {e}")
+
+    for folder_name, folder in sorted(folders.items()):
+        folder_date = _folder_date(folder_name)
+        if folder_date is None or folder_date >= threshold:
+            continue
+        try:
+            result = archive_folder(folder)
+            if result:
+                results.append(result)
+        except Exception as e:
+            logger.error(f"Ошибка архивации папки {folder}: {e}")
+    return results
+
+
+def archive_old_reports_job(context):
+    """Еженедельное задание архивации старых папок отчетов"""
+    try:
+        results = archive_old_folders()
+        saved = sum(result['saved_bytes'] for result in results)
+        logger.info(f"Архивация завершена: папок {len(results)}, освобождено {saved} байт")
+    except Exception as e:
+        logger.error(f"Ошибка архивации старых отчетов: {e}")
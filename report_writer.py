@@ -0,0 +1,134 @@
+import os
+import tempfile
+import logging
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+
+logger = logging.getLogger(__name__)
+
+# Порог, после которого готовый файл отчета сбрасывается из памяти на диск
+SPOOL_MAX_SIZE = int(os.getenv('REPORT_SPOOL_MAX_SIZE', 8 * 1024 * 1024))
+# Сколько строк читаем из курсора за один fetchmany
+CURSOR_BATCH_SIZE = 500
+# Ограничение Excel на длину имени листа
+SHEET_TITLE_MAX_LEN = 31
+
+
+def iter_cursor_rows(cursor, batch_size=CURSOR_BATCH_SIZE):
+    """Построчная выдача результата запроса пачками через fetchmany"""
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            yield row
+
+
+def iter_frame_rows(frames, columns):
+    """Выдача строк из последовательности DataFrame в порядке колонок отчета"""
+    for df in frames:
+        if df is None or df.empty:
+            continue
+        df = df.reindex(columns=columns)
+        df = df.astype(object).where(pd.notna(df), None)
+        for row in df.itertuples(index=False, name=None):
+            yield row
+
+
+def header_positions(header):
+    """Позиции и имена непустых ячеек строки заголовков"""
+    return [(pos, name) for pos, name in enumerate(header) if name is not None]
+
+
+def read_excel_header(file_path):
+    """Чтение только строки заголовков Excel-файла (без пустых ячеек)"""
+    workbook = load_workbook(file_path, read_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        for row in sheet.iter_rows(max_row=1, values_only=True):
+            return [name for _, name in header_positions(row)]
+        return []
+    finally:
+        workbook.close()
+
+
+def iter_excel_rows(file_path, columns=None):
+    """Построчное чтение Excel-файла без загрузки его целиком в память
+
+    Значения берутся по позициям непустых заголовков, поэтому строки
+    совпадают с read_excel_header. Если передан columns, строки приводятся
+    к этому порядку колонок (отсутствующие колонки заполняются None).
+    """
+    workbook = load_workbook(file_path, read_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        named = header_positions(header)
+        if columns is None:
+            positions = [pos for pos, _ in named]
+        else:
+            index = {name: pos for pos, name in named}
+            positions = [index.get(col) for col in columns]
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            yield tuple(row[pos] if pos is not None and pos < len(row) else None
+                        for pos in positions)
+    finally:
+        workbook.close()
+
+
+class StreamingExcelWriter:
+    """Потоковая запись Excel-отчетов с ограниченным потреблением памяти
+
+    Листы пишутся в режиме write_only: строки сразу уходят во временные
+    файлы openpyxl и не накапливаются в памяти. Готовый xlsx собирается
+    во временный файл, который держится в памяти до SPOOL_MAX_SIZE байт,
+    а при большем объеме автоматически сбрасывается на диск.
+    """
+
+    def __init__(self, spool_max_size=SPOOL_MAX_SIZE):
+        self.workbook = Workbook(write_only=True)
+        self.spool_max_size = spool_max_size
+        self.rows_written = 0
+
+    def add_sheet(self, title, columns, rows):
+        """Добавление листа из итератора строк, возвращает число записанных строк"""
+        sheet = self.workbook.create_sheet(title=str(title)[:SHEET_TITLE_MAX_LEN])
+        sheet.append(list(columns))
+        count = 0
+        for row in rows:
+            sheet.append(list(row))
+            count += 1
+        self.rows_written += count
+        return count
+
+    def add_frame(self, title, df):
+        """Добавление листа из одного DataFrame"""
+        columns = list(df.columns)
+        return self.add_sheet(title, columns, iter_frame_rows([df], columns))
+
+    def add_frames(self, title, frames, columns):
+        """Добавление листа из последовательности DataFrame с общими колонками"""
+        return self.add_sheet(title, columns, iter_frame_rows(frames, columns))
+
+    def add_cursor(self, title, columns, cursor, batch_size=CURSOR_BATCH_SIZE):
+        """Добавление листа напрямую из курсора БД"""
+        return self.add_sheet(title, columns, iter_cursor_rows(cursor, batch_size))
+
+    def save(self):
+        """Сборка xlsx; возвращает файловый объект, установленный на начало"""
+        output = tempfile.SpooledTemporaryFile(max_size=self.spool_max_size)
+        self.workbook.save(output)
+        output.seek(0)
+        logger.info(f"Сформирован Excel-отчет: {self.rows_written} строк")
+        return output
+
+
+def frame_to_excel(df, sheet_name='Sheet1'):
+    """Запись одного DataFrame в Excel через потоковый writer"""
+    writer = StreamingExcelWriter()
+    writer.add_frame(sheet_name, df)
+    return writer.save()
@@ -0,0 +1,99 @@
+"""Состав сотрудников бота в памяти процесса
+
+Все сотрудники хранятся в таблице people с колонкой role; прежние таблицы
+Users_admin_bot, Users_dir_bot и Users_user_bot остались представлениями
+над ней. Roster один раз читает people и отвечает на вопросы вида
+"администраторы подразделения" без обращения к БД. Код, меняющий people,
+вызывает invalidate(); изменения в обход бота подхватываются через
+ROSTER_TTL секунд.
+"""
+import os
+import time
+import logging
+import threading
+from collections import namedtuple
+from db_utils import db_transaction
+from users_directory import ROLE_ADMIN, ROLE_MANAGER, ROLE_USER
+
+logger = logging.getLogger(__name__)
+
+ROSTER_TTL = int(os.getenv('ROSTER_TTL', 300))
+
+# Представления для старого кода: роль -> имя представления над people
+ROLE_TABLES = {
+    ROLE_ADMIN: 'Users_admin_bot',
+    ROLE_MANAGER: 'Users_dir_bot',
+    ROLE_USER: 'Users_user_bot'
+}
+
+Person = namedtuple('Person', ['tab_number', 'name', 'role', 'chat_id', 'location', 'division'])
+
+
+class _Snapshot:
+    __slots__ = ('by_tab', 'by_role', 'by_division', 'by_location_division')
+
+    def __init__(self, people):
+        self.by_tab = {}
+        self.by_role = {}
+        self.by_division = {}
+        self.by_location_division = {}
+        for person in people:
+            self.by_tab[person.tab_number] = person
+            self.by_role.setdefault(person.role, []).append(person)
+            self.by_division.setdefault((person.role, person.division), []).append(person)
+            self.by_location_division.setdefault((person.role, person.location, person.division), []).append(person)
+
+
+class Roster:
+    """Кэш таблицы people по табельному номеру, роли и подразделению"""
+
+    def __init__(self, ttl=ROSTER_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._expires = 0
+
+    def invalidate(self):
+        """Сброс кэша после изменения people"""
+        self._expires = 0
+
+    def _current(self):
+        if time.monotonic() < self._expires:
+            return self._snapshot
+        with self._lock:
+            if time.monotonic() < self._expires:
+                return self._snapshot
+            # Срок выставляется до чтения, чтобы invalidate() во время загрузки не потерялся
+            self._expires = time.monotonic() + self.ttl
+            try:
+                with db_transaction() as cursor:
+                    cursor.execute('SELECT tab_number, name, role, chat_id, location, division FROM people')
+                    self._snapshot = _Snapshot(Person(*row) for row in cursor.fetchall())
+            except Exception as e:
+                logger.error(f"Ошибка загрузки состава сотрудников: {e}")
+                self._expires = 0
+                if self._snapshot is None:
+                    return _Snapshot(())
+            return self._snapshot
+
+    def get(self, tab_number):
+        """Сотрудник по табельному номеру или None"""
+        return self._current().by_tab.get(tab_number)
+
+    def members(self, role, division=None, location=None):
+        """Сотрудники роли, при необходимости в подразделении (и локации)"""
+        snapshot = self._current()
+        if location is not None:
+            return list(snapshot.by_location_division.get((role, location, division), ()))
+        if division is not None:
+            return list(snapshot.by_division.get((role, division), ()))
+        return list(snapshot.by_role.get(role, ()))
+
+    def admins_for_division(self, division, location=None):
+        return self.members(ROLE_ADMIN, division, location)
+
+    def managers_for_division(self, division, location=None):
+        return self.members(ROLE_MANAGER, division, location)
+
+
+roster = Roster()
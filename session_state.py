@@ -0,0 +1,179 @@
+"""Компактное состояние диалогов ручного ввода показаний
+
+Записи оборудования хранятся один раз на процесс в общей таблице
+EQUIPMENT, а сессии пользователей держат только массивы индексов в ней.
+Показания хранятся тремя массивами (оборудование, значение, комментарий)
+вместо списка словарей с копией записи оборудования.
+
+Последние показания по оборудованию сессии загружаются одним запросом
+при ее начале (prefetch_last_readings) и хранятся рядом с индексами.
+
+EquipmentSequence и ReadingLog поддерживают чтение так же, как списки,
+которые раньше лежали в context.user_data: len, индекс, перебор, а
+записи показаний при переборе выдаются словарями
+{'equipment', 'value', 'comment'}.
+"""
+import math
+import threading
+from array import array
+
+EQUIPMENT_FIELDS = ('Гос. номер', 'Инв. №', 'Счётчик')
+_FIELD_POSITIONS = {name: pos for pos, name in enumerate(EQUIPMENT_FIELDS)}
+
+
+class EquipmentRecord(tuple):
+    """Неизменяемая запись оборудования с доступом по названию колонки"""
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return tuple.__getitem__(self, _FIELD_POSITIONS[key])
+        return tuple.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        pos = _FIELD_POSITIONS.get(key)
+        return default if pos is None else tuple.__getitem__(self, pos)
+
+
+def _plain(value):
+    # Значения из pandas приводятся к встроенным типам, чтобы одинаковые
+    # записи совпадали при интернировании
+    return value.item() if hasattr(value, 'item') else value
+
+
+class InternTable:
+    """Общая на процесс таблица интернированных значений
+
+    Значения только добавляются, поэтому индексы, выданные сессиям,
+    остаются действительными все время работы бота.
+    """
+
+    def __init__(self, factory=None):
+        self._factory = factory
+        self._values = []
+        self._index = {}
+        self._lock = threading.Lock()
+
+    def intern(self, value):
+        position = self._index.get(value)
+        if position is not None:
+            return position
+        with self._lock:
+            position = self._index.get(value)
+            if position is None:
+                position = len(self._values)
+                self._values.append(self._factory(value) if self._factory else value)
+                self._index[value] = position
+            return position
+
+    def __getitem__(self, position):
+        return self._values[position]
+
+    def __len__(self):
+        return len(self._values)
+
+
+EQUIPMENT = InternTable(EquipmentRecord)
+COMMENTS = InternTable()
+COMMENTS.intern('')
+# Даты последних показаний повторяются у всего оборудования одной подачи
+DATES = InternTable()
+
+
+def intern_equipment(record):
+    """Индекс записи оборудования (словарь, Series или EquipmentRecord)"""
+    return EQUIPMENT.intern(tuple(_plain(record[field]) for field in EQUIPMENT_FIELDS))
+
+
+class EquipmentSequence:
+    """Список оборудования сессии: индексы в общей таблице EQUIPMENT"""
+    __slots__ = ('ids', 'last_values', 'last_dates')
+
+    def __init__(self, ids=None):
+        self.ids = array('I', ids or ())
+        self.last_values = None
+        self.last_dates = None
+
+    @classmethod
+    def from_frame(cls, equipment_df):
+        columns = [equipment_df[field].tolist() for field in EQUIPMENT_FIELDS]
+        return cls(EQUIPMENT.intern(values) for values in zip(*columns))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, position):
+        return EQUIPMENT[self.ids[position]]
+
+    def __iter__(self):
+        for equipment_id in self.ids:
+            yield EQUIPMENT[equipment_id]
+
+    def prefetch_last_readings(self, fetch):
+        """Загрузка последних показаний для всего списка
+
+        fetch - функция, принимающая пары (инв. номер, счетчик) и
+        возвращающая словарь в формате check.get_last_readings.
+        """
+        keys = [(record['Инв. №'], record['Счётчик']) for record in self]
+        found = fetch(keys)
+        self.last_values = array('d')
+        self.last_dates = array('I')
+        for key in keys:
+            last = found.get(key)
+            if last is None:
+                self.last_values.append(math.nan)
+                self.last_dates.append(0)
+            else:
+                reading = last['reading']
+                self.last_values.append(math.nan if reading is None else reading)
+                # 0 - отсутствие показания, поэтому даты сдвинуты на единицу
+                self.last_dates.append(DATES.intern(last['reading_date']) + 1)
+        return self
+
+    def last_reading(self, position):
+        """Последнее показание в формате MeterValidator._get_last_reading"""
+        if self.last_dates is None or not self.last_dates[position]:
+            return None
+        value = self.last_values[position]
+        return {
+            'reading': None if math.isnan(value) else value,
+            'reading_date': DATES[self.last_dates[position] - 1]
+        }
+
+
+class ReadingLog:
+    """Введенные показания сессии: индекс оборудования, значение, комментарий
+
+    Отсутствующее значение хранится как NaN и выдается как None.
+    """
+    __slots__ = ('equipment_ids', 'values', 'comments')
+
+    def __init__(self):
+        self.equipment_ids = array('I')
+        self.values = array('d')
+        self.comments = array('H')
+
+    def add(self, equipment, value, comment=''):
+        self.equipment_ids.append(intern_equipment(equipment))
+        self.values.append(math.nan if value is None else float(value))
+        self.comments.append(COMMENTS.intern(comment or ''))
+
+    def append(self, reading):
+        """Добавление в формате прежнего списка словарей"""
+        self.add(reading['equipment'], reading.get('value'), reading.get('comment', ''))
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, position):
+        value = self.values[position]
+        return {
+            'equipment': EQUIPMENT[self.equipment_ids[position]],
+            'value': None if math.isnan(value) else value,
+            'comment': COMMENTS[self.comments[position]]
+        }
+
+    def __iter__(self):
+        for position in range(len(self.values)):
+            yield self[position]
@@ -0,0 +1,245 @@
+"""Вахты сотрудников интервалами и их индекс в памяти
+
+Табель хранится не строкой на сотрудника и день, а интервалами
+(сотрудник, первый день, последний день, статус): подряд идущие дни с
+одинаковым статусом сливаются в одну запись, поэтому месячная вахта - одна
+строка таблицы shift_intervals. Даты хранятся в формате ГГГГ-ММ-ДД и
+сравниваются как строки.
+
+ShiftStore держит интервалы каждого сотрудника отсортированными по началу
+и находит статус на дату бинарным поиском. Снимок перестраивается после
+загрузки табеля (ShiftsHandler.load_tabel, в том числе ежедневным заданием)
+и подменяется одной ссылкой.
+
+ShiftAvailability (shift_store.availability) отвечает на вопрос "на вахте
+ли табельный номер сегодня" одним обращением к словарю: он стоит перед
+каждой командой бота.
+"""
+import logging
+import threading
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import datetime, date, time, timedelta
+from time import time as current_timestamp
+import pandas as pd
+from db_utils import db_transaction
+from roster import roster, ROSTER_TTL
+from users_directory import ROLE_ADMIN, ROLE_MANAGER, ROLE_USER
+
+logger = logging.getLogger(__name__)
+
+STATUS_ON_SHIFT = 'ДА'
+ABSENT_STATUSES = ('НЕТ', 'О', 'Б')
+# Сколько дат держать в кэше ответов "кто на вахте"
+DAY_CACHE_SIZE = 64
+
+ShiftInterval = namedtuple('ShiftInterval', ['employee_name', 'start_date', 'end_date', 'status'])
+
+
+def to_day(value=None):
+    """Дата из date, datetime или строки дд.мм.гггг / ГГГГ-ММ-ДД; по умолчанию сегодня"""
+    if value is None:
+        return datetime.now().date()
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    value = str(value).strip()
+    return datetime.strptime(value, '%Y-%m-%d' if '-' in value else '%d.%m.%Y').date()
+
+
+def build_intervals(shifts):
+    """Строки (date, employee_name, status) с датами дд.мм.гггг в интервалы
+
+    Возвращает DataFrame с колонками ShiftInterval. Соседние дни с одинаковым
+    статусом объединяются, пропуск дня начинает новый интервал.
+    """
+    if shifts.empty:
+        return pd.DataFrame(columns=list(ShiftInterval._fields))
+
+    df = pd.DataFrame({
+        'employee_name': shifts['employee_name'].to_numpy(),
+        'day': pd.to_datetime(shifts['date'], format='%d.%m.%Y').to_numpy(),
+        'status': shifts['status'].to_numpy()
+    }).sort_values(['employee_name', 'day'], kind='stable')
+
+    new_run = (
+        (df['employee_name'] != df['employee_name'].shift())
+        | (df['status'] != df['status'].shift())
+        | (df['day'].diff() != pd.Timedelta(days=1))
+    )
+    intervals = df.groupby(new_run.cumsum().to_numpy()).agg(
+        employee_name=('employee_name', 'first'),
+        start_date=('day', 'first'),
+        end_date=('day', 'last'),
+        status=('status', 'first')
+    )
+    intervals['start_date'] = intervals['start_date'].dt.strftime('%Y-%m-%d')
+    intervals['end_date'] = intervals['end_date'].dt.strftime('%Y-%m-%d')
+    return intervals.reset_index(drop=True)[list(ShiftInterval._fields)]
+
+
+class _Snapshot:
+    __slots__ = ('by_name', 'by_day', 'overrides')
+
+    def __init__(self, intervals, overrides=None):
+        # {сотрудник: (начала, концы, статусы)}, интервалы отсортированы по началу
+        self.by_name = {}
+        for interval in sorted(intervals, key=lambda item: (item.employee_name, item.start_date)):
+            starts, ends, statuses = self.by_name.setdefault(interval.employee_name, ([], [], []))
+            starts.append(interval.start_date)
+            ends.append(interval.end_date)
+            statuses.append(interval.status)
+        # {дата: {сотрудник: статус}} для уже запрошенных дат
+        self.by_day = {}
+        # {дата: {сотрудник: статус}} поверх интервалов, в БД не записываются
+        self.overrides = overrides or {}
+
+    def status(self, name, day):
+        override = self.overrides.get(day)
+        if override and name in override:
+            return override[name]
+        found = self.by_name.get(name)
+        if found is None:
+            return None
+        starts, ends, statuses = found
+        position = bisect_right(starts, day) - 1
+        if position >= 0 and ends[position] >= day:
+            return statuses[position]
+        return None
+
+    def statuses_on(self, day):
+        statuses = self.by_day.get(day)
+        if statuses is None:
+            statuses = {}
+            for name in self.by_name:
+                status = self.status(name, day)
+                if status is not None:
+                    statuses[name] = status
+            statuses.update(self.overrides.get(day, {}))
+            if len(self.by_day) >= DAY_CACHE_SIZE:
+                self.by_day.clear()
+            self.by_day[day] = statuses
+        return statuses
+
+
+class ShiftAvailability:
+    """Статусы вахты по табельному номеру на сегодня
+
+    Словарь {табельный номер: статус} строится из интервалов и состава
+    сотрудников и подменяется вместе со сроком действия одной ссылкой,
+    поэтому чтение не берет блокировок. Словарь сбрасывается при
+    перезагрузке табеля, истекает в полночь и через ROSTER_TTL секунд
+    (изменения состава). Другие даты и табельные номера вне словаря
+    проверяются через интервалы напрямую.
+    """
+
+    def __init__(self, store):
+        self._store = store
+        self._lock = threading.Lock()
+        # (срок действия, {табельный номер: статус})
+        self._snapshot = (0, {})
+
+    def invalidate(self):
+        self._snapshot = (0, self._snapshot[1])
+
+    def refresh(self):
+        """Построение словаря на сегодня; возвращает число сотрудников в нем"""
+        with self._lock:
+            now = datetime.now()
+            statuses = self._store.statuses_on(now.date())
+            by_tab = {}
+            for role in (ROLE_ADMIN, ROLE_MANAGER, ROLE_USER):
+                for person in roster.members(role):
+                    status = statuses.get(person.name)
+                    if status is not None:
+                        by_tab[person.tab_number] = status
+            midnight = datetime.combine(now.date() + timedelta(days=1), time())
+            expires = min(midnight.timestamp(), now.timestamp() + ROSTER_TTL)
+            self._snapshot = (expires, by_tab)
+            return len(by_tab)
+
+    def status(self, tab_number, day=None):
+        """Статус табельного номера на дату (по умолчанию сегодня) или None"""
+        if day is None:
+            expires, by_tab = self._snapshot
+            if current_timestamp() >= expires:
+                self.refresh()
+                expires, by_tab = self._snapshot
+            status = by_tab.get(tab_number)
+            if status is not None:
+                return status
+        # Дата не сегодняшняя или сотрудника еще нет в словаре (только что вошел)
+        person = roster.get(tab_number)
+        return None if person is None else self._store.status(person.name, day)
+
+    def is_on_shift(self, tab_number, day=None):
+        return self.status(tab_number, day) == STATUS_ON_SHIFT
+
+
+class ShiftStore:
+    """Интервалы вахт из таблицы shift_intervals с поиском по дате"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        # {дата ГГГГ-ММ-ДД: {сотрудник: статус}}: статусы, перенесенные на сегодня при загрузке табеля
+        self._overrides = {}
+        self.availability = ShiftAvailability(self)
+
+    def refresh(self, overrides=None):
+        """Перечитывание интервалов из БД; возвращает их количество
+
+        overrides, если передан, заменяет статусы, которые держатся только
+        в памяти поверх интервалов.
+        """
+        if overrides is not None:
+            self._overrides = overrides
+        try:
+            with db_transaction() as cursor:
+                cursor.execute('SELECT employee_name, start_date, end_date, status FROM shift_intervals')
+                intervals = [ShiftInterval(*row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Ошибка загрузки интервалов вахт: {e}")
+            return None
+        self._snapshot = _Snapshot(intervals, self._overrides)
+        self.availability.invalidate()
+        logger.info(f"Интервалы вахт загружены: {len(intervals)} записей, {len(self._snapshot.by_name)} сотрудников")
+        return len(intervals)
+
+    def _current(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self.refresh()
+                snapshot = self._snapshot or _Snapshot(())
+        return snapshot
+
+    def status(self, employee_name, day=None):
+        """Статус сотрудника в табеле на дату или None, если дня нет в табеле"""
+        return self._current().status(employee_name, to_day(day).isoformat())
+
+    def statuses_on(self, day=None):
+        """Словарь {сотрудник: статус} на дату (не изменять)"""
+        return self._current().statuses_on(to_day(day).isoformat())
+
+    def employees_with_status(self, statuses, day=None):
+        """Пары (сотрудник, статус) на дату для статусов из списка"""
+        return [(name, status) for name, status in self.statuses_on(day).items() if status in statuses]
+
+    def on_shift(self, day=None):
+        """ФИО сотрудников на вахте на дату"""
+        return [name for name, _ in self.employees_with_status((STATUS_ON_SHIFT,), day)]
+
+    def is_on_shift(self, tab_number, when=None):
+        """Находится ли сотрудник с табельным номером на вахте в момент when"""
+        return self.availability.is_on_shift(tab_number, when)
+
+    def users_on_shift(self, day=None):
+        """Пользователи бота (роль 'Пользователь'), которые на вахте на дату"""
+        names = set(self.on_shift(day))
+        return [person for person in roster.members(ROLE_USER) if person.name in names]
+
+
+shift_store = ShiftStore()
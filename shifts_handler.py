@@ -1,8 +1,10 @@
 import pandas as pd
-from datetime import datetime, timedelta
-import sqlite3
+from datetime import datetime, date, timedelta
 import logging
 import os
+from shift_store import shift_store, build_intervals, ABSENT_STATUSES, STATUS_ON_SHIFT
+from template_service import DATA_DIR
+from db_utils import db_transaction
 
 # Настройка логирования
 logging.basicConfig(
@@ -11,24 +13,138 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+TABEL_FILE = os.getenv('TABEL_FILE', os.path.join(DATA_DIR, 'tabels.xlsx'))
+DATE_FORMAT = '%d.%m.%Y'
+
+
+def parse_date_headers(columns):
+    """Даты заголовков табеля в формате дд.мм.гггг (None для прочих колонок)"""
+    headers = pd.Series(list(columns), dtype=object)
+    is_date = headers.map(lambda col: isinstance(col, (datetime, pd.Timestamp))).astype(bool)
+    parsed = pd.Series(pd.NaT, index=headers.index, dtype='datetime64[ns]')
+    if is_date.any():
+        parsed[is_date] = pd.to_datetime(headers[is_date])
+
+    text = headers[~is_date].astype(str).str.strip()
+    parsed[~is_date] = pd.to_datetime(text, format=DATE_FORMAT, errors='coerce')
+    # Прочие написания дат разбираются только для заголовков, не подошедших под основной формат
+    rest = parsed.isna() & ~is_date & (headers != 'ФИО')
+    if rest.any():
+        parsed[rest] = pd.to_datetime(text[rest], format='ISO8601', errors='coerce')
+    rest = parsed.isna() & ~is_date & (headers != 'ФИО')
+    if rest.any():
+        parsed[rest] = pd.to_datetime(text[rest], dayfirst=True, errors='coerce', format='mixed')
+    return [None if pd.isna(value) else value.strftime(DATE_FORMAT) for value in parsed]
+
+
+def tabel_to_long(df):
+    """Широкий табель в строки (date, employee_name, status) только по датам из файла"""
+    dates = parse_date_headers(df.columns)
+    date_columns = {col: date for col, date in zip(df.columns, dates) if date is not None}
+    wide = df[['ФИО'] + list(date_columns)]
+    wide.columns = ['employee_name'] + list(date_columns.values())
+    wide = wide[wide['employee_name'].notna()]
+
+    shifts = wide.melt(id_vars='employee_name', var_name='date', value_name='status')
+    shifts = shifts[shifts['status'].notna()]
+    shifts['status'] = shifts['status'].astype(str).str.strip().str.upper()
+    shifts = shifts.drop_duplicates(['date', 'employee_name'], keep='last')
+    return shifts[['date', 'employee_name', 'status']]
+
+
+def carried_statuses(shifts, names, current_date):
+    """Статусы на сегодня, если текущей даты в табеле нет: {сотрудник: статус}
+
+    Берутся статусы последней предыдущей даты, а при ее отсутствии - 'НЕТ'.
+    Результат не записывается в БД, а держится в shift_store до следующей
+    загрузки табеля. Если текущая дата в табеле есть, словарь пуст.
+    """
+    if (shifts['date'] == current_date).any():
+        return {}
+    today = datetime.strptime(current_date, DATE_FORMAT)
+    previous = [d for d in (datetime.strptime(day, DATE_FORMAT) for day in set(shifts['date'])) if d < today]
+    if previous:
+        last_date = max(previous).strftime(DATE_FORMAT)
+        last = shifts[shifts['date'] == last_date]
+        logger.info(f"Даты {current_date} нет в табеле, статусы перенесены с {last_date}")
+        return dict(zip(last['employee_name'], last['status']))
+    logger.info(f"Даты {current_date} нет в табеле, все сотрудники отмечены 'НЕТ'")
+    return {name: 'НЕТ' for name in names}
+
+
+def interval_rows(intervals):
+    """Интервалы build_intervals в словарь {(сотрудник, начало): (конец, статус)}"""
+    return {
+        (name, start): (end, status)
+        for name, start, end, status in intervals.itertuples(index=False, name=None)
+    }
+
+
+def current_intervals(cursor):
+    """Интервалы из shift_intervals: {(сотрудник, начало): (конец, статус)}"""
+    cursor.execute('SELECT employee_name, start_date, end_date, status FROM shift_intervals')
+    return {(row[0], row[1]): (row[2], row[3]) for row in cursor.fetchall()}
+
+
+def apply_interval_changes(cursor, changed, deleted):
+    """Запись изменений shift_intervals: changed - {(сотрудник, начало): (конец, статус)}"""
+    cursor.executemany('''
+        DELETE FROM shift_intervals WHERE employee_name = ? AND start_date = ?
+    ''', list(deleted))
+    cursor.executemany('''
+        INSERT INTO shift_intervals (employee_name, start_date, end_date, status)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(employee_name, start_date) DO UPDATE SET
+            end_date = excluded.end_date, status = excluded.status
+    ''', [(*key, *values) for key, values in changed.items()])
+
+
+def plan_interval_changes(current, rows, first_day, last_day):
+    """Изменения shift_intervals для табеля за дни first_day..last_day
+
+    Табель заменяет только свой период: интервалы за его пределами
+    остаются, а интервалы, пересекающие границу, обрезаются до нее.
+    Возвращает (changed, deleted) для apply_interval_changes.
+    """
+    before = (date.fromisoformat(first_day) - timedelta(days=1)).isoformat()
+    after = (date.fromisoformat(last_day) + timedelta(days=1)).isoformat()
+    target = {}
+    for (name, start), (end, status) in current.items():
+        if end < first_day or start > last_day:
+            target[(name, start)] = (end, status)
+            continue
+        if start < first_day:
+            target[(name, start)] = (before, status)
+        if end > last_day:
+            target[(name, after)] = (end, status)
+    target.update(rows)
+    changed = {key: values for key, values in target.items() if current.get(key) != values}
+    deleted = [key for key in current if key not in target]
+    return changed, deleted
+
+
+def write_intervals(rows):
+    """Запись интервалов табеля {(сотрудник, начало): (конец, статус)} одной транзакцией
+
+    Единственный способ записи табеля в БД (загрузка файла и импорт 1С).
+    Табель заменяет период от первого до последнего своего дня: сравнение
+    идет с текущим содержимым таблицы, записываются только отличия, история
+    за другие даты не затрагивается. Внутри открытой транзакции выполняется
+    как ее часть. Возвращает изменившиеся строки и удаленные ключи.
+    """
+    if not rows:
+        return {}, []
+    first_day = min(start for _, start in rows)
+    last_day = max(end for end, _ in rows.values())
+    with db_transaction(immediate=True) as cursor:
+        changed, deleted = plan_interval_changes(current_intervals(cursor), rows, first_day, last_day)
+        if changed or deleted:
+            apply_interval_changes(cursor, changed, deleted)
+    return changed, deleted
+
+
 class ShiftsHandler:
-    def __init__(self):
-        self.conn = sqlite3.connect('Users_bot.db', check_same_thread=False)
-        self.cursor = self.conn.cursor()
-        self.setup_database()
-
-    def setup_database(self):
-        """Создание необходимых таблиц в базе данных"""
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS daily_shifts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                date TEXT,
-                employee_name TEXT,
-                status TEXT,
-                UNIQUE(date, employee_name)
-            )
-        ''')
-        self.conn.commit()
+    """Загрузка табеля и статусы вахт; таблица shift_intervals создается в main.init_database"""
 
     def check_admin_status(self, admin_name):
         try:
@@ -36,20 +152,11 @@ class ShiftsHandler:
                 logger.error("Передано пустое имя администратора")
                 return None
             
-            current_date = datetime.now().strftime('%d.%m.%Y')
+            status = shift_store.status(admin_name)
+            if status:
+                return status
             
-            # Проверяем в daily_shifts
-            self.cursor.execute('''
-                SELECT status 
-                FROM daily_shifts 
-                WHERE date = ? AND employee_name = ?
-            ''', (current_date, admin_name))
-            
-            result = self.cursor.fetchone()
-            if result:
-                return result[0]
-            
-            # Если нет в daily_shifts, считаем что на вахте (по умолчанию для администраторов)
+            # Если дня нет в табеле, считаем что на вахте (по умолчанию для администраторов)
             return "ДА"
                 
         except Exception as e:
@@ -57,115 +164,62 @@ class ShiftsHandler:
             return None
 
     def load_tabel(self):
-        """Загрузка и обработка данных из табеля"""
+        """Загрузка табеля в shift_intervals
+
+        Лист разворачивается в строки (дата, сотрудник, статус), которые
+        сворачиваются в интервалы и записываются через write_intervals только
+        за даты из файла, после чего перестраивается индекс shift_store.
+        Если текущей даты в табеле нет (или нет самого файла), статусы на
+        сегодня держатся только в памяти shift_store.
+        """
         try:
-            df = pd.read_excel('tabels.xlsx')
-            
-            current_date = datetime.now().strftime('%d.%m.%Y')
-            
-            date_columns = []
-            for col in df.columns:
-                if col != 'ФИО':
-                    try:
-                        date_obj = pd.to_datetime(col, dayfirst=True, errors='coerce')
-                        if pd.notna(date_obj):
-                            date_str = date_obj.strftime('%d.%m.%Y')
-                            df = df.rename(columns={col: date_str})
-                            date_columns.append(date_str)
-                    except Exception as e:
-                        logger.warning(f"Ошибка при обработке даты {col}: {e}")
-                        continue
-            
-            # Если текущей даты нет
-            if current_date not in df.columns:
-                logger.info(f"Добавление новой даты {current_date} в табель")
-                if date_columns:
-                    last_date = sorted(date_columns, 
-                                    key=lambda x: datetime.strptime(x, '%d.%m.%Y'))[-1]
-                    df[current_date] = df[last_date]
-                else:
-                    # Если нет предыдущих дат, заполняем "НЕТ"
-                    df[current_date] = "НЕТ"
-                
-                df.to_excel('tabels.xlsx', index=False)
-                logger.info(f"Табель обновлен с новой датой {current_date}")
-            
-            current_statuses = df[['ФИО', current_date]].copy()
-            current_statuses.columns = ['employee_name', 'status']
-            
-            self.cursor.execute('DELETE FROM daily_shifts WHERE date = ?', (current_date,))
-            
-            for _, row in current_statuses.iterrows():
-                if pd.notna(row['status']):
-                    status = str(row['status']).strip().upper()
-                    self.cursor.execute('''
-                        INSERT INTO daily_shifts (date, employee_name, status)
-                        VALUES (?, ?, ?)
-                    ''', (current_date, row['employee_name'], status))
-            
-            self.conn.commit()
-            
-        except FileNotFoundError:
-            logger.error("Файл tabels.xlsx не найден. Создаем новый файл.")
+            current_date = datetime.now().strftime(DATE_FORMAT)
             try:
-                self.cursor.execute('SELECT name FROM Users_user_bot')
-                employees = [row[0] for row in self.cursor.fetchall()]
-                
-                df = pd.DataFrame({'ФИО': employees})
-                current_date = datetime.now().strftime('%d.%m.%Y')
-                df[current_date] = "НЕТ"  # По умолчанию все "НЕТ"
-                
-                df.to_excel('tabels.xlsx', index=False)
-                logger.info("Создан новый файл tabels.xlsx")
-                
-                # Рекурсия...
-                self.load_tabel()
-                
-            except Exception as e:
-                logger.error(f"Ошибка при создании нового файла табеля: {e}")
+                df = pd.read_excel(TABEL_FILE)
+            except FileNotFoundError:
+                logger.error(f"Файл {TABEL_FILE} не найден, на сегодня все сотрудники отмечены 'НЕТ'")
+                with db_transaction() as cursor:
+                    cursor.execute('SELECT name FROM Users_user_bot')
+                    names = [row[0] for row in cursor.fetchall()]
+                shift_store.refresh(overrides={date.today().isoformat(): {name: 'НЕТ' for name in names}})
+                return
+
+            shifts = tabel_to_long(df)
+            names = df['ФИО'].dropna().drop_duplicates().tolist()
+            carried = carried_statuses(shifts, names, current_date)
+            rows = interval_rows(build_intervals(shifts))
+            changed, deleted = write_intervals(rows)
+            shift_store.refresh(overrides={date.today().isoformat(): carried} if carried else {})
+            logger.info(
+                f"Табель загружен: {shifts['date'].nunique()} дат, {len(shifts)} отметок, "
+                f"{len(rows)} интервалов, записано {len(changed) + len(deleted)}"
+            )
             
         except Exception as e:
             logger.error(f"Ошибка при загрузке табеля: {e}")
-            if 'strptime()' in str(e):
-                logger.error("Ошибка в формате даты. Текущие колонки в табеле:")
-                try:
-                    df = pd.read_excel('tabels.xlsx')
-                    logger.error(f"Колонки: {df.columns.tolist()}")
-                except:
-                    pass
 
     def get_absent_users(self) -> list:
         # Возвращает список отсутствующих в формате [(name, status), ...]
         try:
-            current_date = datetime.now().strftime('%d.%m.%Y')
-            self.cursor.execute('''
-                SELECT employee_name, status FROM daily_shifts
-                WHERE date = ? AND status IN ("НЕТ", "О", "Б")
-            ''', (current_date,))
-            return self.cursor.fetchall()
+            return shift_store.employees_with_status(ABSENT_STATUSES)
         except Exception as e:
             logger.error(f"Ошибка получения отсутствующих: {e}")
             return []
 
     def check_employee_status(self, employee_name: str) -> str:
-        return "ДА"
+        # Статус на сегодня из табеля; None, если сотрудника на эту дату в табеле нет
+        return shift_store.status(employee_name)
 
     def is_user_available(self, employee_name):
-        return True
+        return self.check_employee_status(employee_name) == STATUS_ON_SHIFT
 
     def get_active_users(self):
         """Получение списка активных пользователей на текущий день"""
         try:
-            current_date = datetime.now().strftime('%d.%m.%Y')
-            
-            self.cursor.execute('''
-                SELECT u.tab_number, u.name, u.location, u.division, u.t_number
-                FROM Users_user_bot u
-                JOIN daily_shifts ds ON u.name = ds.employee_name
-                WHERE ds.date = ? AND ds.status = "ДА"
-            ''', (current_date,))
-            
-            return self.cursor.fetchall()
+            return [
+                (person.tab_number, person.name, person.location, person.division, person.chat_id)
+                for person in shift_store.users_on_shift()
+            ]
             
         except Exception as e:
             logger.error(f"Ошибка при получении активных пользователей: {e}")
@@ -174,12 +228,7 @@ class ShiftsHandler:
     def get_users_on_shift(self):
         """Получение списка пользователей на смене"""
         try:
-            self.cursor.execute('''
-                SELECT tab_number, name
-                FROM shifts 
-                WHERE is_on_shift = 'ДА'
-            ''')
-            return self.cursor.fetchall()
+            return [(person.tab_number, person.name) for person in shift_store.users_on_shift()]
         except Exception as e:
             logger.error(f"Ошибка получения списка пользователей на смене: {e}")
             return []
@@ -187,18 +236,12 @@ class ShiftsHandler:
     def get_users_info(self):
         """Получение информации о пользователях"""
         try:
-            self.cursor.execute('''
-                SELECT u.tab_number, u.name, u.location, u.division
-                FROM Users_user_bot u
-            ''')
-            return self.cursor.fetchall()
+            with db_transaction() as cursor:
+                cursor.execute('''
+                    SELECT u.tab_number, u.name, u.location, u.division
+                    FROM Users_user_bot u
+                ''')
+                return cursor.fetchall()
         except Exception as e:
             logger.error(f"Ошибка получения информации о пользователях: {e}")
-            return []
-
-    def __del__(self):
-        """Закрытие соединения с базой данных"""
-        try:
-            self.conn.close()
-        except:
-            pass 
\ No newline at end of file
+            return [] 
\ No newline at end of file
@@ -0,0 +1,220 @@
+"""Кэш готовых шаблонов Excel для подачи показаний
+
+Шаблон подразделения собирается один раз на версию справочника (время
+изменения и размер файла) и затем отдается всем запросившим. При
+отправке через очередь ключ кэша file_id строится по той же версии, так
+что Telegram получает файл один раз, а остальные получатели - по file_id.
+
+Справочник оборудования (equipment_templates) читается из таблицы
+equipment, которую заполняет импорт выгрузок 1С (import_1c), в том числе
+из Equipment.xlsx; шаблоны последних показаний - из файла.
+"""
+import os
+import logging
+import threading
+from collections import OrderedDict
+import pandas as pd
+from report_writer import frame_to_excel
+from outbound_queue import send_document, PRIORITY_NOTIFY
+from db_utils import db_transaction
+
+logger = logging.getLogger(__name__)
+
+# Каталог выгрузок 1С; отдельные файлы можно переопределить своими переменными
+DATA_DIR = os.getenv('DATA_DIR', '')
+EQUIPMENT_FILE = os.getenv('EQUIPMENT_FILE', os.path.join(DATA_DIR, 'Equipment.xlsx'))
+LAST_READINGS_FILE = os.getenv('LAST_READINGS_FILE', os.path.join(DATA_DIR, 'last_readings.xlsx'))
+TEMPLATE_CACHE_SIZE = int(os.getenv('TEMPLATE_CACHE_SIZE', 128))
+
+TEMPLATE_COLUMNS = ['№ п/п', 'Гос. номер', 'Инв. №', 'Счётчик', 'Показания', 'Комментарий']
+# Колонки, без которых новый файл справочника не принимается
+EQUIPMENT_REQUIRED_COLUMNS = ['Локация', 'Подразделение', 'Гос. номер', 'Инв. №', 'Счётчик']
+TEMPLATE_SHEET = 'Показания'
+
+
+def file_version(path):
+    """Версия файла справочника: время изменения и размер"""
+    try:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+
+def build_template_frame(equipment, readings_column=None):
+    """Сборка таблицы шаблона из строк справочника целыми столбцами"""
+    readings = ''
+    if readings_column and readings_column in equipment.columns:
+        readings = equipment[readings_column].to_numpy()
+    return pd.DataFrame({
+        '№ п/п': range(1, len(equipment) + 1),
+        'Гос. номер': equipment['Гос. номер'].to_numpy(),
+        'Инв. №': equipment['Инв. №'].to_numpy(),
+        'Счётчик': equipment['Счётчик'].to_numpy(),
+        'Показания': readings,
+        'Комментарий': ''
+    }, columns=TEMPLATE_COLUMNS)
+
+
+class TemplateService:
+    """Шаблоны по (локация, подразделение) для одного файла-справочника"""
+
+    def __init__(self, source_file, readings_column=None, max_size=TEMPLATE_CACHE_SIZE):
+        self.source_file = source_file
+        self.readings_column = readings_column
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._version = None
+        self._groups = {}
+        self._templates = OrderedDict()
+        # Если файл отслеживает reference_watcher, обращения не проверяют его версию
+        self.watched = False
+
+    def _refresh(self):
+        """Перечитывание справочника, если файл изменился (под блокировкой)
+
+        Новый файл принимается только целиком: при ошибке чтения или
+        отсутствии нужных колонок остается прежний справочник.
+        """
+        if self.watched and self._version is not None:
+            return self._version
+        version = self._source_version()
+        if version is None:
+            if self._version is None:
+                logger.warning(f"Справочник {self.source_file} не найден")
+            return self._version
+        if version == self._version:
+            return version
+        try:
+            df = self._read_source()
+            missing = [col for col in EQUIPMENT_REQUIRED_COLUMNS if col not in df.columns]
+            if missing:
+                raise ValueError(f"нет колонок {', '.join(missing)}")
+            groups = {key: frame for key, frame in df.groupby(['Локация', 'Подразделение'], sort=False)}
+        except Exception as e:
+            logger.error(f"Ошибка загрузки справочника {self.source_file}, используется прежняя версия: {e}")
+            return self._version
+        logger.info(f"Справочник {self.source_file} загружен: {len(df)} строк, {len(groups)} подразделений")
+        self._version = version
+        self._groups = groups
+        self._templates.clear()
+        return version
+
+    def _source_version(self):
+        return file_version(self.source_file)
+
+    def _read_source(self):
+        df = pd.read_excel(self.source_file)
+        df.columns = [str(col).strip() for col in df.columns]
+        return df
+
+    def reload(self, path=None):
+        """Проверка файла и подмена справочника (вызывается наблюдателем за файлами)"""
+        with self._lock:
+            watched, self.watched = self.watched, False
+            try:
+                return self._refresh()
+            finally:
+                self.watched = watched
+
+    def get_equipment(self, location, division):
+        """Строки справочника для подразделения (пустой DataFrame, если их нет)"""
+        with self._lock:
+            self._refresh()
+            frame = self._groups.get((location, division))
+        return frame.copy() if frame is not None else pd.DataFrame()
+
+    def locations(self):
+        """Локации, для которых в справочнике есть оборудование"""
+        with self._lock:
+            self._refresh()
+            return {location for location, _ in self._groups}
+
+    def get_template(self, location, division):
+        """Байты шаблона и версия справочника; (None, None), если оборудования нет"""
+        key = (location, division)
+        with self._lock:
+            version = self._refresh()
+            content = self._templates.get(key)
+            if content is not None:
+                self._templates.move_to_end(key)
+                return content, version
+
+            equipment = self._groups.get(key)
+            if equipment is None or equipment.empty:
+                return None, None
+            output = frame_to_excel(build_template_frame(equipment, self.readings_column), sheet_name=TEMPLATE_SHEET)
+            content = output.read()
+            output.close()
+
+            self._templates[key] = content
+            while len(self._templates) > self.max_size:
+                self._templates.popitem(last=False)
+            logger.info(f"Шаблон для {location}, {division} сформирован ({len(equipment)} строк)")
+            return content, version
+
+    def send_template(self, bot, chat_id, location, division, filename=None,
+                      priority=PRIORITY_NOTIFY, **kwargs):
+        """Отправка шаблона через очередь; False, если оборудования нет"""
+        content, version = self.get_template(location, division)
+        if content is None:
+            return False
+        filename = filename or f'Показания_{location}_{division}.xlsx'
+        send_document(
+            bot,
+            chat_id=chat_id,
+            document=content,
+            priority=priority,
+            filename=filename,
+            # file_id хранит имя файла первой загрузки, поэтому оно входит в ключ
+            cache_key=f'template:{self.source_file}:{location}:{division}:{version[0]}:{version[1]}:{filename}',
+            **kwargs
+        )
+        return True
+
+
+def _cell_value(value):
+    """Значение ячейки так, как его вернул бы read_excel: целые числа - числами"""
+    if value == '':
+        return None
+    if isinstance(value, str) and value.isdigit() and (value == '0' or not value.startswith('0')):
+        return int(value)
+    return value
+
+
+class EquipmentTableService(TemplateService):
+    """Шаблоны по таблице equipment (оборудование со статусом 'removed' не входит)
+
+    Версия справочника - число запусков импорта оборудования и номер
+    последнего, поэтому после импорта с изменениями (он вызывает reload)
+    шаблоны собираются заново.
+    """
+
+    def __init__(self, max_size=TEMPLATE_CACHE_SIZE):
+        super().__init__('equipment', max_size=max_size)
+
+    def _source_version(self):
+        try:
+            with db_transaction(immediate=False) as cursor:
+                cursor.execute('''
+                    SELECT COUNT(*), COALESCE(MAX(id), 0) FROM import_journal
+                    WHERE source = 'equipment' AND status = 'success'
+                ''')
+                return tuple(cursor.fetchone())
+        except Exception as e:
+            logger.error(f"Ошибка чтения версии справочника оборудования: {e}")
+            return None
+
+    def _read_source(self):
+        with db_transaction(immediate=False) as cursor:
+            cursor.execute('''
+                SELECT location, division, gov_number, inventory_number, meter_type, status
+                FROM equipment WHERE status != 'removed'
+                ORDER BY rowid
+            ''')
+            rows = [tuple(_cell_value(value) for value in row[:5]) + row[5:] for row in cursor.fetchall()]
+        return pd.DataFrame(rows, columns=EQUIPMENT_REQUIRED_COLUMNS + ['Состояние'])
+
+
+equipment_templates = EquipmentTableService()
+readings_templates = TemplateService(LAST_READINGS_FILE, readings_column='Последние показания')
@@ -1,16 +1,33 @@
 # time_utils.py
+import os
+import json
 import pytz
-from datetime import datetime, time
+from datetime import datetime, time, timedelta
+from time import time as current_timestamp
+from collections import namedtuple
 import logging
+import threading
+from template_service import file_version, equipment_templates
+from users_directory import users_directory
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_TIMEZONE = 'Europe/Moscow'
+MOSCOW_TZ = pytz.timezone(DEFAULT_TIMEZONE)
+
+# Файл уточнений {"локация или префикс": "часовой пояс"} для неоднозначных названий
+TIMEZONE_OVERRIDES_FILE = os.getenv('TIMEZONE_OVERRIDES_FILE', 'timezone_overrides.json')
+
+# Срок подачи показаний: день недели (0 - понедельник) и час по Москве
+REPORT_DEADLINE_WEEKDAY = int(os.getenv('REPORT_DEADLINE_WEEKDAY', 2))
+REPORT_DEADLINE_HOUR = int(os.getenv('REPORT_DEADLINE_HOUR', 14))
+
 # Часовые пояса России
 RUSSIAN_TIMEZONES = {
     # Центральный федеральный округ (UTC+3)
     'Белго': 'Europe/Moscow',
     'Брянс': 'Europe/Moscow',
-    'Влади': 'Europe/Moscow',
+    'Влади': 'Europe/Moscow',  # Владимирская; совпадает с Владивостоком, см. AMBIGUOUS_PREFIXES
     'Ворон': 'Europe/Moscow',
     'Ивано': 'Europe/Moscow',
     'Калуж': 'Europe/Moscow',
@@ -32,7 +49,7 @@ RUSSIAN_TIMEZONES = {
     'Калин': 'Europe/Kaliningrad',  # UTC+2
     'Карел': 'Europe/Moscow',
     'Коми': 'Europe/Moscow',
-    'Ленин': 'Europe/Moscow',
+    'Ленин': 'Europe/Moscow',  # Ленинградская; совпадает с Ленинском-Кузнецким
     'Мурма': 'Europe/Moscow',
     'Ненец': 'Europe/Moscow',
     'Новго': 'Europe/Moscow',
@@ -48,10 +65,10 @@ RUSSIAN_TIMEZONES = {
     'Кабар': 'Europe/Moscow',
     'Калмы': 'Europe/Moscow',
     'Карач': 'Europe/Moscow',
-    'Красн': 'Europe/Moscow',  # Краснодарский край
+    # 'Красн' (Краснодарский край) совпадает с Красноярским краем, см. AMBIGUOUS_PREFIXES
     'Крым': 'Europe/Moscow',
     'Росто': 'Europe/Moscow',
-    'Север': 'Europe/Moscow',
+    'Север': 'Europe/Moscow',  # Северная Осетия; совпадает с Североуральском, Северобайкальском
     'Ставр': 'Europe/Moscow',
     'Чечня': 'Europe/Moscow',
     
@@ -85,7 +102,7 @@ RUSSIAN_TIMEZONES = {
     'Забай': 'Asia/Yakutsk',  # UTC+9
     'Иркут': 'Asia/Irkutsk',  # UTC+8
     'Кемер': 'Asia/Krasnoyarsk',  # UTC+7
-    'Красн': 'Asia/Krasnoyarsk',  # UTC+7 - Красноярский край
+    'Красн': 'Asia/Krasnoyarsk',  # UTC+7 - Красноярский край, если название не уточняет
     'Новос': 'Asia/Krasnoyarsk',  # UTC+7
     'Омска': 'Asia/Omsk',  # UTC+6
     'Томск': 'Asia/Krasnoyarsk',  # UTC+7
@@ -102,4 +119,173 @@ RUSSIAN_TIMEZONES = {
     'Сахал': 'Asia/Magadan',  # UTC+11
     'Хабар': 'Asia/Vladivostok',  # UTC+10
     'Чукот': 'Asia/Kamchatka'  # UTC+12
-}
\ No newline at end of file
+}
+
+# Префиксы, общие для регионов в разных часовых поясах: решаются по полному названию
+AMBIGUOUS_PREFIXES = {'Красн', 'Влади', 'Ленин', 'Север'}
+
+# Характерные части названий, если префикс не найден или неоднозначен
+TIMEZONE_KEYWORDS = (
+    (('краснодар',), 'Europe/Moscow'),
+    (('красноярск',), 'Asia/Krasnoyarsk'),
+    (('владимир', 'ленинград', 'осети', 'северодвин', 'североморск'), 'Europe/Moscow'),
+    (('кузнецк',), 'Asia/Krasnoyarsk'),
+    (('североурал',), 'Asia/Yekaterinburg'),
+    (('северобайкал',), 'Asia/Irkutsk'),
+    (('москв',), 'Europe/Moscow'),
+    (('калин',), 'Europe/Kaliningrad'),
+    (('самар', 'саратов'), 'Europe/Samara'),
+    (('екатер', 'свердл'), 'Asia/Yekaterinburg'),
+    (('омск',), 'Asia/Omsk'),
+    (('иркут', 'бурят'), 'Asia/Irkutsk'),
+    (('якут', 'саха'), 'Asia/Yakutsk'),
+    (('владив', 'примор'), 'Asia/Vladivostok'),
+    (('магад', 'сахал'), 'Asia/Magadan'),
+    (('камчат', 'чукот'), 'Asia/Kamchatka'),
+)
+
+LocationTime = namedtuple('LocationTime', ['timezone_name', 'tz', 'utc_offset', 'deadline', 'deadline_text'])
+
+
+def resolve_timezone_name(location, overrides=None):
+    """Часовой пояс локации: уточнения, префикс из RUSSIAN_TIMEZONES, части названия"""
+    location = str(location or '').strip()
+    overrides = overrides or {}
+    if location in overrides:
+        return overrides[location]
+
+    prefixes = [location[:size].capitalize() for size in (5, 4)]
+    for prefix in prefixes:
+        if prefix in overrides:
+            return overrides[prefix]
+    for prefix in prefixes:
+        if prefix in RUSSIAN_TIMEZONES and prefix not in AMBIGUOUS_PREFIXES:
+            return RUSSIAN_TIMEZONES[prefix]
+
+    location_lower = location.lower()
+    for keywords, timezone_name in TIMEZONE_KEYWORDS:
+        if any(keyword in location_lower for keyword in keywords):
+            return timezone_name
+
+    for prefix in prefixes:
+        if prefix in RUSSIAN_TIMEZONES:
+            logger.warning(f"Часовой пояс локации {location} определен по неоднозначному префиксу {prefix}")
+            return RUSSIAN_TIMEZONES[prefix]
+    return DEFAULT_TIMEZONE
+
+
+def reporting_deadline(now=None):
+    """Срок подачи показаний текущей недели (aware datetime по Москве)"""
+    today = (now or datetime.now(MOSCOW_TZ)).astimezone(MOSCOW_TZ).date()
+    deadline_date = today - timedelta(days=today.weekday()) + timedelta(days=REPORT_DEADLINE_WEEKDAY)
+    return MOSCOW_TZ.localize(datetime.combine(deadline_date, time(hour=REPORT_DEADLINE_HOUR)))
+
+
+class LocationRegistry:
+    """Часовые пояса локаций с заранее рассчитанным сроком подачи
+
+    Каждая локация разрешается один раз; объект pytz, смещение от UTC и
+    местное время срока текущей недели хранятся в словаре, поэтому
+    форматирование времени в рассылках не разбирает название заново.
+    Записи пересчитываются при смене недели и изменении файла уточнений.
+    """
+
+    def __init__(self, overrides_file=TIMEZONE_OVERRIDES_FILE):
+        self.overrides_file = overrides_file
+        self._lock = threading.Lock()
+        self._overrides = {}
+        self._overrides_version = None
+        self._deadline = None
+        self._week_end = None
+        self._week_end_ts = 0
+        self._locations = {}
+
+    def _load_overrides(self):
+        version = file_version(self.overrides_file)
+        if version == self._overrides_version:
+            return False
+        overrides = {}
+        if version is not None:
+            try:
+                with open(self.overrides_file, encoding='utf-8') as f:
+                    for name, timezone_name in json.load(f).items():
+                        try:
+                            pytz.timezone(timezone_name)
+                        except pytz.UnknownTimeZoneError:
+                            logger.error(f"Неизвестный часовой пояс {timezone_name} для {name} в {self.overrides_file}")
+                            continue
+                        overrides[str(name).strip()] = timezone_name
+                logger.info(f"Уточнения часовых поясов загружены: {len(overrides)}")
+            except Exception as e:
+                logger.error(f"Ошибка загрузки уточнений часовых поясов {self.overrides_file}: {e}")
+                overrides = self._overrides
+        self._overrides = overrides
+        self._overrides_version = version
+        return True
+
+    def _build(self, location):
+        timezone_name = resolve_timezone_name(location, self._overrides)
+        tz = pytz.timezone(timezone_name)
+        deadline = self._deadline.astimezone(tz)
+        return LocationTime(timezone_name, tz, deadline.utcoffset(), deadline, deadline.strftime('%H:%M (%Z)'))
+
+    def _check_week(self):
+        now = datetime.now(MOSCOW_TZ)
+        if self._week_end is None or now >= self._week_end:
+            self._deadline = reporting_deadline(now)
+            monday = self._deadline.date() - timedelta(days=self._deadline.weekday())
+            self._week_end = MOSCOW_TZ.localize(datetime.combine(monday + timedelta(days=7), time()))
+            self._week_end_ts = self._week_end.timestamp()
+            self._locations = {}
+
+    def refresh(self, locations=None):
+        """Пересчет записей для локаций справочников сотрудников и оборудования"""
+        if locations is None:
+            locations = {entry.location for entry in users_directory.entries()}
+            locations.update(equipment_templates.locations())
+        with self._lock:
+            self._load_overrides()
+            self._check_week()
+            # Уже известные локации пересчитываются вместе с новыми: могли измениться уточнения
+            locations = set(locations) | set(self._locations)
+            built = {location: self._build(location) for location in locations if location}
+            self._locations = built
+        logger.info(f"Часовые пояса рассчитаны для {len(built)} локаций")
+        return len(built)
+
+    def get(self, location):
+        """Запись LocationTime локации"""
+        info = self._locations.get(location)
+        if info is not None and current_timestamp() < self._week_end_ts:
+            return info
+        with self._lock:
+            self._check_week()
+            info = self._locations.get(location)
+            if info is None:
+                info = self._build(location)
+                self._locations = {**self._locations, location: info}
+            return info
+
+    def timezone_name(self, location):
+        return self.get(location).timezone_name
+
+    def timezone(self, location):
+        return self.get(location).tz
+
+    def utc_offsets(self):
+        """Смещение от UTC по каждой известной локации"""
+        return {location: info.utc_offset for location, info in self._locations.items()}
+
+    def now(self, location):
+        """Текущее время в локации"""
+        return datetime.now(self.get(location).tz)
+
+    def format_datetime(self, dt, location):
+        return dt.astimezone(self.get(location).tz).strftime('%Y-%m-%d %H:%M:%S (%Z)')
+
+    def deadline_text(self, location):
+        """Срок подачи текущей недели по местному времени, например '16:00 (+05)'"""
+        return self.get(location).deadline_text
+
+
+location_registry = LocationRegistry()
@@ -0,0 +1,112 @@
+"""Синхронизация таблицы сотрудников бота с выгрузкой Users.xlsx
+
+Выгрузка сравнивается с таблицей people по табельному номеру и хэшу полей
+(ФИО, роль, локация, подразделение). В одной транзакции выполняются только
+нужные изменения и удаления, поэтому обработчики никогда не видят пустой
+таблицы.
+
+chat_id задается только при входе пользователя в бота и при синхронизации
+не меняется; смена роли - обычное изменение записи. Новые сотрудники из
+выгрузки без chat_id не добавляются: их запись создается при первом входе
+(add_user_to_db).
+
+Это единственный код, изменяющий people по выгрузке: импорт 1С
+(import_1c) применяет сотрудников через apply_sync в своей транзакции.
+"""
+import logging
+import hashlib
+from db_utils import db_transaction
+from users_directory import users_directory, tab_number_key, ROLE_USER
+from roster import roster, ROLE_TABLES
+
+logger = logging.getLogger(__name__)
+
+
+def _text(value):
+    return '' if value is None else str(value).strip()
+
+
+def row_hash(name, role, location, division):
+    """Хэш полей записи, которые приходят из выгрузки"""
+    data = '\x1f'.join(_text(value) for value in (name, role, location, division))
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def plan_sync(entries, current):
+    """Расчет изменений без обращения к БД
+
+    entries - записи UserEntry из выгрузки; current - {ключ: (табельный
+    номер, ФИО, роль, chat_id, локация, подразделение)} из people.
+    Возвращает {'update', 'delete'} с параметрами запросов и число
+    сотрудников, ожидающих первого входа.
+    """
+    plan = {'update': [], 'delete': []}
+    exported = set()
+    waiting_login = 0
+
+    for entry in entries:
+        key = tab_number_key(entry.tab_number)
+        exported.add(key)
+        row = current.get(key)
+        if row is None:
+            waiting_login += 1
+            continue
+        role = entry.role if entry.role in ROLE_TABLES else ROLE_USER
+        if row_hash(row[1], row[2], row[4], row[5]) != row_hash(entry.name, role, entry.location, entry.division):
+            plan['update'].append((entry.name, role, entry.location, entry.division, row[0]))
+
+    for key, row in current.items():
+        if key not in exported:
+            plan['delete'].append((row[0],))
+
+    return plan, waiting_login
+
+
+def apply_sync(cursor, entries):
+    """Применение выгрузки к people в открытой транзакции; возвращает план и число ожидающих входа"""
+    cursor.execute('SELECT tab_number, name, role, chat_id, location, division FROM people')
+    current = {tab_number_key(row[0]): row for row in cursor.fetchall()}
+
+    plan, waiting_login = plan_sync(entries, current)
+
+    if plan['delete']:
+        cursor.executemany('DELETE FROM people WHERE tab_number = ?', plan['delete'])
+    if plan['update']:
+        cursor.executemany('''
+            UPDATE people SET name = ?, role = ?, location = ?, division = ?
+            WHERE tab_number = ?
+        ''', plan['update'])
+    return plan, waiting_login
+
+
+def sync_users(entries=None):
+    """Применение выгрузки к таблице people; возвращает счетчики изменений"""
+    if entries is None:
+        entries = users_directory.entries()
+    if not entries:
+        # Пустая или нечитаемая выгрузка не должна удалить всех пользователей
+        logger.warning("Выгрузка сотрудников пуста, синхронизация пропущена")
+        return {'status': 'skipped', 'updated': 0, 'deleted': 0, 'waiting_login': 0}
+
+    try:
+        with db_transaction(immediate=True) as cursor:
+            plan, waiting_login = apply_sync(cursor, entries)
+
+        if plan['delete'] or plan['update']:
+            roster.invalidate()
+
+        result = {
+            'status': 'success',
+            'updated': len(plan['update']),
+            'deleted': len(plan['delete']),
+            'waiting_login': waiting_login
+        }
+        logger.info(
+            f"Синхронизация пользователей: изменено {result['updated']}, "
+            f"удалено {result['deleted']}, ожидают входа {result['waiting_login']}"
+        )
+        return result
+
+    except Exception as e:
+        logger.error(f"Ошибка синхронизации пользователей: {e}")
+        return {'status': 'error', 'message': str(e)}
@@ -0,0 +1,138 @@
+"""Справочник сотрудников из Users.xlsx в памяти
+
+Файл читается один раз на версию (время изменения и размер) в словарь по
+табельному номеру с уже вычисленными ролью, локацией и подразделением.
+Новая выгрузка подхватывается при следующем обращении: снимок строится
+целиком и подменяется одной ссылкой, поэтому читатели видят либо старый,
+либо новый справочник. Пока снимок перестраивается, вход выполняется по
+предыдущему.
+"""
+import os
+import logging
+import threading
+from collections import namedtuple
+import pandas as pd
+from template_service import file_version, DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+USERS_FILE = os.getenv('USERS_FILE', os.path.join(DATA_DIR, 'Users.xlsx'))
+
+ROLE_ADMIN = 'Администратор'
+ROLE_MANAGER = 'Руководитель'
+ROLE_USER = 'Пользователь'
+
+UserEntry = namedtuple('UserEntry', ['tab_number', 'name', 'role', 'location', 'division', 'phone'])
+_Snapshot = namedtuple('_Snapshot', ['version', 'users'])
+
+
+def normalize_role(value):
+    """Роль бота по значению колонки 'Роль'"""
+    value = str(value)
+    if ROLE_ADMIN in value:
+        return ROLE_ADMIN
+    if ROLE_MANAGER in value:
+        return ROLE_MANAGER
+    return ROLE_USER
+
+
+def tab_number_key(value):
+    """Табельный номер в виде строки для поиска (123.0 и 123 совпадают)"""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _plain(value, default=''):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return default
+    return value.item() if hasattr(value, 'item') else value
+
+
+def build_users_index(df):
+    """Словарь {табельный номер: UserEntry}; при повторах берется первая строка"""
+    df = df.rename(columns=lambda col: str(col).strip())
+    if 'Табельный номер' not in df.columns:
+        raise ValueError("В файле отсутствует столбец 'Табельный номер'")
+    df = df[df['Табельный номер'].notna()]
+
+    def column(name, default=''):
+        return df[name].tolist() if name in df.columns else [default] * len(df)
+
+    roles = [normalize_role(value) for value in column('Роль', ROLE_USER)]
+    users = {}
+    for tab_number, name, role, location, division, phone in zip(
+            column('Табельный номер'), column('ФИО'), roles,
+            column('Локация'), column('Подразделение'), column('Номер телефона', None)):
+        key = tab_number_key(_plain(tab_number))
+        if key not in users:
+            users[key] = UserEntry(
+                _plain(tab_number), _plain(name), role,
+                _plain(location), _plain(division), _plain(phone, None)
+            )
+    return users
+
+
+class UsersDirectory:
+    """Индекс сотрудников одного файла выгрузки"""
+
+    def __init__(self, source_file=USERS_FILE):
+        self.source_file = source_file
+        self._snapshot = _Snapshot(None, {})
+        self._reload_lock = threading.Lock()
+        # Версия файла, которую не удалось прочитать; повторно ее не разбираем
+        self._failed_version = None
+        # Если файл отслеживает reference_watcher, обращения не проверяют его версию
+        self.watched = False
+
+    def _current(self):
+        snapshot = self._snapshot
+        if self.watched and snapshot.version is not None:
+            return snapshot
+        return self._check()
+
+    def _check(self):
+        snapshot = self._snapshot
+        version = file_version(self.source_file)
+        if version is None or version in (snapshot.version, self._failed_version):
+            return snapshot
+        # Если снимок уже есть, его перестраивает один поток, остальные работают по старому
+        if not self._reload_lock.acquire(blocking=not snapshot.users):
+            return snapshot
+        try:
+            snapshot = self._snapshot
+            if version != snapshot.version:
+                snapshot = self._load(version) or snapshot
+            return snapshot
+        finally:
+            self._reload_lock.release()
+
+    def _load(self, version):
+        try:
+            users = build_users_index(pd.read_excel(self.source_file))
+        except Exception as e:
+            logger.error(f"Ошибка загрузки справочника сотрудников {self.source_file}: {e}")
+            self._failed_version = version
+            return None
+        snapshot = _Snapshot(version, users)
+        self._snapshot = snapshot
+        logger.info(f"Справочник сотрудников {self.source_file} загружен: {len(users)} записей")
+        return snapshot
+
+    def refresh(self, path=None):
+        """Загрузка справочника заранее (при запуске) или после обновления файла"""
+        return len(self._check().users)
+
+    def get(self, tab_number):
+        """Запись сотрудника по табельному номеру или None"""
+        return self._current().users.get(tab_number_key(tab_number))
+
+    def entries(self):
+        """Все записи текущего снимка"""
+        return list(self._current().users.values())
+
+    def __len__(self):
+        return len(self._current().users)
+
+
+users_directory = UsersDirectory()
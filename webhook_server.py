@@ -0,0 +1,232 @@
+"""Запуск бота в режиме webhook или long polling
+
+Режим выбирается переменной BOT_MODE (polling по умолчанию). В режиме
+webhook обновления принимает встроенный HTTP-сервер на секретном пути и
+передает их в очередь диспетчера. При остановке сервер перестает
+принимать запросы, дожидается уже принятых и дает диспетчеру разобрать
+очередь обновлений.
+
+TELEGRAM_API_BASE_URL позволяет направить бота на локальный сервер Bot API
+или на тестовую заглушку Telegram.
+"""
+import os
+import ssl
+import json
+import time
+import signal
+import logging
+import secrets
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+from telegram import Update
+from telegram.ext import Updater
+
+logger = logging.getLogger(__name__)
+
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+# Потоки диспетчера для обработчиков с run_async
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', 4))
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL', '').rstrip('/')
+
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8443))
+# Внешний адрес, по которому Telegram достучится до сервера (без секретного пути)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')
+# Секретная часть пути; если не задана, генерируется при каждом запуске
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 4))
+# Сколько принятых соединений может ждать свободного потока; сверх этого соединение закрывается
+WEBHOOK_BACKLOG = int(os.getenv('WEBHOOK_BACKLOG', 64))
+WEBHOOK_MAX_BODY = int(os.getenv('WEBHOOK_MAX_BODY', 1024 * 1024))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40))
+WEBHOOK_DRAIN_TIMEOUT = int(os.getenv('WEBHOOK_DRAIN_TIMEOUT', 30))
+# Сертификат и ключ, если TLS завершается на самом боте, а не на прокси
+WEBHOOK_CERT = os.getenv('WEBHOOK_CERT', '')
+WEBHOOK_KEY = os.getenv('WEBHOOK_KEY', '')
+
+
+def create_updater(token=None):
+    """Создание Updater с учетом адреса Bot API и числа потоков"""
+    kwargs = {'token': token or os.getenv('BOT_TOKEN'), 'use_context': True, 'workers': BOT_WORKERS}
+    if TELEGRAM_API_BASE_URL:
+        kwargs['base_url'] = f'{TELEGRAM_API_BASE_URL}/bot'
+        kwargs['base_file_url'] = f'{TELEGRAM_API_BASE_URL}/file/bot'
+    return Updater(**kwargs)
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'MetersBot'
+    # Медленные клиенты не должны держать поток бесконечно
+    timeout = 10
+
+    def do_POST(self):
+        server = self.server
+        if self.path.split('?', 1)[0] != server.path:
+            self._reply(404)
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = 0
+        if length <= 0:
+            self._reply(411)
+            return
+        if length > server.max_body:
+            logger.warning(f"Отклонен запрос webhook размером {length} байт")
+            self._reply(413)
+            return
+        try:
+            data = json.loads(self.rfile.read(length).decode('utf-8'))
+            update = Update.de_json(data, server.bot)
+        except Exception as e:
+            logger.warning(f"Некорректное обновление webhook: {e}")
+            self._reply(400)
+            return
+        server.update_queue.put(update)
+        self._reply(200)
+
+    def do_GET(self):
+        self._reply(404)
+
+    def _reply(self, code):
+        self.send_response(code)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logger.debug(f"webhook {self.address_string()}: {format % args}")
+
+
+class WebhookServer(HTTPServer):
+    """HTTP-сервер webhook с ограниченным числом потоков обработки
+
+    Поток serve_forever только принимает соединения: TLS-рукопожатие
+    выполняется в потоке обработки с таймаутом обработчика, поэтому
+    медленный клиент не останавливает прием. Одновременно в работе и в
+    ожидании не больше workers + backlog соединений, лишние закрываются сразу.
+    """
+
+    request_queue_size = WEBHOOK_BACKLOG
+
+    def __init__(self, address, bot, update_queue, path, workers=WEBHOOK_WORKERS,
+                 max_body=WEBHOOK_MAX_BODY, ssl_context=None, backlog=WEBHOOK_BACKLOG):
+        super().__init__(address, WebhookRequestHandler)
+        self.ssl_context = ssl_context
+        self.bot = bot
+        self.update_queue = update_queue
+        self.path = path
+        self.max_body = max_body
+        self._slots = threading.BoundedSemaphore(workers + backlog)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='webhook')
+
+    def process_request(self, request, client_address):
+        if not self._slots.acquire(blocking=False):
+            logger.warning(f"Очередь webhook переполнена, соединение {client_address[0]} закрыто")
+            self.shutdown_request(request)
+            return
+        self._executor.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            request.settimeout(WebhookRequestHandler.timeout)
+            if self.ssl_context is not None:
+                try:
+                    request = self.ssl_context.wrap_socket(
+                        request, server_side=True, do_handshake_on_connect=False
+                    )
+                    request.do_handshake()
+                except OSError as e:
+                    logger.debug(f"TLS-рукопожатие с {client_address[0]} не выполнено: {e}")
+                    return
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        """Закрытие сокета и ожидание уже принятых запросов"""
+        super().server_close()
+        self._executor.shutdown(wait=True)
+
+
+def _wait_for_stop_signal():
+    stop = threading.Event()
+
+    def handler(signum, frame):
+        logger.info(f"Получен сигнал {signum}, остановка бота...")
+        stop.set()
+
+    for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT):
+        signal.signal(sig, handler)
+    while not stop.is_set():
+        stop.wait(1)
+
+
+def _drain_update_queue(update_queue, timeout):
+    deadline = time.monotonic() + timeout
+    while not update_queue.empty() and time.monotonic() < deadline:
+        time.sleep(0.2)
+    if not update_queue.empty():
+        logger.warning(f"Не обработано обновлений при остановке: {update_queue.qsize()}")
+
+
+def run_webhook(updater):
+    """Прием обновлений через webhook до получения сигнала остановки"""
+    if not WEBHOOK_URL:
+        raise ValueError("Для режима webhook необходимо задать WEBHOOK_URL")
+
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    path = f'/{secret}'
+    ssl_context = None
+    if WEBHOOK_CERT and WEBHOOK_KEY:
+        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ssl_context.load_cert_chain(WEBHOOK_CERT, WEBHOOK_KEY)
+
+    dispatcher = updater.dispatcher
+    server = WebhookServer(
+        (WEBHOOK_LISTEN, WEBHOOK_PORT), updater.bot, updater.update_queue, path,
+        ssl_context=ssl_context
+    )
+
+    updater.job_queue.start()
+    dispatcher_ready = threading.Event()
+    dispatcher_thread = threading.Thread(
+        target=dispatcher.start, kwargs={'ready': dispatcher_ready}, name='dispatcher'
+    )
+    dispatcher_thread.start()
+    dispatcher_ready.wait()
+
+    server_thread = threading.Thread(target=server.serve_forever, name='webhook')
+    server_thread.start()
+
+    try:
+        updater.bot.set_webhook(url=f'{WEBHOOK_URL}{path}', max_connections=WEBHOOK_MAX_CONNECTIONS)
+        logger.info(f"Webhook зарегистрирован, сервер слушает {WEBHOOK_LISTEN}:{WEBHOOK_PORT}")
+        _wait_for_stop_signal()
+    finally:
+        # Прекращаем прием, дожидаемся принятых запросов и разбора очереди
+        server.shutdown()
+        server.server_close()
+        server_thread.join()
+        _drain_update_queue(updater.update_queue, WEBHOOK_DRAIN_TIMEOUT)
+        updater.job_queue.stop()
+        dispatcher.stop()
+        dispatcher_thread.join()
+        logger.info("Прием обновлений через webhook остановлен")
+
+
+def run_bot(updater):
+    """Запуск бота в выбранном режиме; возвращает управление после остановки"""
+    if BOT_MODE == 'webhook':
+        run_webhook(updater)
+        return
+
+    if BOT_MODE != 'polling':
+        logger.warning(f"Неизвестный режим BOT_MODE={BOT_MODE}, используется polling")
+    # start_polling сам снимает webhook, оставшийся от предыдущего запуска
+    updater.start_polling()
+    logger.info("Бот успешно запущен и ожидает сообщений")
+    updater.idle()
@@ -0,0 +1,148 @@
+"""Пул исполнителей для тяжелых обработчиков
+
+Разбор Excel, проверка показаний и формирование отчетов выполняются вне
+потоков диспетчера, чтобы быстрые команды не ждали загрузок. Очередь
+ограничена: если она заполнена, пользователь сразу получает просьбу
+повторить попытку позже. Разбор xlsx выполняется в отдельных процессах.
+"""
+import os
+import logging
+import functools
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from excel_worker import read_excel_bytes
+
+logger = logging.getLogger(__name__)
+
+# Потоки для тяжелых обработчиков (работа с БД и Telegram)
+HEAVY_WORKERS = int(os.getenv('HEAVY_WORKERS', 4))
+# Процессы для разбора Excel; 0 - разбирать в потоке обработчика
+PARSE_PROCESSES = int(os.getenv('PARSE_PROCESSES', 2))
+# Сколько задач может выполняться и ждать в очереди одновременно
+MAX_PENDING_JOBS = int(os.getenv('MAX_PENDING_JOBS', 32))
+
+BUSY_TEXT = "⏳ Сейчас обрабатывается много запросов. Пожалуйста, повторите попытку через пару минут."
+FILE_ACCEPTED_TEXT = "📥 Файл принят, идёт проверка..."
+REPORT_PREPARING_TEXT = "⏳ Отчет формируется, это может занять некоторое время..."
+
+
+class WorkerPool:
+    """Ограниченный пул потоков с процессами для разбора файлов"""
+
+    def __init__(self, workers=HEAVY_WORKERS, processes=PARSE_PROCESSES, max_pending=MAX_PENDING_JOBS):
+        self.workers = workers
+        self.processes = processes
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._threads = None
+        self._process_pool = None
+
+    def start(self):
+        """Запуск процессов разбора заранее, до первой загрузки"""
+        pool = self._get_process_pool()
+        if pool is not None:
+            pool.submit(int).result()
+
+    def _get_threads(self):
+        with self._lock:
+            if self._threads is None:
+                self._threads = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='heavy')
+            return self._threads
+
+    def _get_process_pool(self):
+        if self.processes <= 0:
+            return None
+        with self._lock:
+            if self._process_pool is None:
+                # spawn не наследует блокировки потоков бота, в отличие от fork;
+                # дочерний процесс импортирует main.py как __mp_main__, поэтому
+                # запуск бота и инициализация БД в main.py выполняются только под __main__
+                self._process_pool = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._process_pool
+
+    def reserve(self):
+        """Занятие места в очереди; False, если очередь заполнена"""
+        return self._slots.acquire(blocking=False)
+
+    def release(self):
+        self._slots.release()
+
+    def run_reserved(self, func, *args, **kwargs):
+        """Запуск задачи на уже занятом месте очереди"""
+        return self._get_threads().submit(self._run, func, args, kwargs)
+
+    def submit(self, func, *args, **kwargs):
+        """Постановка задачи в очередь; None, если очередь заполнена"""
+        if not self.reserve():
+            return None
+        return self.run_reserved(func, *args, **kwargs)
+
+    def _run(self, func, args, kwargs):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"Ошибка выполнения задачи {getattr(func, '__name__', func)}: {e}")
+        finally:
+            self.release()
+
+    def parse_excel(self, data, **kwargs):
+        """Чтение Excel из байтов в отдельном процессе"""
+        pool = self._get_process_pool()
+        if pool is None:
+            return read_excel_bytes(data, kwargs)
+        try:
+            return pool.submit(read_excel_bytes, data, kwargs).result()
+        except BrokenProcessPool as e:
+            logger.error(f"Пул процессов разбора Excel недоступен, разбор в текущем потоке: {e}")
+            with self._lock:
+                if self._process_pool is pool:
+                    self._process_pool = None
+            return read_excel_bytes(data, kwargs)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            threads, processes = self._threads, self._process_pool
+            self._threads = self._process_pool = None
+        if threads is not None:
+            threads.shutdown(wait=wait)
+        if processes is not None:
+            processes.shutdown(wait=wait)
+
+
+def heavy_handler(ack_text=None):
+    """Декоратор обработчика, выполняемого в пуле
+
+    Обработчик сразу возвращает управление диспетчеру, поэтому он не
+    должен возвращать состояние ConversationHandler. Если очередь
+    заполнена, пользователь получает BUSY_TEXT.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(update, context):
+            message = update.effective_message
+            if not pool.reserve():
+                logger.warning(f"Очередь тяжелых задач заполнена, {func.__name__} отклонен")
+                if message:
+                    message.reply_text(BUSY_TEXT)
+                return None
+            if ack_text and message:
+                try:
+                    message.reply_text(ack_text)
+                except Exception as e:
+                    logger.error(f"Ошибка отправки подтверждения приема: {e}")
+            pool.run_reserved(func, update, context)
+            return None
+        return wrapper
+    return decorator
+
+
+pool = WorkerPool()
+
+
+def parse_excel(data, **kwargs):
+    return pool.parse_excel(data, **kwargs)